@@ -0,0 +1,128 @@
+"""
+Order-independent mapping of the atoms of two structures, such as a
+pristine host and a defective cell, where labels no longer correspond.
+
+Atoms are paired within each species by minimum-image position: pairs that
+are each other's nearest atom (periodic KD-tree of neighbor_search.py) are
+taken directly, and only the atoms left over are paired by an assignment
+that minimizes the sum of distances. Atoms without a partner within the
+matching distance are the defect: a removed atom (vacancy), an added atom
+(interstitial), or a removed and an added atom of different species at
+the same place (substitution).
+"""
+
+import numpy as np
+
+from displacement import minimum_image_vectors, sort_displacements
+
+# Atoms farther apart than this are not paired (angstrom)
+MATCH_DISTANCE = 1.0
+
+
+def _assign(lattice, frac1, frac2, max_distance):
+    """
+    Pairs of two small sets of atoms minimizing the sum of distances.
+
+    output:
+    (index1, index2) int arrays of the pairs within max_distance
+    """
+    from scipy.optimize import linear_sum_assignment
+    if len(frac1) == 0 or len(frac2) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    difference = (frac2[None, :, :] - frac1[:, None, :]).reshape(-1, 3)
+    distance = np.linalg.norm(minimum_image_vectors(lattice, difference), axis=1).reshape(len(frac1), -1)
+    # Pairs beyond max_distance are allowed with a prohibitive cost, then dropped
+    cost = np.where(distance <= max_distance, distance, max_distance * len(distance) + 1.0)
+    index1, index2 = linear_sum_assignment(cost)
+    keep = distance[index1, index2] <= max_distance
+    return index1[keep], index2[keep]
+
+
+def map_atoms(labeled1, labeled2, max_distance=MATCH_DISTANCE):
+    """
+    input:
+    labeled1, labeled2: LabeledStructure with equivalent lattices, with
+        any number and order of atoms
+    max_distance: largest displacement of a paired atom (angstrom)
+
+    output:
+    dict with keys
+        'index1', 'index2': int arrays of paired sites, in site order of labeled1
+        'vectors': (M,3) Cartesian displacements from labeled1 to labeled2 (angstrom)
+        'distances': (M,) displacement lengths (angstrom)
+        'substituted1', 'substituted2': sites of different species at the same
+            place (within max_distance), removed from labeled1 and added in labeled2
+        'unmatched1': other sites of labeled1 without partner (vacancies)
+        'unmatched2': other sites of labeled2 without partner (interstitials)
+    """
+    from neighbor_search import PeriodicNeighborSearch
+    if not np.allclose(labeled1.lattice, labeled2.lattice):
+        raise ValueError("Lattice vectors of two structures are not equivalent")
+    lattice = labeled1.lattice
+    index1, index2, unmatched1, unmatched2 = [], [], [], []
+    for element in dict.fromkeys(labeled1.elements + labeled2.elements):
+        sites1 = np.flatnonzero(labeled1.species == element)
+        sites2 = np.flatnonzero(labeled2.species == element)
+        if len(sites1) == 0 or len(sites2) == 0:
+            unmatched1.append(sites1)
+            unmatched2.append(sites2)
+            continue
+        frac1, frac2 = labeled1.frac_coords[sites1], labeled2.frac_coords[sites2]
+        nearest1, _, distance1 = PeriodicNeighborSearch(lattice, frac1).nearest(frac2)
+        nearest2, _, _ = PeriodicNeighborSearch(lattice, frac2).nearest(frac1)
+        # Mutual nearest atoms are paired directly
+        mutual = (nearest2[nearest1] == np.arange(len(sites2))) & (distance1 <= max_distance)
+        pair2 = np.flatnonzero(mutual)
+        pair1 = nearest1[pair2]
+        rest1 = np.setdiff1d(np.arange(len(sites1)), pair1)
+        rest2 = np.flatnonzero(~mutual)
+        more1, more2 = _assign(lattice, frac1[rest1], frac2[rest2], max_distance)
+        index1.append(sites1[np.concatenate([pair1, rest1[more1]])])
+        index2.append(sites2[np.concatenate([pair2, rest2[more2]])])
+        unmatched1.append(sites1[np.setdiff1d(rest1, rest1[more1])])
+        unmatched2.append(sites2[np.setdiff1d(rest2, rest2[more2])])
+
+    index1, index2 = np.concatenate(index1).astype(int), np.concatenate(index2).astype(int)
+    order = np.argsort(index1)
+    index1, index2 = index1[order], index2[order]
+    vectors = minimum_image_vectors(lattice, labeled2.frac_coords[index2] - labeled1.frac_coords[index1])
+
+    # Atoms left on both sides at the same place are substitutions
+    unmatched1 = np.sort(np.concatenate(unmatched1)).astype(int)
+    unmatched2 = np.sort(np.concatenate(unmatched2)).astype(int)
+    sub1, sub2 = _assign(lattice, labeled1.frac_coords[unmatched1], labeled2.frac_coords[unmatched2],
+                         max_distance)
+    return {'index1': index1, 'index2': index2, 'vectors': vectors,
+            'distances': np.sqrt(np.einsum('ij,ij->i', vectors, vectors)),
+            'substituted1': unmatched1[sub1], 'substituted2': unmatched2[sub2],
+            'unmatched1': np.setdiff1d(unmatched1, unmatched1[sub1]),
+            'unmatched2': np.setdiff1d(unmatched2, unmatched2[sub2])}
+
+
+def mapped_compare_columns(labeled1, labeled2, mapping, threshold):
+    """
+    Columns of compare_POSCAR.py for mapped atoms, as structure_server.compare_columns.
+
+    output:
+    dict of arrays, the 'compare' table of output_format.py, from the largest
+    to the smallest displacement
+    """
+    order = sort_displacements(mapping['distances'], threshold)
+    index1, index2 = mapping['index1'][order], mapping['index2'][order]
+    return {'label': labeled1.labels[index1], 'index': index1, 'label2': labeled2.labels[index2],
+            'index2': index2, 'distance': mapping['distances'][order], 'vector': mapping['vectors'][order],
+            'frac_coords': labeled1.frac_coords[index1], 'frac_coords2': labeled2.frac_coords[index2]}
+
+
+def mapped_compare_rows(labeled1, labeled2, mapping, threshold):
+    """
+    Rows of compare_POSCAR.py for mapped atoms, as structure_server.compare_rows.
+
+    output:
+    list of [label1, displacement, x1, y1, z1, x2, y2, z2, label2], from the
+    largest to the smallest displacement, with fractional coordinates
+    """
+    columns = mapped_compare_columns(labeled1, labeled2, mapping, threshold)
+    return [[label1, displ] + coords1 + coords2 + [label2] for label1, displ, coords1, coords2, label2
+            in zip(columns['label'].tolist(), columns['distance'].tolist(), columns['frac_coords'].tolist(),
+                   columns['frac_coords2'].tolist(), columns['label2'].tolist())]
@@ -0,0 +1,138 @@
+"""
+Batch comparison of one reference structure against many target structures.
+
+The reference is parsed once and shipped to each worker process of a pool,
+which parses its targets and computes displacements with displacement.py.
+Results are gathered into one table of per-atom displacements with
+per-target summary columns (max, RMS, number of atoms above threshold).
+"""
+
+import glob
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from labeled_structure import LabeledStructure
+from displacement import compute_displacements
+
+# Reference structure of each worker process, set by _init_worker
+_reference = None
+
+
+def is_poscar_name(name):
+    """True for file names of structures: .vasp suffix, or POSCAR or CONTCAR in the name"""
+    return name.endswith('.vasp') or 'POSCAR' in name or 'CONTCAR' in name
+
+
+def expand_targets(entries):
+    """
+    input:
+    entries: list of file names, directories or glob patterns
+
+    output:
+    list of file names. Directories give their (non-hidden) structure files,
+    sorted, so that manifest.csv and other files next to them are left out
+    """
+    targets = []
+    for entry in entries:
+        if os.path.isdir(entry):
+            targets.extend(sorted(os.path.join(entry, name) for name in os.listdir(entry)
+                                  if not name.startswith('.') and is_poscar_name(name)
+                                  and os.path.isfile(os.path.join(entry, name))))
+        elif glob.has_magic(entry):
+            targets.extend(sorted(glob.glob(entry)))
+        else:
+            targets.append(entry)
+    return targets
+
+
+def pool_context():
+    """
+    The scripts run at module level without a __main__ guard, so workers are
+    forked where possible instead of re-importing the calling script.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def _init_worker(reference):
+    global _reference
+    _reference = reference
+
+
+def _compare_one(target_file):
+    """Displacements of one target against the reference of this worker"""
+    try:
+        target = LabeledStructure.from_file(target_file)
+        vectors, distances, _ = compute_displacements(_reference, target)
+    except (ValueError, KeyError, OSError) as error:
+        return target_file, None, None, str(error)
+    return target_file, vectors, distances, ''
+
+
+def compare_batch(reference, target_files, threshold=0.01, workers=None):
+    """
+    input:
+    reference: LabeledStructure of the reference
+    target_files: list of structure files compared against the reference
+    threshold: displacement threshold (angstrom) for the count column
+    workers: number of worker processes. Default is the number of CPUs
+
+    output:
+    summary: dict of per-target arrays with keys
+        'target', 'max_displ', 'rms_displ', 'n_above', 'error'
+    atoms: dict of per-atom arrays of all targets with keys
+        'target', 'atom_label', 'site_index', 'element', 'dx', 'dy', 'dz',
+        'displ', 'max_displ', 'rms_displ', 'n_above'
+    """
+    num_atoms = len(reference)
+    summary = {'target': [], 'max_displ': [], 'rms_displ': [], 'n_above': [], 'error': []}
+    vector_list, distance_list = [], []
+    chunksize = max(1, len(target_files) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(),
+                             initializer=_init_worker, initargs=(reference,)) as executor:
+        for target_file, vectors, distances, error in executor.map(
+                _compare_one, target_files, chunksize=chunksize):
+            summary['target'].append(target_file)
+            summary['error'].append(error)
+            if error:
+                summary['max_displ'].append(np.nan)
+                summary['rms_displ'].append(np.nan)
+                summary['n_above'].append(-1)
+                continue
+            summary['max_displ'].append(distances.max(initial=0.0))
+            summary['rms_displ'].append(np.sqrt(np.mean(distances**2)) if num_atoms else 0.0)
+            summary['n_above'].append(int(np.count_nonzero(distances > threshold)))
+            vector_list.append(vectors)
+            distance_list.append(distances)
+    summary = {key: np.array(value) for key, value in summary.items()}
+
+    # Per-atom rows, only for targets that could be compared
+    ok = summary['error'] == ''
+    num_ok = int(np.count_nonzero(ok))
+    vectors = np.concatenate(vector_list) if vector_list else np.zeros((0, 3))
+    atoms = {'target': np.repeat(summary['target'][ok], num_atoms),
+             'atom_label': np.tile(reference.labels, num_ok),
+             'site_index': np.tile(reference.site_index, num_ok),
+             'element': np.tile(reference.species, num_ok),
+             'dx': vectors[:, 0], 'dy': vectors[:, 1], 'dz': vectors[:, 2],
+             'displ': np.concatenate(distance_list) if distance_list else np.zeros(0)}
+    for key in ['max_displ', 'rms_displ', 'n_above']:
+        atoms[key] = np.repeat(summary[key][ok], num_atoms)
+    return summary, atoms
+
+
+def write_table(filename, columns):
+    """
+    Write a dict of equal-length column arrays as CSV, or as Parquet
+    when filename ends with .parquet (requires pyarrow or fastparquet).
+    """
+    import pandas as pd
+    table = pd.DataFrame(columns)
+    if filename.endswith('.parquet'):
+        table.to_parquet(filename, index=False)
+    else:
+        table.to_csv(filename, index=False, float_format='%.6f')
@@ -0,0 +1,193 @@
+"""
+## Command:
+python benchmark.py [optional:sizes] [optional:repeat] [optional:stages] [optional:symmetry_max]
+                    [optional:out] [optional:compare]
+
+Times each stage of the scripts on supercells of the bundled SiO2 POSCAR,
+and records the peak memory of each stage.
+
+[optional:sizes]:
+    ex) sizes=100,1000
+    Approximate number of atoms of the supercells. Default is 100,1000,10000,100000
+[optional:repeat]:
+    ex) repeat=5
+    Each stage is run this many times and the fastest run is kept. Default is 3.
+    Peak memory is traced in one more run
+[optional:stages]:
+    ex) stages=parse,neighbors
+    Stages to run, out of import, parse, labeling, neighbors, perturb, symmetry,
+    compare, selective, write. Default is all
+[optional:symmetry_max]:
+    ex) symmetry_max=200000
+    Symmetry is skipped for larger supercells, where spglib takes minutes. Default is 20000
+[optional:out]:
+    ex) out=results.jsonl
+    Results are appended to this file, one JSON record per stage and size,
+    with the git commit of the tree. Default is benchmark_results.jsonl
+[optional:compare]:
+    ex) compare=3f2a1bc
+    Print the time of this run relative to the records of an earlier commit in [out]
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from poscar_io import read_poscar, write_poscar
+from neighbor_search import PeriodicNeighborSearch
+from perturbation import random_displacements
+from symmetry import get_symmetry_dataset, _memory_cache
+from displacement import compute_displacements
+from selective import radius_mask, apply_tags
+from supercell import make_supercell
+
+STAGES = ['import', 'parse', 'labeling', 'neighbors', 'perturb', 'symmetry', 'compare',
+          'selective', 'write']
+# Modules imported by the scripts, timed in a fresh interpreter
+IMPORTS = 'labeled_structure, poscar_io, neighbor_search, displacement, symmetry, selective, spglib'
+
+### Options are given as key=value
+options, _=parse_options(sys.argv, ('sizes', 'repeat', 'stages', 'symmetry_max', 'compare', 'out'))
+sizes=[int(size) for size in options.get('sizes', '100,1000,10000,100000').split(',')]
+repeat=int(options.get('repeat', 3))
+stages=options['stages'].split(',') if 'stages' in options else STAGES
+symmetry_max=int(options.get('symmetry_max', 20000))
+out_filename=options.get('out', 'benchmark_results.jsonl')
+here=os.path.dirname(os.path.abspath(__file__))
+
+try:
+    commit=subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, capture_output=True,
+                          text=True, check=True).stdout.strip()
+    if subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=here).returncode:
+        commit+='-dirty'
+except (OSError, subprocess.CalledProcessError):
+    commit='unknown'
+
+
+def measure(function):
+    """
+    Run function repeat times, then once more with memory tracing,
+    which slows it down and is therefore not timed.
+
+    output:
+    (fastest wall time in seconds, peak traced memory in MB)
+    """
+    best=np.inf
+    for _ in range(repeat):
+        start=time.perf_counter()
+        function()
+        best=min(best, time.perf_counter()-start)
+    tracemalloc.start()
+    function()
+    peak=tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+    return best, peak
+
+
+def cubic_supercell(unit, num_atoms):
+    """Cubic-ish n x n x m supercell of unit with at least num_atoms atoms"""
+    repeats=max(1, int(np.ceil((num_atoms/len(unit))**(1/3))))
+    scale=[repeats, repeats, max(1, int(np.ceil(num_atoms/len(unit)/repeats**2)))]
+    supercell, _ = make_supercell(unit, np.diag(scale))
+    supercell.comment='SiO2 supercell'
+    return supercell
+
+
+##############################################################################
+########## Run stages
+##############################################################################
+unit=read_poscar(os.path.join(here, 'POSCAR'))
+records=[]
+python=platform.python_version()
+
+print("   Atoms   | Stage      |  Time (s)  | Peak (MB)")
+print("   ────────┼────────────┼────────────┼──────────")
+if 'import' in stages:
+    def import_modules():
+        subprocess.run([sys.executable, '-c', 'import '+IMPORTS], cwd=here, check=True)
+    seconds, _ = measure(import_modules)
+    records.append({'stage': 'import', 'num_atoms': 0, 'seconds': seconds, 'peak_mb': None})
+    print("   {0:>7} | {1:<10} | {2:10.4f} |".format('-', 'import', seconds))
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    for size in sizes:
+        supercell=cubic_supercell(unit, size)
+        num_atoms=len(supercell)
+        filename=os.path.join(temp_dir, 'POSCAR_{0}'.format(num_atoms))
+        write_poscar(filename, supercell)
+        rng=np.random.default_rng(0)
+        perturbed=LabeledStructure(supercell.lattice, supercell.species,
+                                   supercell.frac_coords+rng.normal(0, 1e-3, supercell.frac_coords.shape))
+
+        def run_neighbors():
+            search=PeriodicNeighborSearch.from_labeled(supercell)
+            return search.query_sites(np.arange(min(num_atoms, 1000)), 2.5)
+
+        def run_perturb():
+            _, site_index, _, distance=PeriodicNeighborSearch.from_labeled(supercell).query_sites([0], 3.5)
+            return random_displacements(np.random.default_rng(0), distance, supercell.lattice, 100)
+
+        def run_symmetry():
+            _memory_cache.clear()
+            return get_symmetry_dataset(supercell, disk_cache=False)
+
+        def run_compare():
+            return compute_displacements(supercell, perturbed)
+
+        def run_selective():
+            return apply_tags(num_atoms, radius_mask(supercell, 0, 6.0), 'TTT', 'FFF')
+
+        functions={'parse': lambda: read_poscar(filename),
+                   'labeling': lambda: (LabeledStructure(supercell.lattice, supercell.species, supercell.frac_coords)
+                                        .indices(supercell.labels[::max(1, num_atoms//1000)])),
+                   'neighbors': run_neighbors, 'perturb': run_perturb, 'symmetry': run_symmetry,
+                   'compare': run_compare, 'selective': run_selective,
+                   'write': lambda: write_poscar(os.path.join(temp_dir, 'out.vasp'), supercell)}
+        for stage in stages:
+            if stage not in functions or (stage == 'symmetry' and num_atoms > symmetry_max):
+                continue
+            seconds, peak = measure(functions[stage])
+            records.append({'stage': stage, 'num_atoms': num_atoms, 'seconds': seconds, 'peak_mb': peak})
+            print("   {0:>7} | {1:<10} | {2:10.4f} | {3:8.1f}".format(num_atoms, stage, seconds, peak))
+
+##############################################################################
+########## Store & compare
+##############################################################################
+# Records of the earlier commit are read before this run is appended
+reference=dict()
+if 'compare' in options and os.path.isfile(out_filename):
+    with open(out_filename, 'r') as in_file:
+        for line in in_file:
+            record=json.loads(line)
+            if record['commit'].startswith(options['compare']):
+                # Latest record of each stage and size
+                reference[(record['stage'], record['num_atoms'])]=record['seconds']
+
+stamp=time.strftime('%Y-%m-%dT%H:%M:%S')
+with open(out_filename, 'a') as out_file:
+    for record in records:
+        record.update({'commit': commit, 'date': stamp, 'python': python,
+                       'numpy': np.__version__, 'host': platform.node()})
+        out_file.write(json.dumps(record)+'\n')
+print("")
+print("   Results of commit {0} were appended to {1}".format(commit, out_filename))
+
+if 'compare' in options:
+    print("")
+    print("   Atoms   | Stage      | {0:>10} | {1:>10} | Ratio".format(options['compare'][:10], commit[:10]))
+    print("   ────────┼────────────┼────────────┼────────────┼───────")
+    for record in records:
+        key=(record['stage'], record['num_atoms'])
+        if key in reference:
+            print("   {0:>7} | {1:<10} | {2:10.4f} | {3:10.4f} | {4:5.2f}"
+                  .format(record['num_atoms'] or '-', record['stage'], reference[key],
+                          record['seconds'], record['seconds']/reference[key]))
@@ -0,0 +1,31 @@
+"""
+Options of the scripts, given on the command line as key=value.
+
+Only arguments that start with a name and '=' and whose name is an option of
+the script are taken as options. Selections (selection.py) such as
+'O* and z>=0.5' or 'x==0' are kept as positional arguments.
+"""
+
+import re
+
+OPTION = re.compile(r'([A-Za-z_]\w*)=(.*)', re.DOTALL)
+
+
+def parse_options(argv, keys):
+    """
+    input:
+    argv: list of arguments, ex) sys.argv
+    keys: names of the options of the script, ex) ('r', 'n', 'seed', 'out')
+
+    output:
+    (options, arguments): dict of key -> value, and argv without the options
+    """
+    options = dict()
+    arguments = []
+    for arg in argv:
+        match = OPTION.fullmatch(arg)
+        if match is not None and match.group(1) in keys:
+            options[match.group(1)] = match.group(2)
+        else:
+            arguments.append(arg)
+    return options, arguments
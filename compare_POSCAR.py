@@ -5,7 +5,9 @@ Created on Sun Apr 18 19:52:58 2021
 @author: yongjin
 
 ## Command:
-python selective_dynamics.py [POSCAR_filename1]  [POSCAR_filename2] [optional:threshold]
+python compare_POSCAR.py [POSCAR_filename1]  [POSCAR_filename2] [optional:threshold]
+python compare_POSCAR.py [POSCAR_filename1]  [targets] [optional:threshold] [optional:out] [optional:n]
+python compare_POSCAR.py [targets] pairs=1 [optional:tol] [optional:metric] [optional:out] [optional:n]
 
 [POSCAR_filename1]: POSCAR file
 [POSCAR_filename2]: POSCAR file
@@ -13,107 +15,303 @@ python selective_dynamics.py [POSCAR_filename1]  [POSCAR_filename2] [optional:th
 [optional:threshold]: threshold of displacement to print
     ex) 't=0.01'
     ** Default value is 0.01 angstrom
+[optional:map]: pair atoms by position within each species instead of by label
+    ex) 'map=1'. Used anyway when the two files have different atoms.
+    Atoms without a partner are printed as the defect (vacancy, interstitial, substitution)
+[optional:match]: largest displacement of a paired atom in map mode
+    ex) 'match=0.5'
+    ** Default value is 1.0 angstrom
+[optional:sel]: only print the atoms of this selection of [POSCAR_filename1] (selection.py)
+    ex) 'sel=O* and within 5 of Si1'
+[optional:--format]: --format=json, --format=csv or --format=npz writes the 'compare'
+    table of output_format.py instead of printing, ex) --format=csv --output=displ.csv
+    ** Trajectory mode writes the 'trajectory' table, one row per atom of each frame.
+    Batch and pairs modes write their tables to [out] only, and stop with --format
+
+Batch mode: runs when [targets] are several files, a directory or a glob pattern
+    ** A directory gives its files ending with .vasp or with POSCAR or CONTCAR in the name
+    ex) python compare_POSCAR.py CONTCAR_neutral 'charge_*/CONTCAR' out=displ.csv
+[optional:out]: table of per-atom displacements and summary columns
+    ex) 'out=displ.csv' or 'out=displ.parquet'
+    ** Default is compare_batch.csv
+[optional:n]: number of worker processes. Default is the number of CPUs
+
+Trajectory mode: runs when [POSCAR_filename2] is an XDATCAR
+    Frames are read one at a time and compared with [POSCAR_filename1]
+    ** For variable-cell runs (ISIF=3), fractional coordinates are compared
+    and converted with the lattice of each frame, so the strain of the cell is not counted
+[optional:out]: per-atom displacements of each frame
+    ** Default is compare_trajectory.csv
+
+Pairs mode: runs with pairs=1. Every two of [targets] are compared, and the
+structures are clustered into distinct configurations
+    ex) python compare_POSCAR.py 'ENSEMBLE/*/CONTCAR' pairs=1 tol=0.05
+[optional:tol]: structures of a cluster are all within this of each other
+    ** Default is 0.1 angstrom
+[optional:metric]: 'max' (largest atomic displacement, default) or 'rms'
+[optional:out]: table of the displacements of every pair
+    ** Default is compare_pairs.csv
 """
 
+import os
 import sys
+import glob
 import numpy as np
-from pymatgen.core import Structure
-import pandas as pd
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from displacement import minimum_image_vectors
+from poscar_io import is_xdatcar, XdatcarReader, read_poscar_header
+from structure_server import query, compare_rows, compare_columns
+from output_format import output, as_arrays
+profiler.mark('import')
 
 #sys.argv=['test','72_small_void_neutral_2nd_relaxed.vasp','72_small_void_positive_2nd_relaxed.vasp','Si2','O1','r=0.01']
 #print(sys.argv[0])
 
-##############################################################################
-########## Function definition
-##############################################################################
-def create_df(pmg_struct):
-	"""
-	input:
-	pmg_struct: pymatgen structure. Structure containing organic molecule to rotate
-
-	output:
-	dataframe: Pandas DataFrame 
-		with columns=['site_index','atom_label','pmg_site','element']
-	"""
-	n_atom_count_dict=dict()
-	dataframe=pd.DataFrame(columns=['site_index','atom_label','pmg_site','element'])
-	for i in range(0,pmg_struct.num_sites):
-	    # Update label for each element
-	    if pmg_struct[i].specie in list(n_atom_count_dict.keys()):
-	        n_atom_count_dict.update({pmg_struct[i].specie:n_atom_count_dict[pmg_struct[i].specie]+1})
-	    else:
-	        n_atom_count_dict.update({pmg_struct[i].specie:1})
-	        
-	    label='{0}{1}'.format(pmg_struct.species[i], n_atom_count_dict[pmg_struct[i].specie])
-	    # Append a site to the data frame
-	    # If this part is costly, maybe using pd.concat would be faster (not sure yet)
-	    dataframe= dataframe.append({'site_index':i, \
-	                'atom_label':'{0}'.format(label), \
-	                'pmg_site':pmg_struct.sites[i],\
-	                'element':str((pmg_struct.sites[i]).specie)},ignore_index=True)
-	return dataframe
-
 ##############################################################################
 ########## Read POSCAR file 
 ##############################################################################
-if len(sys.argv) <= 2:
+### Options are given as key=value. Others are structure files
+options, file_list=parse_options(sys.argv[1:], ('t', 'sel', 'map', 'match', 'out', 'n', 'pairs', 'tol', 'metric'))
+
+pairs_mode=options.get('pairs', '0').lower() in ('1', 'true', 't', 'yes')
+if len(file_list) <= 1 and not (pairs_mode and file_list):
     print('POSCAR is not provided')
     sys.exit()
 
-# Load structure
-struct1 = Structure.from_file(sys.argv[1])
-struct2 = Structure.from_file(sys.argv[2])
 ### Threshold can be either given from user
 ### Or it would be 0.01 Ang
-threshold=None
-for i in range(len(sys.argv)):
-    if '=' in sys.argv[i]:
-        try:
-            threshold=float(sys.argv[i].split('=')[1])
-        except:
-            print("Maybe you should remove equal sign (=) from structure filenames")
-            sys.exit()
-        # Once parsed, remove from the sys.argv
-        sys.argv.remove(sys.argv[i])
-if threshold == None:
-    threshold=0.01
+try:
+    threshold=float(options.get('t', 0.01))
+    workers=int(options['n']) if 'n' in options else None
+except ValueError:
+    print("Maybe you should remove equal sign (=) from structure filenames")
+    sys.exit()
 
-# Lattice of two structures should be equivalent
-if struct1.lattice != struct2.lattice:
-    print("Lattice vectors of two POSCAR files are not equivalent")
+##############################################################################
+########## Pairs mode: every two structures, clustered
+##############################################################################
+if pairs_mode:
+    if output.format is not None:
+        print("--format is not supported in pairs mode, the table of every pair is written with out=")
+        sys.exit()
+    from batch_compare import expand_targets, write_table
+    from similarity import read_structures, pairwise_displacements, cluster_structures
+
+    target_list = expand_targets(file_list)
+    out_filename = options.get('out', 'compare_pairs.csv')
+    metric = options.get('metric', 'max')
+    tolerance = float(options.get('tol', 0.1))
+    if metric not in ('max', 'rms'):
+        print("metric should be max or rms")
+        sys.exit()
+    structures, errors = read_structures(target_list, workers)
+    target_list = [target for target in target_list if target in structures]
+    for target, error in errors.items():
+        print("   {0}: {1}".format(target, error))
+    if not target_list:
+        sys.exit()
+    profiler.mark('parse')
+    try:
+        rms, largest = pairwise_displacements([structures[target] for target in target_list], workers)
+    except (KeyError, ValueError) as error:
+        print(error.args[0])
+        sys.exit()
+    profiler.mark('compare')
+    distance = largest if metric == 'max' else rms
+    cluster, representative = cluster_structures(distance, tolerance)
+    profiler.mark('cluster')
+
+    upper = np.triu_indices(len(target_list), 1)
+    targets = np.array(target_list)
+    write_table(out_filename, {'target1': targets[upper[0]], 'target2': targets[upper[1]],
+                               'rms_displ': rms[upper], 'max_displ': largest[upper]})
+    profiler.mark('write')
+
+    width=max([len(target) for target in target_list]+[6])
+    print("   Cluster | {0:<{1}s} | Max to rep. | RMS to rep. ".format('Target', width))
+    print("   ────────┼─"+"─"*width+"─┼─────────────┼─────────────")
+    for k in range(cluster.max()+1):
+        members = np.flatnonzero(cluster == k)
+        rep = members[representative[members]][0]
+        for i in members[np.argsort(distance[rep, members], kind='stable')]:
+            print("   {0:>7} | {1:<{2}s} |   {3:8.4f}  |   {4:8.4f}   {5}"
+                  .format(k+1, target_list[i], width, largest[rep, i], rms[rep, i],
+                          '(rep.)' if i == rep else ''))
+    print("")
+    print("   {0} structures form {1} distinct configurations ({2} displacement < {3:.3f} Ang)"
+          .format(len(target_list), cluster.max()+1, metric, tolerance))
+    print("   Displacements of every pair were written as {0}".format(out_filename))
+    sys.exit()
+
+##############################################################################
+########## Batch mode: one reference against many targets
+##############################################################################
+if (len(file_list) > 2 or os.path.isdir(file_list[1]) or glob.has_magic(file_list[1])):
+    if output.format is not None:
+        print("--format is not supported in batch mode, the per-atom table is written with out=")
+        sys.exit()
+    from batch_compare import expand_targets, compare_batch, write_table
+
+    reference = LabeledStructure.from_file(file_list[0])
+    target_list = expand_targets(file_list[1:])
+    out_filename = options.get('out', 'compare_batch.csv')
+    profiler.mark('parse')
+    summary, atoms = compare_batch(reference, target_list, threshold, workers)
+    profiler.mark('compare')
+    write_table(out_filename, atoms)
+    profiler.mark('write')
+
+    width=max([len(target) for target in target_list]+[6])
+    print("   {0:<{1}s} | Max displ. | RMS displ. | # > {2:.2f} ".format('Target', width, threshold))
+    print("   "+"─"*width+"─┼────────────┼────────────┼──────────")
+    for k in np.argsort(-np.nan_to_num(summary['max_displ'], nan=-1.0), kind='stable'):
+        if summary['error'][k]:
+            print("   {0:<{1}s} | {2}".format(summary['target'][k], width, summary['error'][k]))
+            continue
+        print("   {0:<{1}s} |  {2:8.4f}  |  {3:8.4f}  | {4:>8d}"
+              .format(summary['target'][k], width, summary['max_displ'][k],
+                      summary['rms_displ'][k], summary['n_above'][k]))
+    print("")
+    print("   Per-atom displacements were written as {0}".format(out_filename))
+    sys.exit()
+
+##############################################################################
+########## Trajectory mode: reference against every frame of an XDATCAR
+##############################################################################
+if is_xdatcar(file_list[1]):
+    reference = LabeledStructure.from_file(file_list[0])
+    trajectory = XdatcarReader(file_list[1])
+    out_filename = options.get('out', 'compare_trajectory.csv')
+    if trajectory.labeled is None:
+        print("{0} has no frames yet".format(file_list[1]))
+        sys.exit()
+    # Atoms are matched by labels, which are the same in every frame
+    try:
+        index2 = trajectory.labeled.indices(reference.labels)
+    except KeyError as error:
+        print(error.args[0])
+        sys.exit()
+    profiler.mark('parse')
+
+    # Frames go to the 'trajectory' table of output_format.py instead of the printed summary and out
+    if output.format is None:
+        print("   Step  | Max displ. | Atom  | RMS displ. | # > {0:.2f} ".format(threshold))
+        print("   ──────┼────────────┼───────┼────────────┼──────────")
+        out_file = open(out_filename, 'w')
+        out_file.write("step,atom_label,dx,dy,dz,displ\n")
+    frame_table = np.zeros(len(reference), dtype=[('step', int), ('atom_label', reference.labels.dtype),
+                                                  ('dx', float), ('dy', float), ('dz', float),
+                                                  ('displ', float)])
+    frame_table['atom_label'] = reference.labels
+    # One frame at a time: memory does not grow with the trajectory length
+    variable_cell = False
+    for step, lattice, frac_coords in trajectory.frames():
+        # Variable-cell runs (ISIF=3): the reference is taken in the cell of each frame,
+        # so the displacements do not include the homogeneous strain of the cell
+        if not variable_cell and not np.allclose(lattice, reference.lattice, atol=1e-6):
+            variable_cell = True
+            if output.format is None:
+                print("   {0:>5} | Lattice differs from {1}: displacements use the lattice of each frame"
+                      .format(step, file_list[0]))
+        vectors = minimum_image_vectors(lattice, frac_coords[index2] - reference.frac_coords)
+        distances = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+        if output.format is not None:
+            output.write('trajectory', {'step': np.full(len(reference), step),
+                                        'label': reference.labels,
+                                        'index': np.arange(len(reference)),
+                                        'label2': trajectory.labeled.labels[index2],
+                                        'index2': index2,
+                                        'distance': distances,
+                                        'vector': vectors,
+                                        'frac_coords': reference.frac_coords,
+                                        'frac_coords2': frac_coords[index2]})
+            continue
+        frame_table['step'] = step
+        frame_table['dx'], frame_table['dy'], frame_table['dz'] = vectors.T
+        frame_table['displ'] = distances
+        np.savetxt(out_file, frame_table, fmt=['%d', '%s', '%.6f', '%.6f', '%.6f', '%.6f'],
+                   delimiter=',')
+        k = np.argmax(distances)
+        print("   {0:>5} |  {1:8.4f}  | {2:<5} |  {3:8.4f}  | {4:>8d}"
+              .format(step, distances[k], reference.labels[k],
+                      np.sqrt(np.mean(distances**2)), np.count_nonzero(distances > threshold)))
+    profiler.mark('compare')
+    if output.format is not None:
+        sys.exit()
+    out_file.close()
+    print("")
+    print("   Per-atom displacements of each frame were written as {0}".format(out_filename))
     sys.exit()
 
 ##############################################################################
 ########## Data analysis
 ##############################################################################
 
-# Create DataFrame
-df=create_df(struct1)
-df1=create_df(struct1)
-df2=create_df(struct2)
-
-# Make displacement data
-full_atom_list=list(df1['atom_label'])
-displacement_list=[]
-for atom_label in full_atom_list:
-    A1_st1=df1[df1['atom_label']==atom_label]['pmg_site'].iloc[0]
-    A1_st2=df2[df2['atom_label']==atom_label]['pmg_site'].iloc[0]
-    displacement_list.append(A1_st1.distance(A1_st2))
-    
-# Insert Displ column
-df.insert(2, "Displ", displacement_list, True)
-# sort
-df=df.sort_values(by=['Displ'],ascending=False)
-# cut by threshold
-df=df[df['Displ']>threshold]
+def composition(filename):
+    """Elements and their numbers from the header of a POSCAR, or None for other formats"""
+    try:
+        with open(filename, 'r') as file:
+            header=read_poscar_header(file)
+    except (OSError, ValueError, IndexError):
+        return None
+    return sorted(zip(header['species'], header['counts']))
+
+# Atoms are matched by their labels, unless the two files have different atoms
+# (ex. pristine host and defective cell) or map=1 is given
+map_mode=(options.get('map', '0').lower() in ('1', 'true', 't', 'yes')
+          or composition(file_list[0]) != composition(file_list[1]))
+
+# Displacements of all atoms at once, matched and sorted.
+# Answered by the structure server if one is running (structure_server.py)
+# Lattice of two structures should be equivalent
+try:
+    # Columns of arrays are asked instead of rows for machine-readable output (output_format.py)
+    rows=None if map_mode else query({'op': 'compare', 'file1': file_list[0], 'file2': file_list[1],
+                                      'threshold': threshold, 'selection': options.get('sel'),
+                                      'columns': output.format is not None})
+    if rows is None:
+        labeled1=LabeledStructure.from_file(file_list[0])
+        labeled2=LabeledStructure.from_file(file_list[1])
+        profiler.mark('parse')
+        if map_mode:
+            from atom_mapping import map_atoms, mapped_compare_rows, mapped_compare_columns, MATCH_DISTANCE
+            mapping=map_atoms(labeled1, labeled2, float(options.get('match', MATCH_DISTANCE)))
+            if output.format is None:
+                rows=mapped_compare_rows(labeled1, labeled2, mapping, threshold)
+            else:
+                rows=mapped_compare_columns(labeled1, labeled2, mapping, threshold)
+            if 'sel' in options:
+                from selection import select
+                selected=select(labeled1, options['sel'])
+                if output.format is None:
+                    selected=set(labeled1.labels[selected].tolist())
+                    rows=[row for row in rows if row[0] in selected]
+                else:
+                    rows={name: column[selected[rows['index']]] for name, column in rows.items()}
+        else:
+            rows=(compare_rows if output.format is None else compare_columns)(labeled1, labeled2, threshold,
+                                                                              options.get('sel'))
+    elif output.format is not None:
+        rows=as_arrays('compare', rows)
+    profiler.mark('compare')
+except (KeyError, ValueError) as error:
+    print(error.args[0])
+    sys.exit()
+
+if output.format is not None:
+    output.write('compare', rows)
+    profiler.mark('write')
+    sys.exit()
 
 ##############################################################################
 ########## Printing
 ##############################################################################
 
 ### Filename treatment
-filename1=sys.argv[1]
-filename2=sys.argv[2]
+filename1=file_list[0]
+filename2=file_list[1]
 # Align with respect to longer filename
 filename1=str(filename1).ljust(max(len(filename1),len(filename2)))
 filename2=str(filename2).ljust(max(len(filename1),len(filename2)))
@@ -130,18 +328,31 @@ for i in range(Q):
           .format(filename1[i*namespace:(i+1)*namespace],filename2[i*namespace:(i+1)*namespace]))
 print('              | Thres.= {0:.2f} | {1:<24s} | {2:<24s} |'
           .format(threshold,filename1[Q*namespace:],filename2[Q*namespace:]))
-print("   Atom label | Displ. (Ang) |     x       y       z    |     x       y       z    |")
-print("   ───────────┼──────────────┼──────────────────────────┼──────────────────────────┤")
+print("   Atom label | Displ. (Ang) |     x       y       z    |     x       y       z    |"
+      + (" Atom 2" if map_mode else ""))
+print("   ───────────┼──────────────┼──────────────────────────┼──────────────────────────┤"
+      + ("───────" if map_mode else ""))
 
 
 ### Printing items
-for atom_label in list(df['atom_label']):
-    # Calculate displacement. This is always positive
-    disp=df[df['atom_label']==atom_label]['Displ'].iloc[0]
-    A1_st1=df1[df1['atom_label']==atom_label]['pmg_site'].iloc[0]
-    A1_st2=df2[df2['atom_label']==atom_label]['pmg_site'].iloc[0]
-    coord1=A1_st1.frac_coords
-    coord2=A1_st2.frac_coords
+for atom_label, disp, x1, y1, z1, x2, y2, z2, *atom_label2 in rows:
     print("        {0:>5} |  {1:8.4f}    ".format(atom_label,disp) +
-          "| {0: 5.4f} {1: 5.4f} {2: 5.4f}  ".format(coord1[0],coord1[1],coord1[2]) + 
-          "| {0: 5.4f} {1: 5.4f} {2: 5.4f}  |".format(coord2[0],coord2[1],coord2[2]))
+          "| {0: 5.4f} {1: 5.4f} {2: 5.4f}  ".format(x1,y1,z1) +
+          "| {0: 5.4f} {1: 5.4f} {2: 5.4f}  |".format(x2,y2,z2) +
+          "".join(" {0:>5}".format(label) for label in atom_label2))
+
+### Atoms without partner are the defect
+if map_mode:
+    print("")
+    print("   Matched {0} atoms of {1} and {2} atoms of {3}".format(
+        len(mapping['index1']), len(labeled1), len(mapping['index2']), len(labeled2)))
+    for i in mapping['unmatched1']:
+        print("   Vacancy      | {0:>5}          |  {1: 5.4f} {2: 5.4f} {3: 5.4f}"
+              .format(labeled1.labels[i], *labeled1.frac_coords[i]))
+    for i in mapping['unmatched2']:
+        print("   Interstitial |          {0:>5} |  {1: 5.4f} {2: 5.4f} {3: 5.4f}"
+              .format(labeled2.labels[i], *labeled2.frac_coords[i]))
+    for i, j in zip(mapping['substituted1'], mapping['substituted2']):
+        print("   Substitution | {0:>5} -> {1:<5} |  {2: 5.4f} {3: 5.4f} {4: 5.4f}"
+              .format(labeled1.labels[i], labeled2.labels[j], *labeled2.frac_coords[j]))
+profiler.mark('print')
@@ -1,15 +1,24 @@
 """
 ## Command:
-python selective_dynamics.py [POSCAR_filename] [optional:atom labels to get line_number]
+python coordinate.py [POSCAR_filename] [optional:atom labels to get line_number]
 
 [POSCAR_filename]:
     POSCAR file that the user want to get coordinates
 [optional:atom labels to get coordinates]:
     follows VESTA-like labels. Separated by spaces
     ex) Si1 Si2 Si47 O28
+    ** any selection of selection.py works, quoted as one argument
+    ex) 'O* and z>0.7', Si10-Si20, 'within 3 of Si1'
+[optional:--format]:
+    --format=json, --format=csv or --format=npz writes the 'coordinates' table
+    of output_format.py instead of printing, ex) --format=npz --output=coords.npz
 """
 import sys
-import numpy as np
+from profiling import profiler
+from poscar_io import read_poscar, read_poscar_header
+from structure_server import query, coordinate_rows, coordinate_columns
+from output_format import output, as_arrays
+profiler.mark('import')
 
 #sys.argv=['test','POSCAR','Si1', 'O1']
 
@@ -20,35 +29,6 @@ if len(sys.argv) == 1:
     print('POSCAR is not provided')
     sys.exit()
 
-struct_file=open(sys.argv[1],'r')
-lines=struct_file.readlines()
-
-#### Calculate index, including header 
-num_atom_dict=dict()
-element_list=lines[5].split()
-for i in range(len(element_list)):
-    num_atom_dict[element_list[i]]=int((lines[6].split())[i])
-
-# 8th line starts with s or S --> selective dynamics
-if lines[7][0]=='s' or lines[7][0]=='S':
-    # the vasp file is already tagged with 'selective dynamics'
-    flag_selective=1
-else:
-    # the vasp file is pristine. Should add 'Selective dynamics'
-    flag_selective=0
-
-#### INDEXING INDIVIDUAL ATOMS #####
-### Si1 --> 9, Si2 -->10, etc for non-selective dynamics POSCAR
-### Si1 --> 10, Si2 -->11, etc for selective dynamics POSCAR
-index_dict=dict()
-# index_counter to read/write in sequence from original vasp
-index_counter = 8 + flag_selective
-for i, element in enumerate(element_list):
-    for j in range(num_atom_dict[element]):
-        label_name=element+str(j+1)      
-        index_dict[label_name] = index_counter
-        index_counter += 1
-
 ##############################################################################
 ########## Ask user for tag and atoms to apply
 ##############################################################################
@@ -82,13 +62,33 @@ if len(atom_list)==0:
 #     print("   {0:>10} | {1: 5.4f} {2: 5.4f} {3: 5.4f} ".format(atom_label,temp_array[0],temp_array[1],temp_array[2]))
 
 
+# Answered by the structure server if one is running (structure_server.py)
+# Columns of arrays are asked instead of rows for machine-readable output (output_format.py)
+try:
+    rows=query({'op': 'coordinates', 'file': sys.argv[1], 'labels': atom_list,
+                'columns': output.format is not None})
+    if rows is None:
+        labeled=read_poscar(sys.argv[1])
+        with open(sys.argv[1],'r') as struct_file:
+            first_coord_line=read_poscar_header(struct_file)['first_coord_line']
+        profiler.mark('parse')
+        rows=(coordinate_rows if output.format is None else coordinate_columns)(labeled, first_coord_line,
+                                                                                atom_list)
+    elif output.format is not None:
+        rows=as_arrays('coordinates', rows)
+    profiler.mark('labeling')
+except (KeyError, ValueError) as error:
+    print(error.args[0])
+    sys.exit()
+
+if output.format is not None:
+    output.write('coordinates', rows)
+    profiler.mark('write')
+    sys.exit()
+
 print("   Atom label | Line # |     x       y       z   ")
 print("   ───────────┼────────┼─────────────────────────")
-# list of (3,) numpy arrays
-for atom_label in atom_list:
-    temp_list = lines[index_dict[atom_label]].split()
-    #coordinate_list.append(np.array([float(i) for i in temp_list]))
-    temp_array=np.array([float(i) for i in temp_list[0:3]])
-    print("   {0:>10} | {1:>5}  ".format(atom_label,index_dict[atom_label]+1) + # Line number is index +1
-          "| {0: 5.4f} {1: 5.4f} {2: 5.4f} ".format(temp_array[0],temp_array[1],temp_array[2]))
-
+for atom_label, line_number, x, y, z in rows:
+    print("   {0:>10} | {1:>5}  ".format(atom_label,line_number) +
+          "| {0: 5.4f} {1: 5.4f} {2: 5.4f} ".format(x,y,z))
+profiler.mark('print')
@@ -1,109 +1,134 @@
 """
 ## Command:
-python selective_dynamics.py [input_filename] [output_filename:optional]
-
+python defect_creation.py [POSCAR_filename] [optional:vac] [optional:sub] [optional:antisite]
+                          [optional:supercell] [optional:out] [optional:n] [optional:symprec]
+
+[POSCAR_filename]:
+    POSCAR file of the host structure
+[optional:vac]:
+    ex) vac=O or vac=Si,O
+    Elements to make vacancies of. Default is every element, vac=none for no vacancy
+[optional:sub]:
+    ex) sub=Si:Ge,O:N or sub=Si:Ge:C
+    Substitutions, as host element followed by the new elements
+[optional:antisite]:
+    ex) antisite=1
+    Also put every other host element on each site
+[optional:supercell]:
+    ex) supercell=3 or supercell=3,3,2 or supercell=2,1,0,-1,1,0,0,0,1
+    Make the defects in a supercell of [POSCAR_filename], given as n for n x n x n,
+    a diagonal, or the nine integers of the transformation matrix (rows)
+[optional:out]:
+    ex) out=DEFECTS
+    Output directory. Default is [POSCAR_filename]_DEFECTS
+[optional:n]:
+    ex) n=8
+    Number of worker processes writing POSCARs. Default is the number of CPUs
+[optional:symprec]:
+    ex) symprec=1e-3
+    Tolerance of the symmetry analysis. Default is 1e-2
+
+Equivalent sites are grouped by their Wyckoff orbit, and one POSCAR is
+written per symmetry-distinct defect, ex) vac_O1.vasp, sub_Ge_on_Si1.vasp,
+as_O_on_Si1.vasp. manifest.csv in the output directory lists the site,
+Wyckoff letter, multiplicity and equivalent sites of each defect.
+With supercell=, the symmetry of [POSCAR_filename] is carried over to the
+supercell, and the labels are those of the supercell, as written by VESTA.
+If the matrix breaks the point symmetry of the lattice, the supercell
+itself is analyzed instead.
 """
-import sys
-import numpy as np
-
-### temporary_line
-sys.argv=[None,'SelDy_TTT_All.vasp']
 
-##############################################################################
-########## Read POSCAR file and indexing each line with atom label
-##############################################################################
-struct_file=open(sys.argv[1],'r')
-lines=struct_file.readlines()
-
-#### Calculate index, including header 
-num_atom_dict=dict()
-element_list=lines[5].split()
-for i in range(len(element_list)):
-    num_atom_dict[element_list[i]]=int((lines[6].split())[i])
-
-if lines[7][0]=='s' or lines[7][0]=='S':
-    # the vasp file is already tagged with 'selective dynamics'
-    flag_selective=1
+import os
+import sys
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from symmetry import get_symmetry_dataset
+from defects import enumerate_defects, write_defects
+from supercell import parse_matrix, make_supercell, keeps_symmetry, supercell_dataset
+profiler.mark('import')
+
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('vac', 'sub', 'antisite', 'supercell', 'symprec', 'out', 'n'))
+
+if len(sys.argv) == 1:
+    print('POSCAR is not provided')
+    sys.exit()
+
+if 'vac' not in options:
+    vacancies=None
+elif options['vac'].lower() == 'none':
+    vacancies=[]
 else:
-    # the vasp file is pristine. Should add 'Selective dynamics'
-    flag_selective=0
-
-#### INDEXING INDIVIDUAL ATOMS #####
-### Si1 --> 9, Si2 -->10, etc
-index_dict=dict()
-# index_counter to read/write in sequence from original vasp
-index_counter = 8 + flag_selective
-for i, element in enumerate(element_list):
-    for j in range(num_atom_dict[element]):
-        label_name=element+str(j+1)      
-        index_dict[label_name] = index_counter
-        index_counter += 1
-
-##############################################################################
-########## Ask user for tag and atoms to apply
-##############################################################################
-print('Which tag do you want to apply for selective dynamics?')
-print('ex) TTT, FFF, FFT')
-SD_tag=input()
-defect_input=input()
-
-print('For which atoms do you want to apply this tag?')
-print("Separate with spaces: ex) 'Si1 Si2 O1 O3'")
-print("For all atoms, write 'All' ")
-atom_input=input()
-
-if atom_input == 'All':
-    apply_atom_list = [atom_input]
-    apply_index_list = []
+    vacancies=options['vac'].split(',')
+
+# sub=Si:Ge,O:N --> {'Si': ['Ge'], 'O': ['N']}
+substitutions=dict()
+for entry in options.get('sub', '').split(','):
+    if entry:
+        host, *new_elements = entry.split(':')
+        substitutions.setdefault(host, []).extend(new_elements)
+
+antisites=options.get('antisite', '0').lower() in ('1', 'true', 't', 'yes')
+workers=int(options['n']) if 'n' in options else None
+symprec=float(options.get('symprec', 1e-2))
+try:
+    matrix=parse_matrix(options['supercell']) if 'supercell' in options else None
+except ValueError as error:
+    print(error.args[0])
+    sys.exit()
+
+if sys.argv[1][-5::]=='.vasp':
+    out_dir=options.get('out', sys.argv[1][:-5]+'_DEFECTS')
 else:
-    apply_atom_list=atom_input.split()
-    apply_index_list=[index_dict[i] for i in apply_atom_list]
-
-
-
-
-
-
-
+    out_dir=options.get('out', sys.argv[1]+'_DEFECTS')
 
 ##############################################################################
-########## Write output POSCAR file
+########## Read host & group equivalent sites
 ##############################################################################
-if len(sys.argv) >= 3:
-    out_filename=sys.argv[2]
-else:
-    out_filename='SelDy'+'_'+SD_tag+'_'+"_".join('%s' % entry for entry in apply_atom_list)+'.vasp'
-out_file=open(out_filename,'w')
-
-# Write header + lattice part
-# Header is up to 7th line if 'selective dynamics' is not stated
-# up to 8th if 'selective dynamics' is already stated
-for i in range(0,8+flag_selective):
-    out_file.write(lines[i])
-
-# state 'selective dynamics' if not already stated
-if flag_selective == 0:
-    out_file.write("Selective dynamics \n")
-    
-for i in range(8+flag_selective,max(index_dict.values())):
-    for j in (lines[i].split())[0:3]:
-            out_file.write('  '+j)
-            
-    #out_file.write('  ')
-    if i in apply_index_list or atom_input=='All' or atom_input=='all':
-        # for j in (lines[i].split)[0:3]:
-        #     out_file.write('  '+j)
-        out_file.write('   {0}   {1}   {2}'.format(SD_tag[0],SD_tag[1],SD_tag[2]))
-    elif flag_selective == 1:
-        tag_list=lines[i].split()[3:6]
-        out_file.write('   {0}   {1}   {2}'.format(tag_list[0],tag_list[1],tag_list[2]))
+labeled = LabeledStructure.from_file(sys.argv[1])
+profiler.mark('parse')
+dataset = get_symmetry_dataset(labeled, symprec=symprec, angle_tolerance=0.1)
+profiler.mark('symmetry')
+
+if matrix is not None:
+    labeled, primitive_index = make_supercell(labeled, matrix)
+    if keeps_symmetry(matrix, dataset['rotations']):
+        dataset = supercell_dataset(dataset, primitive_index)
     else:
-        # Default is to be TTT
-        out_file.write('   T   T   T')
-    out_file.write('\n') # end of line
-# end of file
-out_file.close()
+        dataset = get_symmetry_dataset(labeled, symprec=symprec, angle_tolerance=0.1)
+    profiler.mark('supercell')
 
+for element in list(substitutions) + (vacancies or []):
+    if element not in labeled.elements:
+        print('{0} is not in the host structure'.format(element))
+        sys.exit()
 
-print("Following POSCAR is written: {0}".format(out_filename))
+defects = enumerate_defects(labeled, dataset, vacancies=vacancies,
+                            substitutions=substitutions, antisites=antisites)
 
+##############################################################################
+########## Write POSCARs & manifest
+##############################################################################
+profiler.mark('labeling')
+filenames = write_defects(labeled, defects, out_dir, workers=workers, source=sys.argv[1])
+
+with open(os.path.join(out_dir,'manifest.csv'),'w') as manifest:
+    manifest.write("name,type,site_label,element,new_element,wyckoff,multiplicity,equivalent_labels,filename\n")
+    for defect, filename in zip(defects, filenames):
+        manifest.write("{0},{1},{2},{3},{4},{5},{6},{7},{8}\n".format(
+            defect['name'], defect['kind'], defect['site_label'], defect['element'],
+            defect['new_element'], defect['wyckoff'], defect['multiplicity'],
+            defect['equivalent_labels'], os.path.basename(filename)))
+
+print("   Host: {0}, space group {1} ({2})".format(sys.argv[1], dataset['international'], dataset['number']))
+if matrix is not None:
+    print("   Supercell: {0} ({1} atoms)".format(' '.join(str(row) for row in matrix.tolist()), len(labeled)))
+print("   Defect name         | Wyckoff | Multiplicity ")
+print("   ────────────────────┼─────────┼──────────────")
+for defect in defects:
+    print("   {0:<20}|   {1:^5} |  {2:>5}".format(defect['name'], defect['wyckoff'], defect['multiplicity']))
+
+print("")
+print('  {0} symmetry-distinct defects and manifest.csv were written in {1}'.format(len(defects), out_dir))
+profiler.mark('write')
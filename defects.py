@@ -0,0 +1,127 @@
+"""
+Enumeration of symmetry-inequivalent point defects of a host structure.
+
+Sites are grouped into orbits by the equivalent_atoms of the symmetry
+dataset (symmetry.py), and one vacancy, substitution or antisite is
+created per orbit, with the orbit size as its multiplicity.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from labeled_structure import LabeledStructure
+from poscar_io import write_poscar
+from batch_compare import pool_context
+
+# Host structure of each worker process, set by _init_worker
+_host = None
+
+
+def enumerate_defects(labeled, dataset, vacancies=None, substitutions=None, antisites=False):
+    """
+    input:
+    labeled: LabeledStructure of the host
+    dataset: symmetry dataset of the host, from symmetry.get_symmetry_dataset
+    vacancies: elements to remove, ex) ['O']. Default is every element, [] for none
+    substitutions: dict of host element -> list of new elements, ex) {'Si': ['Ge', 'C']}
+    antisites: if True, put every other host element on each site
+
+    output:
+    list of dict, one per inequivalent defect, with keys
+        'name': ex) 'vac_O1', 'sub_Ge_on_Si1', 'as_O_on_Si1'
+        'kind': 'vacancy', 'substitution' or 'antisite'
+        'site_index': representative site of the orbit
+        'site_label': label of the representative site
+        'element': host element of the site
+        'new_element': element put on the site ('' for vacancy)
+        'wyckoff': Wyckoff letter of the site
+        'multiplicity': number of equivalent sites in the host
+        'equivalent_labels': labels of all equivalent sites
+    """
+    equivalent_atoms = np.asarray(dataset['equivalent_atoms'])
+    representatives, multiplicity = np.unique(equivalent_atoms, return_counts=True)
+    # Orbits in site order of the host
+    order = np.argsort(representatives)
+    elements = labeled.elements
+    vacancies = elements if vacancies is None else vacancies
+    substitutions = substitutions or {}
+
+    defects = []
+    for rep, mult in zip(representatives[order], multiplicity[order]):
+        element = str(labeled.species[rep])
+        site = {'site_index': int(rep), 'site_label': labeled.label(rep), 'element': element,
+                'wyckoff': dataset['wyckoffs'][rep], 'multiplicity': int(mult),
+                'equivalent_labels': ' '.join(labeled.labels[equivalent_atoms == rep])}
+        if element in vacancies:
+            defects.append(dict(site, name='vac_{0}'.format(site['site_label']),
+                                kind='vacancy', new_element=''))
+        for new_element in substitutions.get(element, []):
+            defects.append(dict(site, name='sub_{0}_on_{1}'.format(new_element, site['site_label']),
+                                kind='substitution', new_element=new_element))
+        if antisites:
+            for new_element in elements:
+                if new_element != element:
+                    defects.append(dict(site, name='as_{0}_on_{1}'.format(new_element, site['site_label']),
+                                        kind='antisite', new_element=new_element))
+    return defects
+
+
+def create_defect(labeled, site_index, new_element=''):
+    """
+    input:
+    labeled: LabeledStructure of the host
+    site_index: site to remove or replace
+    new_element: element put on the site. '' makes a vacancy
+
+    output:
+    LabeledStructure of the defective structure. The host atoms keep their
+    order, and a substituted atom is moved to the end. Labels are counted
+    again, so atoms of the element that loses the site and come after it are
+    numbered one less, ex) Si3 becomes Si2 when Si2 is removed; atoms of the
+    other elements keep their labels. Pair atoms by position
+    (atom_mapping.py) to compare with the host
+    """
+    keep = np.ones(len(labeled), dtype=bool)
+    keep[site_index] = False
+    species = labeled.species[keep]
+    frac_coords = labeled.frac_coords[keep]
+    if new_element:
+        species = np.append(species, new_element)
+        frac_coords = np.vstack([frac_coords, labeled.frac_coords[site_index]])
+    return LabeledStructure(labeled.lattice, species, frac_coords)
+
+
+def _init_worker(host):
+    global _host
+    _host = host
+
+
+def _write_one(task):
+    """Create and write one defect of the host of this worker"""
+    filename, site_index, new_element, comment = task
+    write_poscar(filename, create_defect(_host, site_index, new_element), comment=comment)
+    return filename
+
+
+def write_defects(labeled, defects, out_dir, workers=None, source=''):
+    """
+    Write one POSCAR per defect in out_dir, in parallel, and return the file names.
+
+    input:
+    labeled: LabeledStructure of the host
+    defects: list of dict from enumerate_defects
+    out_dir: output directory
+    workers: number of worker processes. Default is the number of CPUs
+    source: name of the host file, written in the comment line
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(os.path.join(out_dir, defect['name'] + '.vasp'), defect['site_index'],
+              defect['new_element'], '{0} from {1} (multiplicity {2})'
+              .format(defect['name'], source, defect['multiplicity']))
+             for defect in defects]
+    chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(),
+                             initializer=_init_worker, initargs=(labeled,)) as executor:
+        return list(executor.map(_write_one, tasks, chunksize=chunksize))
@@ -0,0 +1,113 @@
+"""
+Minimum-image displacements between structures sharing one lattice.
+
+All atoms are handled in one numpy operation on the fractional coordinate
+arrays of LabeledStructure, instead of one Site.distance call per label.
+"""
+
+import numpy as np
+
+# 27 lattice translations checked for the shortest image in skewed cells
+IMAGE_SHIFTS = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'),
+                        axis=-1).reshape(-1, 3)
+
+# Rows handled at once, to bound the (rows, 27, 3) candidate array
+CHUNK_SIZE = 65536
+
+
+def minimum_image_vectors(lattice, frac_difference):
+    """
+    input:
+    lattice: (3,3) array, lattice vectors in rows (angstrom)
+    frac_difference: (N,3) array of fractional coordinate differences
+
+    output:
+    vectors: (N,3) array, shortest Cartesian vectors among periodic images (angstrom)
+    """
+    lattice = np.asarray(lattice, dtype=float)
+    frac_difference = np.asarray(frac_difference, dtype=float).reshape(-1, 3)
+    # Wrap into [-0.5, 0.5), which is the answer for cells that are not too skewed
+    frac_difference = frac_difference - np.round(frac_difference)
+    vectors = frac_difference @ lattice
+    # Any other image is at least (shortest lattice vector - |v|) long, and the shortest
+    # lattice vector is at least the smallest interplanar spacing, so vectors shorter
+    # than half of it are already the shortest. Only the others are searched
+    spacing = 1 / np.linalg.norm(np.linalg.inv(lattice), axis=0).max()
+    search = np.flatnonzero(np.einsum('ij,ij->i', vectors, vectors) > (spacing / 2)**2)
+    for start in range(0, len(search), CHUNK_SIZE):
+        index = search[start:start + CHUNK_SIZE]
+        candidates = (frac_difference[index][:, None, :] + IMAGE_SHIFTS) @ lattice
+        shortest = np.argmin(np.einsum('ijk,ijk->ij', candidates, candidates), axis=1)
+        vectors[index] = candidates[np.arange(len(index)), shortest]
+    return vectors
+
+
+def compute_displacements(labeled1, labeled2):
+    """
+    Displacement of every atom from labeled1 to labeled2, matched by atom label.
+
+    input:
+    labeled1, labeled2: LabeledStructure with equivalent lattices
+
+    output:
+    vectors: (N,3) array of Cartesian displacement vectors (angstrom),
+        in the site order of labeled1
+    distances: (N,) array of displacement lengths (angstrom)
+    index2: (N,) int array, site index in labeled2 of each atom of labeled1
+    """
+    if not np.allclose(labeled1.lattice, labeled2.lattice):
+        raise ValueError("Lattice vectors of two structures are not equivalent")
+    if np.array_equal(labeled1.labels, labeled2.labels):
+        index2 = labeled1.site_index
+    else:
+        index2 = labeled2.indices(labeled1.labels)
+    vectors = minimum_image_vectors(labeled1.lattice,
+                                    labeled2.frac_coords[index2] - labeled1.frac_coords)
+    distances = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+    return vectors, distances, index2
+
+
+def sort_displacements(distances, threshold):
+    """
+    input:
+    distances: (N,) array of displacement lengths
+    threshold: only displacements larger than this are kept (angstrom)
+
+    output:
+    order: int array of site indices, from the largest to the smallest displacement
+    """
+    order = np.argsort(-distances, kind='stable')
+    return order[distances[order] > threshold]
+
+
+class DisplacementTracker:
+    """
+    Running displacements of the atoms of a relaxation, updated one ionic
+    step at a time. Each update is one minimum-image pass over the new
+    frame, so following a trajectory costs the same for every step.
+
+    attributes:
+    initial: (N,3) fractional coordinates of the first frame
+    previous: (N,3) fractional coordinates of the last frame
+    from_initial: (N,) displacement of each atom from the first frame (angstrom)
+    from_previous: (N,) displacement of each atom in the last step (angstrom)
+    num_updates: number of frames after the first
+    """
+
+    def __init__(self, frac_coords):
+        self.initial = np.array(frac_coords, dtype=float)
+        self.previous = self.initial
+        self.from_initial = np.zeros(len(self.initial))
+        self.from_previous = np.zeros(len(self.initial))
+        self.num_updates = 0
+
+    def update(self, lattice, frac_coords):
+        """Add the frame of the next ionic step, with the lattice of that step"""
+        frac_coords = np.asarray(frac_coords, dtype=float)
+        # One pass for both displacements
+        vectors = minimum_image_vectors(lattice, np.concatenate([frac_coords - self.initial,
+                                                                 frac_coords - self.previous]))
+        distances = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+        self.from_initial, self.from_previous = np.split(distances, 2)
+        self.previous = frac_coords
+        self.num_updates += 1
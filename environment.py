@@ -0,0 +1,191 @@
+"""
+Local-environment fingerprints of all atoms, and the defect they point to.
+
+Every atom is described by its coordination number toward each element
+and by its bond-length signature, the sorted distances of its nearest
+neighbors. Both come from one neighbor query of all atoms together
+(neighbor_search.py). Atoms are then scored against a reference: the same
+atom in the pristine host, paired by atom_mapping.py, or, without a host,
+the typical atom of the same element in the structure itself. The atoms
+with the largest scores surround the defect.
+
+Bonds are neighbors closer than BOND_FACTOR times the typical nearest-
+neighbor distance of the element of the atom, so no table of radii is
+needed.
+"""
+
+import numpy as np
+
+from displacement import minimum_image_vectors
+
+# Neighbors closer than this times the typical nearest-neighbor distance are bonded
+BOND_FACTOR = 1.25
+# Number of neighbor distances in the bond-length signature
+SIGNATURE_SIZE = 8
+# Change of the signature (angstrom) that scores as much as one missing bond
+SIGNATURE_SCALE = 0.1
+# Without a host, atoms of an element rarer than this fraction are impurities
+RARE_FRACTION = 0.01
+
+
+def fingerprints(labeled, elements=None, bond_lengths=None, bond_factor=BOND_FACTOR,
+                 signature_size=SIGNATURE_SIZE):
+    """
+    input:
+    labeled: LabeledStructure
+    elements: columns of the coordination numbers. Default is the elements of labeled
+    bond_lengths: dict of element -> typical nearest-neighbor distance (angstrom).
+        Missing elements get the median over their atoms in labeled; pass
+        those of the host to compare a defective cell with it
+    bond_factor: bonds are shorter than bond_factor times the typical
+        nearest-neighbor distance of the element of the atom
+    signature_size: number of neighbor distances in the signature
+
+    output:
+    dict with keys
+        'elements': list of elements, the columns of 'coordination'
+        'coordination': (N,E) int array, number of bonds to each element
+        'signature': (N,K) array of the K nearest neighbor distances, nan if
+            fewer neighbors were found (angstrom)
+        'mean_bond': (N,) mean bond length, nan without bonds (angstrom)
+        'bond_lengths': dict of element -> typical nearest-neighbor distance
+    """
+    from neighbor_search import PeriodicNeighborSearch
+    num_atoms = len(labeled)
+    elements = labeled.elements if elements is None else list(elements)
+    bond_lengths = dict(bond_lengths or {})
+    search = PeriodicNeighborSearch.from_labeled(labeled)
+
+    # Radius holding about signature_size neighbors at the average density, doubled
+    radius = 2.0 * (3 * signature_size * abs(np.linalg.det(labeled.lattice))
+                    / (4 * np.pi * max(num_atoms, 1)))**(1 / 3)
+    while True:
+        center, site_index, _, distance = search.query_sites(labeled.site_index, radius)
+        # Entries are sorted by center, then by distance: rank of each neighbor of its center
+        bounds = np.searchsorted(center, np.arange(num_atoms + 1))
+        rank = np.arange(len(center)) - bounds[center]
+        lengths = dict(bond_lengths)
+        for element in labeled.elements:
+            mine = (rank == 0) & (labeled.species[center] == element)
+            if element not in lengths and mine.any():
+                lengths[element] = float(np.median(distance[mine]))
+        if bond_factor * max(lengths.values(), default=0.0) <= radius:
+            break
+        radius = bond_factor * max(lengths.values())
+
+    signature = np.full((num_atoms, signature_size), np.nan)
+    keep = rank < signature_size
+    signature[center[keep], rank[keep]] = distance[keep]
+
+    cutoff = bond_factor * np.array([lengths.get(element, 0.0) for element in labeled.species.tolist()])
+    column = {element: k for k, element in enumerate(elements)}
+    neighbor_column = np.array([column.get(element, -1) for element in labeled.species.tolist()], dtype=int)
+    bonded = (distance <= cutoff[center]) & (neighbor_column[site_index] >= 0)
+    coordination = np.zeros((num_atoms, len(elements)), dtype=int)
+    np.add.at(coordination, (center[bonded], neighbor_column[site_index[bonded]]), 1)
+    bond_sum = np.bincount(center[bonded], weights=distance[bonded], minlength=num_atoms)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_bond = bond_sum / coordination.sum(axis=1)
+    return {'elements': elements, 'coordination': coordination, 'signature': signature,
+            'mean_bond': mean_bond, 'bond_lengths': lengths}
+
+
+def scores(fingerprint, reference_coordination, reference_signature):
+    """
+    Anomaly of each atom: the number of bonds gained or lost toward each
+    element, plus the change of the bond-length signature in units of
+    SIGNATURE_SCALE.
+
+    input:
+    fingerprint: dict from fingerprints
+    reference_coordination: (N,E) array, expected coordination of each atom
+    reference_signature: (N,K) array, expected signature of each atom
+
+    output:
+    (N,) array of scores, 0 for an atom in its expected environment
+    """
+    bonds = np.abs(fingerprint['coordination'] - reference_coordination).sum(axis=1)
+    change = np.sqrt(np.nansum((fingerprint['signature'] - reference_signature)**2, axis=1))
+    return bonds + change / SIGNATURE_SCALE
+
+
+def defect_center(lattice, frac_points, weights):
+    """
+    Weighted minimum-image centroid of points, taken around the point of
+    largest weight, so that points across the cell boundary are averaged
+    correctly.
+
+    output:
+    (3,) fractional coordinates
+    """
+    frac_points = np.asarray(frac_points, dtype=float).reshape(-1, 3)
+    weights = np.asarray(weights, dtype=float)
+    origin = frac_points[np.argmax(weights)]
+    vectors = minimum_image_vectors(lattice, frac_points - origin)
+    shift = (weights @ vectors) / weights.sum()
+    return np.mod(origin + shift @ np.linalg.inv(lattice), 1.0)
+
+
+def locate_defect(labeled, host=None, bond_factor=BOND_FACTOR, max_distance=None):
+    """
+    input:
+    labeled: LabeledStructure of the (relaxed) defective cell
+    host: LabeledStructure of the pristine host with the same lattice, or
+        None to compare each atom with the typical atom of its element
+    bond_factor: see fingerprints
+    max_distance: largest displacement of paired atoms of labeled and host
+        (angstrom). Default is atom_mapping.MATCH_DISTANCE
+
+    output:
+    dict with keys
+        'score': (N,) anomaly of each atom of labeled; inf for atoms without
+            a partner in the host (interstitials and substituents)
+        'order': site indices of labeled by decreasing score
+        'fingerprint': dict from fingerprints of labeled
+        'center': (3,) fractional coordinates of the suggested defect center
+        'vacancies': site indices in host of the atoms missing in labeled
+        'added': site indices in labeled of the atoms missing in host, or
+            without a host, of the elements rarer than RARE_FRACTION
+    """
+    vacancies = added = np.zeros(0, dtype=int)
+    if host is None:
+        fingerprint = fingerprints(labeled, bond_factor=bond_factor)
+        reference_coordination = np.zeros_like(fingerprint['coordination'])
+        reference_signature = np.zeros_like(fingerprint['signature'])
+        # Typical environment of each element: median over its atoms
+        for element in labeled.elements:
+            mine = labeled.species == element
+            reference_coordination[mine] = np.round(np.median(fingerprint['coordination'][mine], axis=0))
+            reference_signature[mine] = np.nanmedian(fingerprint['signature'][mine], axis=0)
+            if np.count_nonzero(mine) < RARE_FRACTION * len(labeled):
+                added = np.append(added, np.flatnonzero(mine))
+        score = scores(fingerprint, reference_coordination, reference_signature)
+        score[added] = np.inf
+    else:
+        from atom_mapping import map_atoms, MATCH_DISTANCE
+        mapping = map_atoms(host, labeled, MATCH_DISTANCE if max_distance is None else max_distance)
+        elements = list(dict.fromkeys(host.elements + labeled.elements))
+        host_fingerprint = fingerprints(host, elements, bond_factor=bond_factor)
+        fingerprint = fingerprints(labeled, elements, host_fingerprint['bond_lengths'], bond_factor)
+        reference_coordination = np.zeros_like(fingerprint['coordination'])
+        reference_signature = np.full_like(fingerprint['signature'], np.nan)
+        reference_coordination[mapping['index2']] = host_fingerprint['coordination'][mapping['index1']]
+        reference_signature[mapping['index2']] = host_fingerprint['signature'][mapping['index1']]
+        score = scores(fingerprint, reference_coordination, reference_signature)
+        added = np.concatenate([mapping['unmatched2'], mapping['substituted2']])
+        vacancies = mapping['unmatched1']
+        score[added] = np.inf
+
+    order = np.argsort(-score, kind='stable')
+    if len(added) or len(vacancies):
+        # Atoms added or removed are the defect itself
+        points = labeled.frac_coords[added]
+        if host is not None:
+            points = np.vstack([points, host.frac_coords[vacancies]])
+        center = defect_center(labeled.lattice, points, np.ones(len(points)))
+    else:
+        # Atoms scoring at least half of the largest score, at most 12 of them
+        top = order[:12][score[order[:12]] >= 0.5 * score[order[0]]]
+        center = defect_center(labeled.lattice, labeled.frac_coords[top], score[top] + 1e-12)
+    return {'score': score, 'order': order, 'fingerprint': fingerprint, 'center': center,
+            'vacancies': vacancies, 'added': added}
@@ -0,0 +1,101 @@
+"""
+## Command:
+python find_interstitials.py [POSCAR_filename] [optional:method] [optional:spacing] [optional:min]
+                             [optional:tol] [optional:top] [optional:symprec] [optional:out]
+
+[POSCAR_filename]:
+    POSCAR file of the host structure
+[optional:method]:
+    ex) method=grid
+    voronoi (default): exact local maxima of the distance to the nearest atom,
+    among the vertices of the Voronoi tessellation
+    grid: local maxima on a periodic grid of the distance to the nearest atom
+[optional:spacing]:
+    ex) spacing=0.1
+    Grid spacing of method=grid. Default is 0.2 ang.
+[optional:min]:
+    ex) min=1.5
+    Candidates closer than this to any atom are dropped. Default is 1.0 ang.
+[optional:tol]:
+    ex) tol=0.3
+    Candidates closer than this to each other, or to a symmetry image of
+    each other, are merged. Default is 0.5 ang.
+[optional:top]:
+    ex) top=20
+    Number of candidates printed. Default is all
+[optional:symprec]:
+    ex) symprec=1e-3
+    Tolerance of the symmetry analysis. symprec=0 skips the symmetry grouping,
+    ex) for amorphous cells. Default is 1e-2
+[optional:out]:
+    ex) out=interstitials.csv
+    Also write all candidates as CSV
+
+Candidates are ranked by the distance to the nearest atom. The 'Cartesian'
+column can be passed as it is to neighbors.py and perturb.py, ex)
+python neighbors.py POSCAR 1.8201,0.0000,0.9063
+"""
+
+import sys
+import numpy as np
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from symmetry import get_symmetry_dataset
+from interstitials import find_interstitials
+profiler.mark('import')
+
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('method', 'spacing', 'min', 'tol', 'top', 'symprec', 'out'))
+method=options.get('method', 'voronoi')
+spacing=float(options.get('spacing', 0.2))
+min_distance=float(options.get('min', 1.0))
+tolerance=float(options.get('tol', 0.5))
+top=int(options['top']) if 'top' in options else None
+symprec=float(options.get('symprec', 1e-2))
+
+if len(sys.argv) == 1:
+    print('POSCAR is not provided')
+    sys.exit()
+
+##############################################################################
+########## Find candidates
+##############################################################################
+labeled = LabeledStructure.from_file(sys.argv[1])
+profiler.mark('parse')
+dataset = get_symmetry_dataset(labeled, symprec=symprec, angle_tolerance=0.1) if symprec > 0 else None
+profiler.mark('symmetry')
+
+candidates = find_interstitials(labeled, dataset, method=method, spacing=spacing,
+                                min_distance=min_distance, tolerance=tolerance)
+profiler.mark('neighbors')
+
+##############################################################################
+########## Print & write
+##############################################################################
+if dataset is not None:
+    print("   Host: {0}, space group {1} ({2})".format(sys.argv[1], dataset['international'], dataset['number']))
+else:
+    print("   Host: {0}, no symmetry grouping".format(sys.argv[1]))
+print("   Rank |     x       y       z    |        Cartesian          | Distance | Nearest | Mult.")
+print("   ─────┼──────────────────────────┼───────────────────────────┼──────────┼─────────┼──────")
+for i in range(len(candidates['rank']))[:top]:
+    frac=candidates['frac_coords'][i]
+    cart=candidates['cart_coords'][i]
+    print("   {0:>4} | {1: 5.4f} {2: 5.4f} {3: 5.4f}  | {4:<25} |  {5:6.4f}  | {6:>6}  | {7:>4}"
+          .format(candidates['rank'][i], frac[0], frac[1], frac[2],
+                  '{0:.4f},{1:.4f},{2:.4f}'.format(cart[0], cart[1], cart[2]),
+                  candidates['distance'][i], candidates['nearest_label'][i], candidates['multiplicity'][i]))
+
+if 'out' in options:
+    table=np.column_stack([candidates['rank'], candidates['frac_coords'], candidates['cart_coords'],
+                           candidates['distance'], candidates['nearest_label'],
+                           candidates['multiplicity'], candidates['equivalent']])
+    np.savetxt(options['out'], table, fmt='%s', delimiter=',', comments='',
+               header='rank,a,b,c,x,y,z,distance,nearest_label,multiplicity,equivalent')
+
+print("")
+print('  {0} candidate interstitial sites were found'.format(len(candidates['rank'])))
+if 'out' in options:
+    print('  Candidates were written as {0}'.format(options['out']))
+profiler.mark('write')
@@ -0,0 +1,291 @@
+"""
+Interstitial site candidates from the distance to the nearest atom.
+
+Candidates are local maxima of the distance to the nearest atom, found
+either on a periodic grid (evaluated in chunks with one KD-tree query per
+chunk) or exactly, among the vertices of the Voronoi tessellation of the
+atoms. Nearby maxima are merged,
+symmetry-equivalent ones are grouped with the operations of the symmetry
+dataset (symmetry.py), and the remaining sites are ranked by their
+distance to the nearest atom.
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from neighbor_search import PeriodicNeighborSearch
+
+# Grid points evaluated at once, to bound the memory of the coordinate arrays
+CHUNK_SIZE = 262144
+
+# Initial skin of periodic images of the Voronoi method (angstrom), and its growth
+# over the largest circumradius when that does not fit in the skin
+SKIN = 3.0
+SKIN_GROWTH = 1.2
+
+# 26 neighbors of a grid point
+GRID_NEIGHBORS = [shift for shift in np.ndindex(3, 3, 3) if shift != (1, 1, 1)]
+# Grid values closer than this (angstrom) are equal, so that symmetric points tie
+GRID_TOLERANCE = 1e-8
+
+
+def grid_shape(lattice, spacing):
+    """Number of grid points along each lattice vector, for the given spacing (angstrom)"""
+    return tuple(int(n) for n in np.maximum(np.ceil(np.linalg.norm(lattice, axis=1) / spacing), 1))
+
+
+def distance_grid(search, shape):
+    """
+    input:
+    search: PeriodicNeighborSearch of the structure
+    shape: (n1, n2, n3), number of grid points along each lattice vector
+
+    output:
+    (n1, n2, n3) array of the distance to the nearest atom (angstrom) at
+    fractional coordinates (i/n1, j/n2, k/n3)
+    """
+    shape = np.asarray(shape)
+    num_points = int(np.prod(shape))
+    distance = np.empty(num_points)
+    for start in range(0, num_points, CHUNK_SIZE):
+        index = np.arange(start, min(start + CHUNK_SIZE, num_points))
+        points = np.stack(np.unravel_index(index, shape), axis=1) / shape
+        distance[start:start + len(index)] = search.nearest(points)[2]
+    return distance.reshape(shape)
+
+
+def grid_maxima(distance):
+    """
+    input:
+    distance: (n1, n2, n3) periodic grid of values
+
+    output:
+    (M,3) fractional coordinates of the local maxima. Neighboring grid points
+    of equal value (a plateau, ex. along a symmetric ridge) are one maximum at
+    their center, and only when no grid point next to the plateau is larger
+    """
+    shape = np.asarray(distance.shape)
+    maximum = np.ones(distance.shape, dtype=bool)
+    for shift in GRID_NEIGHBORS:
+        neighbor = np.roll(distance, np.subtract(shift, 1), axis=(0, 1, 2))
+        maximum &= distance >= neighbor - GRID_TOLERANCE
+    points = np.argwhere(maximum)
+    if len(points) == 0:
+        return np.zeros((0, 3))
+
+    # Plateaus: candidates joined to their equal neighbors. A plateau that also
+    # reaches a point with a larger neighbor is a flat part of a slope
+    value = distance.reshape(-1)
+    flat = np.ravel_multi_index(points.T, distance.shape)
+    number = np.full(distance.size, -1)
+    number[flat] = np.arange(len(points))
+    i, j = [], []
+    slope = np.zeros(len(points), dtype=bool)
+    for shift in GRID_NEIGHBORS:
+        neighbor = np.ravel_multi_index(((points + np.subtract(shift, 1)) % shape).T, distance.shape)
+        equal = np.abs(value[neighbor] - value[flat]) <= GRID_TOLERANCE
+        slope |= equal & (number[neighbor] < 0)
+        equal &= number[neighbor] >= 0
+        i.append(np.flatnonzero(equal))
+        j.append(number[neighbor[equal]])
+    group = _groups(len(points), np.concatenate(i), np.concatenate(j))[1]
+    kept = np.setdiff1d(np.unique(group), group[slope])
+
+    # Center of each plateau, from its points unwrapped around the first one
+    first = points[np.unique(group, return_index=True)[1]][group]
+    relative = points - first
+    relative -= np.rint(relative / shape).astype(int) * shape
+    counts = np.bincount(group)
+    center = np.stack([np.bincount(group, weights=first[:, axis] + relative[:, axis]) / counts
+                       for axis in range(3)], axis=1)
+    return np.mod(center[kept], shape) / shape
+
+
+def _delaunay_vertices(lattice, frac_coords, skin):
+    """
+    Voronoi vertices inside the unit cell, from the Delaunay tessellation of the
+    atoms and their periodic images within skin (angstrom) of the cell.
+
+    output:
+    vertices: (V,3) fractional coordinates of the vertices inside the unit cell
+    radius: (V,) circumradius of their tetrahedra (angstrom)
+    maximum: (V,) bool, True for the local maxima of the distance to the nearest atom
+    """
+    from scipy.spatial import Delaunay
+    inv_lattice = np.linalg.inv(lattice)
+    skin_frac = skin * np.linalg.norm(inv_lattice, axis=0)
+    n_image = np.ceil(skin_frac).astype(int)
+    offsets = np.stack(np.meshgrid(*[np.arange(-n, n + 1) for n in n_image], indexing='ij'),
+                       axis=-1).reshape(-1, 3)
+    images = (np.mod(frac_coords, 1.0)[None, :, :] + offsets[:, None, :]).reshape(-1, 3)
+    images = images[np.all((images >= -skin_frac) & (images < 1.0 + skin_frac), axis=1)]
+    cart = images @ lattice
+
+    # (S,4,3) corners of each tetrahedron, edges from the first corner
+    corners = cart[Delaunay(cart).simplices]
+    edges = corners[:, 1:] - corners[:, :1]
+    flat = np.abs(np.linalg.det(edges)) < 1e-8
+    corners, edges = corners[~flat], edges[~flat]
+    # Circumcenter c - p0 solves 2 edges @ (c - p0) = |edges|^2
+    relative = np.linalg.solve(2.0 * edges, np.einsum('sij,sij->si', edges, edges)[..., None])[..., 0]
+    # Barycentric coordinates of the circumcenter in its own tetrahedron
+    weights = np.linalg.solve(np.transpose(edges, (0, 2, 1)), relative[..., None])[..., 0]
+    maximum = np.all(weights >= -1e-8, axis=1) & (weights.sum(axis=1) <= 1.0 + 1e-8)
+
+    vertices = (corners[:, 0] + relative) @ inv_lattice
+    in_cell = np.all((vertices >= 0.0) & (vertices < 1.0), axis=1)
+    return vertices[in_cell], np.linalg.norm(relative[in_cell], axis=1), maximum[in_cell]
+
+
+def voronoi_maxima(lattice, frac_coords, skin=None):
+    """
+    Voronoi vertices that are local maxima of the distance to the nearest atom.
+
+    Voronoi vertices are circumcenters of Delaunay tetrahedra, and a vertex
+    is a local maximum when it lies inside its own tetrahedron. A vertex is
+    exact when all atoms within its circumradius are among the images, so by
+    default the skin of images starts at SKIN and is widened until it covers
+    the largest circumradius of the vertices in the cell (sparse hosts, voids).
+
+    input:
+    lattice: (3,3) array, lattice vectors in rows (angstrom)
+    frac_coords: (N,3) array of fractional coordinates of atoms
+    skin: thickness (angstrom) of periodic images around the cell. Default is automatic
+
+    output:
+    (M,3) fractional coordinates of the maxima inside the unit cell
+    """
+    if skin is not None:
+        vertices, _, maximum = _delaunay_vertices(lattice, frac_coords, skin)
+        return vertices[maximum]
+    skin = SKIN
+    while True:
+        vertices, radius, maximum = _delaunay_vertices(lattice, frac_coords, skin)
+        largest = radius.max(initial=0.0)
+        if largest <= skin:
+            return vertices[maximum]
+        skin = SKIN_GROWTH * largest
+
+
+def _groups(num_points, i, j):
+    """Group index of each point, where pairs (i, j) are in the same group"""
+    graph = coo_matrix((np.ones(len(i)), (i, j)), shape=(num_points, num_points))
+    return connected_components(graph, directed=False)
+
+
+def cluster_points(lattice, frac_points, value, tolerance):
+    """
+    Merge points within tolerance (angstrom) of each other, keeping the one
+    with the largest value of each cluster.
+
+    output:
+    index: int array of kept points
+    """
+    search = PeriodicNeighborSearch(lattice, frac_points)
+    center, site_index, _, _ = search.query_points(frac_points, tolerance)
+    group = _groups(len(frac_points), center, site_index)[1]
+    # Largest value first, then the first point of each group
+    order = np.lexsort((-value, group))
+    first = np.unique(group[order], return_index=True)[1]
+    return order[first]
+
+
+def symmetry_orbits(lattice, frac_points, rotations, translations, tolerance):
+    """
+    input:
+    lattice: (3,3) array, lattice vectors in rows (angstrom)
+    frac_points: (M,3) fractional coordinates
+    rotations: (K,3,3) int array, symmetry operations acting on fractional coordinates
+    translations: (K,3) array
+    tolerance: distance (angstrom) under which two points are the same
+
+    output:
+    orbit: (M,) int array, orbit index of each point
+    multiplicity: (M,) int array, number of distinct images of each point in the cell
+    """
+    rotations = np.asarray(rotations, dtype=float).reshape(-1, 3, 3)
+    translations = np.asarray(translations, dtype=float).reshape(-1, 3)
+    # Images of every point under every operation, image k*M + m of point m
+    images = (np.einsum('kij,mj->kmi', rotations, frac_points) + translations[:, None, :]).reshape(-1, 3)
+    num_points = len(frac_points)
+
+    search = PeriodicNeighborSearch(lattice, frac_points)
+    center, site_index, _, _ = search.query_points(images, tolerance)
+    orbit = _groups(num_points, center % num_points, site_index)[1]
+
+    # Distinct images of each point. Images that fall on a candidate are told apart by
+    # that candidate, from one query of the same tree; the images between candidates
+    # (orbits not found completely) are grouped with one tree over them
+    point = np.arange(len(images)) % num_points
+    nearest, _, distance = search.nearest(images)
+    found = distance <= tolerance
+    pairs = np.unique(point[found] * num_points + nearest[found])
+    multiplicity = np.bincount(pairs // num_points, minlength=num_points)
+    lost = np.flatnonzero(~found)
+    if len(lost):
+        search = PeriodicNeighborSearch(lattice, images[lost])
+        center, site_index, _, _ = search.query_points(images[lost], tolerance)
+        same_point = point[lost][center] == point[lost][site_index]
+        group = _groups(len(lost), center[same_point], site_index[same_point])[1]
+        first = np.unique(group, return_index=True)[1]
+        multiplicity += np.bincount(point[lost][first], minlength=num_points)
+    return orbit, multiplicity
+
+
+def find_interstitials(labeled, dataset=None, method='voronoi', spacing=0.2, min_distance=1.0,
+                       tolerance=0.5):
+    """
+    input:
+    labeled: LabeledStructure of the host
+    dataset: symmetry dataset from symmetry.get_symmetry_dataset, or None to skip
+        the symmetry grouping (ex. amorphous cells)
+    method: 'voronoi' (exact maxima) or 'grid'
+    spacing: grid spacing (angstrom) of the grid method
+    min_distance: candidates closer than this to an atom are dropped (angstrom)
+    tolerance: candidates closer than this to each other are merged (angstrom)
+
+    output:
+    dict of per-candidate arrays, ranked by distance to the nearest atom, with keys
+        'rank', 'frac_coords', 'cart_coords', 'distance', 'nearest_index',
+        'nearest_label', 'multiplicity', 'equivalent'
+    where 'equivalent' is the number of symmetry-equivalent candidates found
+    (multiplicity counts the images in the cell, whether found or not)
+    """
+    search = PeriodicNeighborSearch.from_labeled(labeled)
+    if method == 'grid':
+        shape = grid_shape(labeled.lattice, spacing)
+        points = grid_maxima(distance_grid(search, shape))
+    elif method == 'voronoi':
+        points = voronoi_maxima(labeled.lattice, labeled.frac_coords)
+    else:
+        raise ValueError("Unknown method {0}, use grid or voronoi".format(method))
+
+    nearest_index, _, distance = search.nearest(points)
+    keep = distance >= min_distance
+    points, nearest_index, distance = points[keep], nearest_index[keep], distance[keep]
+
+    kept = cluster_points(labeled.lattice, points, distance, tolerance)
+    points, nearest_index, distance = points[kept], nearest_index[kept], distance[kept]
+
+    if dataset is not None and len(points):
+        orbit, multiplicity = symmetry_orbits(labeled.lattice, points, dataset['rotations'],
+                                              dataset['translations'], tolerance)
+    else:
+        orbit, multiplicity = np.arange(len(points)), np.ones(len(points), dtype=int)
+    # Best candidate of each orbit, by distance to the nearest atom
+    order = np.lexsort((-distance, orbit))
+    first, equivalent = np.unique(orbit[order], return_index=True, return_counts=True)[1:]
+    representative = order[first]
+    rank_order = np.argsort(-distance[representative], kind='stable')
+    representative, equivalent = representative[rank_order], equivalent[rank_order]
+
+    frac_coords = np.mod(points[representative], 1.0)
+    return {'rank': np.arange(1, len(representative) + 1),
+            'frac_coords': frac_coords,
+            'cart_coords': frac_coords @ labeled.lattice,
+            'distance': distance[representative],
+            'nearest_index': nearest_index[representative],
+            'nearest_label': labeled.labels[nearest_index[representative]],
+            'multiplicity': multiplicity[representative],
+            'equivalent': equivalent}
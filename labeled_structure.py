@@ -0,0 +1,132 @@
+"""
+Array-backed structure with VESTA-like atom labels, shared by the scripts.
+
+Atoms are labeled with element and number such as Si1, Si2, O1, where the
+number counts the atoms of each element in the order they appear in the
+structure file. Species, labels, site indices and coordinates are kept as
+contiguous numpy arrays, so that label -> index and index -> label lookups
+do not require scanning the structure.
+"""
+
+import numpy as np
+
+# Structure files that are not POSCAR, left to pymatgen
+PYMATGEN_EXTENSIONS = ('.cif', '.mcif', '.json', '.xsf', '.cssr', '.res', '.yaml', '.xyz')
+
+
+def create_labels(species):
+    """
+    input:
+    species: sequence of element symbols, one entry per site
+
+    output:
+    labels: numpy array of VESTA-like labels such as 'Si1', 'O3'
+    """
+    species = np.asarray(species, dtype=str)
+    if len(species) == 0:
+        return np.array([], dtype=str)
+    _, inverse, counts = np.unique(species, return_inverse=True, return_counts=True)
+    # Sites grouped by element while keeping the file order inside each group
+    order = np.argsort(inverse, kind='stable')
+    starts = np.cumsum(counts) - counts
+    numbers = np.empty(len(species), dtype=int)
+    numbers[order] = np.arange(len(species)) - np.repeat(starts, counts) + 1
+    return np.char.add(species, numbers.astype(str))
+
+
+class LabeledStructure:
+    """
+    Periodic structure stored as numpy arrays with VESTA-like labels.
+
+    attributes:
+    lattice: (3,3) array, lattice vectors in rows (angstrom)
+    species: (N,) array of element symbols
+    labels: (N,) array of atom labels, ex) 'Si1', 'O3'
+    site_index: (N,) array of site indices
+    frac_coords: (N,3) array of fractional coordinates
+    cart_coords: (N,3) array of Cartesian coordinates (angstrom)
+    label_to_index: dict mapping each label to its site index
+    selective_dynamics: (N,3) bool array of selective dynamics flags, or None
+    velocities: (N,3) array of velocities (angstrom/fs), or None
+    comment: comment line of the structure file
+    """
+
+    def __init__(self, lattice, species, frac_coords,
+                 selective_dynamics=None, velocities=None, comment=''):
+        self.lattice = np.ascontiguousarray(lattice, dtype=float).reshape(3, 3)
+        self.species = np.asarray(species, dtype=str)
+        self.frac_coords = np.ascontiguousarray(frac_coords, dtype=float).reshape(-1, 3)
+        if len(self.species) != len(self.frac_coords):
+            raise ValueError("Number of species ({0}) and coordinates ({1}) do not match"
+                             .format(len(self.species), len(self.frac_coords)))
+        self.cart_coords = self.frac_coords @ self.lattice
+        self.site_index = np.arange(len(self.species))
+        self.labels = create_labels(self.species)
+        self.label_to_index = dict(zip(self.labels.tolist(), self.site_index.tolist()))
+        self.selective_dynamics = (None if selective_dynamics is None
+                                   else np.asarray(selective_dynamics, dtype=bool).reshape(-1, 3))
+        self.velocities = None if velocities is None else np.asarray(velocities, dtype=float).reshape(-1, 3)
+        self.comment = comment
+
+    @classmethod
+    def from_pymatgen(cls, pmg_struct):
+        """
+        input:
+        pmg_struct: pymatgen Structure
+
+        output:
+        LabeledStructure with the same lattice, species and site order
+        """
+        return cls(pmg_struct.lattice.matrix,
+                   [str(specie) for specie in pmg_struct.species],
+                   pmg_struct.frac_coords)
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        input:
+        filename: POSCAR/CONTCAR file, read without pymatgen.
+            Other formats (cif, ...) known by their extension are read with pymatgen
+        """
+        if filename.lower().endswith(PYMATGEN_EXTENSIONS):
+            from pymatgen.core import Structure
+            return cls.from_pymatgen(Structure.from_file(filename))
+        from poscar_io import read_poscar
+        return read_poscar(filename)
+
+    def to_pymatgen(self):
+        """pymatgen Structure of this structure. Imports pymatgen"""
+        from pymatgen.core import Structure
+        return Structure(self.lattice, self.species.tolist(), self.frac_coords)
+
+    def __len__(self):
+        return len(self.species)
+
+    @property
+    def num_sites(self):
+        return len(self.species)
+
+    @property
+    def elements(self):
+        """Element symbols in order of first appearance, ex) ['Si', 'O']"""
+        _, first_index = np.unique(self.species, return_index=True)
+        return self.species[np.sort(first_index)].tolist()
+
+    def get_frac_coords(self, cart_coords):
+        """Fractional coordinates of Cartesian coordinates (angstrom)"""
+        return np.asarray(cart_coords, dtype=float) @ np.linalg.inv(self.lattice)
+
+    def index(self, label):
+        """Site index of an atom label such as 'Si1'"""
+        try:
+            return self.label_to_index[label]
+        except KeyError:
+            raise KeyError("Atom label {0} is not in the structure".format(label)) from None
+
+    def indices(self, labels):
+        """Array of site indices for a sequence of atom labels"""
+        return np.array([self.index(label) for label in labels], dtype=int)
+
+    def label(self, index):
+        """Atom label of a site index"""
+        return str(self.labels[index])
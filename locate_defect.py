@@ -0,0 +1,102 @@
+"""
+## Command:
+python locate_defect.py [POSCAR_filename] [optional:host] [optional:top] [optional:min]
+                        [optional:bond] [optional:out]
+
+[POSCAR_filename]:
+    POSCAR (or CONTCAR) of the relaxed defective cell
+[optional:host]:
+    ex) host=POSCAR_pristine
+    Pristine host with the same lattice. Atoms are compared with their
+    partner in the host. Without a host, each atom is compared with the
+    typical atom of its element
+[optional:top]:
+    ex) top=20
+    Number of atoms printed. Default is 10
+[optional:min]:
+    ex) min=2
+    Atoms scoring less than this are not anomalous. Default is 1.0,
+    one bond gained or lost, or a 0.1 ang change of the bond lengths
+[optional:bond]:
+    ex) bond=1.3
+    Neighbors closer than this times the typical nearest-neighbor distance
+    of the element are bonded. Default is 1.25
+[optional:out]:
+    ex) out=environment.csv
+    Also write the coordination numbers, mean bond length and score of every atom
+
+The suggested defect center is printed in Cartesian coordinates, which can
+be passed as they are to neighbors.py and perturb.py.
+"""
+
+import sys
+import numpy as np
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from environment import locate_defect, BOND_FACTOR
+profiler.mark('import')
+
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('host', 'top', 'min', 'bond', 'out'))
+top=int(options.get('top', 10))
+min_score=float(options.get('min', 1.0))
+bond_factor=float(options.get('bond', BOND_FACTOR))
+
+if len(sys.argv) == 1:
+    print('POSCAR is not provided')
+    sys.exit()
+
+##############################################################################
+########## Fingerprints & scores
+##############################################################################
+labeled = LabeledStructure.from_file(sys.argv[1])
+host = LabeledStructure.from_file(options['host']) if 'host' in options else None
+profiler.mark('parse')
+try:
+    result = locate_defect(labeled, host, bond_factor=bond_factor)
+except (KeyError, ValueError) as error:
+    print(error.args[0])
+    sys.exit()
+profiler.mark('neighbors')
+
+##############################################################################
+########## Print & write
+##############################################################################
+fingerprint = result['fingerprint']
+score = result['score']
+print("   Reference: {0}".format(options['host'] if host is not None else 'typical atom of each element'))
+print("   Rank | Atom   | Bonds " + " ".join("{0:>3}".format(element) for element in fingerprint['elements'])
+      + " | Mean bond |  Score  |     x       y       z")
+print("   ─────┼────────┼──────" + "────" * len(fingerprint['elements'])
+      + "─┼───────────┼─────────┼─────────────────────────")
+for rank, i in enumerate(result['order'][:top]):
+    if score[i] < min_score:
+        break
+    print("   {0:>4} | {1:<6} |       ".format(rank + 1, labeled.labels[i])
+          + " ".join("{0:>3}".format(count) for count in fingerprint['coordination'][i])
+          + " |  {0:7.4f}  | {1:>7} | {2: 5.4f} {3: 5.4f} {4: 5.4f}".format(
+              fingerprint['mean_bond'][i], 'new' if np.isinf(score[i]) else '{0:7.2f}'.format(score[i]),
+              *labeled.frac_coords[i]))
+if host is not None:
+    for i in result['vacancies']:
+        print("      - | {0:<6} | missing from the host".format(host.labels[i]) + " " * 4 * len(fingerprint['elements'])
+              + "             | {0: 5.4f} {1: 5.4f} {2: 5.4f}".format(*host.frac_coords[i]))
+
+if 'out' in options:
+    columns = [labeled.labels, fingerprint['coordination'], fingerprint['mean_bond'], score]
+    np.savetxt(options['out'], np.column_stack(columns), fmt='%s', delimiter=',', comments='',
+               header=','.join(['label'] + ['cn_' + element for element in fingerprint['elements']]
+                               + ['mean_bond', 'score']))
+
+print("")
+if len(result['added']) or len(result['vacancies']) or score[result['order'][0]] >= min_score:
+    center = result['center']
+    cart = center @ labeled.lattice
+    print("   Suggested defect center: {0: 5.4f} {1: 5.4f} {2: 5.4f} (Cartesian {3:.4f},{4:.4f},{5:.4f})"
+          .format(*center, *cart))
+else:
+    print("   No atom scores above {0}: no defect was found".format(min_score))
+if 'out' in options:
+    print("   Fingerprints of all atoms were written as {0}".format(options['out']))
+profiler.mark('write')
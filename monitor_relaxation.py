@@ -0,0 +1,173 @@
+"""
+## Command:
+python monitor_relaxation.py [XDATCARs or job directories] [optional:interval] [optional:tol] [optional:top]
+                             [optional:sel] [optional:out] [optional:follow]
+
+[XDATCARs or job directories]:
+    ex) XDATCAR, 'charge_*/'
+    Relaxations to follow while they run. A directory stands for its XDATCAR.
+    Only the frames appended since the last check are read, so dozens of jobs
+    can be followed at once. A CONTCAR can also be given: it is read again
+    whenever VASP rewrites it
+[optional:interval]:
+    ex) interval=30
+    Seconds between checks of the files. Default is 10
+[optional:tol]:
+    ex) tol=0.005
+    Steps in which no atom moves more than this are printed as 'still'.
+    Default is 0.01 ang.
+[optional:top]:
+    ex) top=3
+    Also print this many atoms with the largest displacement from the initial
+    structure at every step. Default is 0
+[optional:sel]:
+    ex) 'sel=within 5 of Ge1'
+    Only follow the atoms of this selection of the first frame (selection.py)
+[optional:out]:
+    ex) out=monitor.csv
+    Append one line per ionic step of every job
+[optional:follow]:
+    follow=0 prints the steps written so far and exits. Default follows the
+    files until interrupted with Ctrl+C
+"""
+
+import os
+import sys
+import glob
+import time
+import numpy as np
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from displacement import DisplacementTracker
+from poscar_io import read_poscar, is_xdatcar, XdatcarReader
+from selection import select_indices
+profiler.mark('import')
+
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('interval', 'tol', 'top', 'sel', 'out', 'follow'))
+interval=float(options.get('interval', 10))
+tolerance=float(options.get('tol', 0.01))
+top=int(options.get('top', 0))
+follow=options.get('follow', '1').lower() in ('1', 'true', 't', 'yes')
+
+if len(sys.argv) == 1:
+    print('XDATCAR is not provided')
+    sys.exit()
+
+# Directories stand for their XDATCAR, patterns are expanded
+file_list=[]
+for entry in sys.argv[1:]:
+    for filename in (sorted(glob.glob(entry)) if glob.has_magic(entry) else [entry]):
+        file_list.append(os.path.join(filename, 'XDATCAR') if os.path.isdir(filename) else filename)
+if len(file_list) == 0:
+    print('No file matches {0}'.format(' '.join(sys.argv[1:])))
+    sys.exit()
+
+jobs=[{'file': filename, 'reader': None, 'stat': None, 'count': 0, 'tracker': None}
+      for filename in file_list]
+
+##############################################################################
+########## New frames of each job
+##############################################################################
+
+def new_frames(job):
+    """
+    (step, lattice, frac_coords) of the frames written since the last call.
+    Files that do not exist yet, or have no complete frame yet, give none
+    """
+    filename=job['file']
+    try:
+        if not os.path.exists(filename):
+            return []
+        # XDATCAR: only the appended frames are parsed
+        if job['reader'] is not None or 'XDATCAR' in os.path.basename(filename) or is_xdatcar(filename):
+            if job['reader'] is None:
+                job['reader']=XdatcarReader(filename)
+                job['reader'].position=job['reader'].offset
+                job['species']=job['reader'].species
+            try:
+                return job['reader'].new_frames()
+            except ValueError:
+                # The job was restarted: the file is read again, from the same initial structure
+                print("   {0}: rewritten from the start".format(filename))
+                job['reader']=None
+                return new_frames(job)
+        # CONTCAR: read again when rewritten
+        stat=os.stat(filename)
+        if (stat.st_size, stat.st_mtime_ns) == job['stat']:
+            return []
+        labeled=read_poscar(filename)
+        job['stat']=(stat.st_size, stat.st_mtime_ns)
+        job['species']=labeled.species
+        job['count']+=1
+        return [(job['count'], labeled.lattice, labeled.frac_coords)]
+    except (OSError, ValueError, IndexError):
+        # Header or frame is partly written: tried again at the next check
+        return []
+
+##############################################################################
+########## Follow & print
+##############################################################################
+width=max(len(job['file']) for job in jobs)
+out_file=None
+if 'out' in options:
+    new_file=not os.path.exists(options['out']) or os.path.getsize(options['out']) == 0
+    out_file=open(options['out'], 'a')
+    if new_file:
+        out_file.write("file,step,max_from_initial,atom_from_initial,max_step,atom_step,rms_step\n")
+
+print("   {0:<{1}s} |  Step | From initial | Atom   | Last step | Atom   | RMS step |"
+      .format('File', width))
+print("   " + "─" * width + "─┼───────┼──────────────┼────────┼───────────┼────────┼──────────┼───────",
+      flush=True)
+try:
+    while True:
+        for job in jobs:
+            for step, lattice, frac_coords in new_frames(job):
+                if job['tracker'] is None:
+                    # The first frame is the initial structure of the atoms followed
+                    first=LabeledStructure(lattice, job['species'], frac_coords)
+                    try:
+                        job['index']=(select_indices(first, options['sel']) if 'sel' in options
+                                      else first.site_index)
+                    except (KeyError, ValueError) as error:
+                        print(error.args[0])
+                        sys.exit()
+                    if len(job['index']) == 0:
+                        print("No atom of {0} is selected by '{1}'".format(job['file'], options['sel']))
+                        sys.exit()
+                    job['labels']=first.labels[job['index']]
+                    job['tracker']=DisplacementTracker(frac_coords[job['index']])
+                    print("   {0:<{1}s} | {2:>5} | initial structure, {3} atoms followed"
+                          .format(job['file'], width, step, len(job['index'])), flush=True)
+                    continue
+                tracker=job['tracker']
+                tracker.update(lattice, frac_coords[job['index']])
+                i=np.argmax(tracker.from_initial)
+                j=np.argmax(tracker.from_previous)
+                rms=np.sqrt(np.mean(tracker.from_previous**2))
+                print("   {0:<{1}s} | {2:>5} |   {3:8.4f}   | {4:<6} |  {5:8.4f} | {6:<6} | {7:8.4f} | {8}"
+                      .format(job['file'], width, step, tracker.from_initial[i], job['labels'][i],
+                              tracker.from_previous[j], job['labels'][j], rms,
+                              'still' if tracker.from_previous[j] <= tolerance else ''), flush=True)
+                for k in np.argsort(-tracker.from_initial, kind='stable')[:top]:
+                    print("   {0:<{1}s} |       |   {2:8.4f}   | {3:<6} |  {4:8.4f} |        |          |"
+                          .format('', width, tracker.from_initial[k], job['labels'][k],
+                                  tracker.from_previous[k]), flush=True)
+                if out_file is not None:
+                    out_file.write("{0},{1},{2:.6f},{3},{4:.6f},{5},{6:.6f}\n"
+                                   .format(job['file'], step, tracker.from_initial[i], job['labels'][i],
+                                           tracker.from_previous[j], job['labels'][j], rms))
+                    out_file.flush()
+        profiler.mark('compare')
+        if not follow:
+            break
+        time.sleep(interval)
+        profiler.mark('wait')
+except KeyboardInterrupt:
+    print("")
+    print("   Stopped following")
+finally:
+    if out_file is not None:
+        out_file.close()
@@ -0,0 +1,169 @@
+"""
+Periodic neighbor search returning (site_index, image, distance) triples.
+
+site_index refers to the site order of the structure file, so labels and
+coordinates of neighbors come from direct array lookups in a
+LabeledStructure instead of comparing Site objects.
+
+PeriodicNeighborSearch is built once per structure and answers many
+centers in one call. Atoms are wrapped into the unit cell and periodic
+images are added only inside a skin as thick as the search radius, so a
+KD-tree over roughly N points covers every neighbor and the cost stays
+near-linear in the number of atoms.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Neighbors closer than this to a center atom are the atom itself
+SELF_TOLERANCE = 1e-8
+
+
+class PeriodicNeighborSearch:
+    """
+    input:
+    lattice: (3,3) array, lattice vectors in rows (angstrom)
+    frac_coords: (N,3) array of fractional coordinates
+    """
+
+    def __init__(self, lattice, frac_coords):
+        self.lattice = np.asarray(lattice, dtype=float).reshape(3, 3)
+        self.inv_lattice = np.linalg.inv(self.lattice)
+        self.frac_coords = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+        # Columns of the inverse lattice are reciprocal vectors (without 2 pi),
+        # their lengths are the inverse interplanar spacings
+        self.inv_spacing = np.linalg.norm(self.inv_lattice, axis=0)
+        self.cell_shift = np.floor(self.frac_coords).astype(int)
+        self.unit_frac_coords = self.frac_coords - self.cell_shift
+        self.skin = -1.0
+        self.tree = None
+
+    @classmethod
+    def from_labeled(cls, labeled):
+        """Build from a LabeledStructure"""
+        return cls(labeled.lattice, labeled.frac_coords)
+
+    def _build(self, radius):
+        """Index the atoms in the cell plus periodic images within radius of the cell"""
+        skin_frac = radius * self.inv_spacing
+        n_image = np.ceil(skin_frac).astype(int)
+        ranges = [np.arange(-n, n + 1) for n in n_image]
+        offsets = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        point_site, point_offset = [], []
+        all_sites = np.arange(len(self.frac_coords))
+        for offset in offsets:
+            shifted = self.unit_frac_coords + offset
+            inside = np.all((shifted >= -skin_frac) & (shifted < 1.0 + skin_frac), axis=1)
+            point_site.append(all_sites[inside])
+            point_offset.append(np.broadcast_to(offset, (np.count_nonzero(inside), 3)))
+        self.point_site = np.concatenate(point_site)
+        self.point_offset = np.concatenate(point_offset)
+        self.point_cart = (self.unit_frac_coords[self.point_site] + self.point_offset) @ self.lattice
+        self.tree = cKDTree(self.point_cart)
+        self.skin = radius
+
+    def query(self, centers, radius, center_sites=None):
+        """
+        Find all atoms within radius of each center.
+
+        input:
+        centers: (M,3) array of fractional coordinates of the centers
+        radius: search radius (angstrom)
+        center_sites: (M,) array of site indices of the centers, or None.
+            Where given, the center atom itself is excluded from its neighbors.
+
+        output:
+        center: (K,) int array, which center (0..M-1) each neighbor belongs to
+        site_index: (K,) int array, index of each neighbor in the structure
+        image: (K,3) int array, lattice translation such that the neighbor is at
+            frac_coords[site_index] + image, as seen from the center as given
+        distance: (K,) float array, distance from the center (angstrom)
+        Entries are sorted by center, then by distance.
+        """
+        centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        if self.tree is None or radius > self.skin:
+            self._build(radius)
+        center_shift = np.floor(centers).astype(int)
+        center_cart = (centers - center_shift) @ self.lattice
+
+        # All (center, point) pairs within radius in one call
+        pairs = cKDTree(center_cart).sparse_distance_matrix(self.tree, radius, output_type='ndarray')
+        center = pairs['i'].astype(int)
+        points = pairs['j'].astype(int)
+        distance = pairs['v']
+        site_index = self.point_site[points]
+        image = self.point_offset[points] - self.cell_shift[site_index] + center_shift[center]
+
+        keep = np.ones(len(points), dtype=bool)
+        if center_sites is not None:
+            center_sites = np.asarray(center_sites)
+            keep = ~((site_index == center_sites[center]) & (distance < SELF_TOLERANCE))
+        order = np.lexsort((site_index[keep], distance[keep], center[keep]))
+        return (center[keep][order], site_index[keep][order],
+                image[keep][order], distance[keep][order])
+
+    def nearest(self, points):
+        """
+        Nearest atom of each point.
+
+        input:
+        points: (M,3) array of fractional coordinates
+
+        output:
+        site_index: (M,) int array, index of the nearest atom
+        image: (M,3) int array, lattice translation of the nearest atom as in query
+        distance: (M,) float array, distance to the nearest atom (angstrom)
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        if self.tree is None:
+            # Radius of a sphere with the volume per atom, enough for most points
+            volume = abs(np.linalg.det(self.lattice))
+            self._build(2.0 * (volume / max(len(self.frac_coords), 1))**(1 / 3))
+        point_shift = np.floor(points).astype(int)
+        point_cart = (points - point_shift) @ self.lattice
+        site_index = np.zeros(len(points), dtype=int)
+        image = np.zeros((len(points), 3), dtype=int)
+        distance = np.full(len(points), np.inf)
+        missing = np.arange(len(points))
+        # Atoms farther than the skin may be missing from the tree, so points
+        # without any atom within the skin are searched again with a thicker skin
+        while len(missing):
+            found_distance, found_point = self.tree.query(point_cart[missing],
+                                                          distance_upper_bound=self.skin, workers=-1)
+            found = np.isfinite(found_distance)
+            done, found_point = missing[found], found_point[found]
+            site_index[done] = self.point_site[found_point]
+            image[done] = (self.point_offset[found_point] - self.cell_shift[site_index[done]]
+                           + point_shift[done])
+            distance[done] = found_distance[found]
+            missing = missing[~found]
+            if len(missing):
+                self._build(2.0 * self.skin)
+        return site_index, image, distance
+
+    def query_sites(self, site_indices, radius):
+        """Neighbors of atoms given by site index, excluding the atoms themselves"""
+        site_indices = np.asarray(site_indices, dtype=int).reshape(-1)
+        return self.query(self.frac_coords[site_indices], radius, center_sites=site_indices)
+
+    def query_points(self, points, radius):
+        """Neighbors of points given in fractional coordinates"""
+        return self.query(points, radius)
+
+
+def split_by_center(center, num_centers, *arrays):
+    """
+    Split flat query results into one tuple of arrays per center.
+
+    input:
+    center: (K,) sorted int array from PeriodicNeighborSearch.query
+    num_centers: number of centers in the query
+    arrays: other (K,...) arrays from the same query
+
+    output:
+    list of num_centers tuples, each holding the slices of arrays
+    """
+    bounds = np.searchsorted(center, np.arange(num_centers + 1))
+    return [tuple(array[bounds[i]:bounds[i + 1]] for array in arrays)
+            for i in range(num_centers)]
@@ -1,65 +1,42 @@
 """
 ## Command:
-python selective_dynamics.py [POSCAR_filename] [optional:atom labels to get neighbors] [optional:radius of search]
+python neighbors.py [POSCAR_filename] [optional:atom labels to get neighbors] [optional:radius of search]
 
 [POSCAR_filename]:
     POSCAR file that the user want to get coordinates
+    ** An XDATCAR can also be given. Neighbors are then listed for every frame
 [optional:atom labels to get neighbors]:
     follows VESTA-like labels. Separated by spaces
     ex) Si1 Si2 Si47 O28
     ** coordinates can also be input
     All of [0.1,0.1,0.1], (0.2,0.1,0.3), 0.1,0.2,0.3 format work
+    ** any selection of selection.py works, quoted as one argument
+    ex) 'O* and within 3 of 0.1,0.1,0.1', 'Si* and z>0.5'
 [optional:radius of search]:
     ex) r=2.5 
     Default is 2.5 ang.
+[optional:--format]:
+    --format=json, --format=csv or --format=npz writes the 'neighbors' table
+    of output_format.py instead of printing, one row per neighbor of each center
 """
 
 import sys
-import numpy as np
-from pymatgen.core import Structure
-import pandas as pd
-import re
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from poscar_io import is_xdatcar, XdatcarReader
+from structure_server import query, neighbor_rows, neighbor_columns
+from output_format import output, as_arrays
+from selection import split_centers
+profiler.mark('import')
 
 #sys.argv=['test','CONTCAR','[0.1,0.1,0.1]','Si1','Si2','O1','r=2']
 # sys.argv=['test','CONTCAR','Si1','0.2,0.1,', '0.1','Si1','Si2','O1','r=2']
 #print(sys.argv[0])
 
-radius=None
-for i in range(len(sys.argv)):
-    if 'r=' in sys.argv[i]:
-        radius=float(sys.argv[i].split('=')[1])
-        # Once parsed, remove from the sys.argv
-        sys.argv.remove(sys.argv[i])
-if radius == None:
-    radius=2.5
-
-def create_df(pmg_struct):
-	"""
-	input:
-	pmg_struct: pymatgen structure. Structure containing organic molecule to rotate
-
-	output:
-	dataframe: Pandas DataFrame 
-		with columns=['site_index','atom_label','pmg_site','element']
-	"""
-	n_atom_count_dict=dict()
-	dataframe=pd.DataFrame(columns=['site_index','atom_label','pmg_site','element'])
-	for i in range(0,pmg_struct.num_sites):
-	    # Update label for each element
-	    if pmg_struct[i].specie in list(n_atom_count_dict.keys()):
-	        n_atom_count_dict.update({pmg_struct[i].specie:n_atom_count_dict[pmg_struct[i].specie]+1})
-	    else:
-	        n_atom_count_dict.update({pmg_struct[i].specie:1})
-	        
-	    label='{0}{1}'.format(pmg_struct.species[i], n_atom_count_dict[pmg_struct[i].specie])
-	    # Append a site to the data frame
-	    # If this part is costly, maybe using pd.concat would be faster (not sure yet)
-	    dataframe= dataframe.append({'site_index':i, \
-	                'atom_label':'{0}'.format(label), \
-	                'pmg_site':pmg_struct.sites[i],\
-	                'element':str((pmg_struct.sites[i]).specie)},ignore_index=True)
-
-	return dataframe
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('r',))
+radius=float(options.get('r', 2.5))
 
 ##############################################################################
 ########## Read POSCAR file and indexing each line with atom label
@@ -85,20 +62,14 @@ elif len(sys.argv) >= 3:
 ##############################################################################
 ########## Additional treatment in case user put in coordinates
 ##############################################################################
-atom_list=[]
-flag_add_to_last=0
-for i,entry in enumerate(entry_list):
-    if flag_add_to_last ==0:
-        atom_list.append(entry)
-    else: 
-        atom_list[-1]=atom_list[-1]+entry
-    
-    if ',' in entry[-1]:
-        flag_add_to_last=1
-    else:
-        flag_add_to_last=0
-    
-if len(atom_list)==0:
+# Coordinates (Cartesian, angstrom) are parsed, selections between them are kept as they are
+try:
+    centers=split_centers(entry_list)
+except ValueError as error:
+    print(error.args[0])
+    sys.exit()
+
+if len(centers)==0:
     print('No atom labels are provided')
     sys.exit()
 
@@ -106,42 +77,64 @@ if len(atom_list)==0:
 ########## Find neighbors & print
 ##############################################################################
 
-struct = Structure.from_file(sys.argv[1])
-df=create_df(struct)
+def print_rows(rows):
+    """Print [center, x, y, z, neighbors] rows of structure_server.neighbor_rows"""
+    for center, x, y, z, neighbors in rows:
+        if isinstance(center, str):
+            print("   {0:>5}      | {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  ----- ".format(center,x,y,z))
+        else:
+            print("     coords   | {0: 5.4f} {1: 5.4f} {2: 5.4f}  |  ----- ".format(x,y,z))
+        for label, nx, ny, nz, dist in neighbors:
+            print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:<6.3f}".format(label,nx,ny,nz,dist))
+
+try:
+    # An XDATCAR is processed frame by frame, keeping one frame in memory
+    if is_xdatcar(sys.argv[1]):
+        from neighbor_search import PeriodicNeighborSearch
+        trajectory = XdatcarReader(sys.argv[1])
+        if output.format is None:
+            print("   Atom label |     x       y       z    | Distance ")
+            print("  ────────────┼──────────────────────────┼──────────")
+        for step, lattice, frac_coords in trajectory.frames():
+            frame = LabeledStructure(lattice, trajectory.species, frac_coords)
+            profiler.mark('parse')
+            if output.format is not None:
+                columns = neighbor_columns(frame, PeriodicNeighborSearch(lattice, frac_coords), centers, radius)
+                columns['step'][:] = step
+                profiler.mark('neighbors')
+                output.write('neighbors', columns)
+                profiler.mark('write')
+                continue
+            print("    Step {0:<5}|                          |".format(step))
+            rows = neighbor_rows(frame, PeriodicNeighborSearch(lattice, frac_coords), centers, radius)
+            profiler.mark('neighbors')
+            print_rows(rows)
+            profiler.mark('print')
+        sys.exit()
+
+    # Answered by the structure server if one is running (structure_server.py)
+    # Columns of arrays are asked instead of rows for machine-readable output (output_format.py)
+    rows = query({'op': 'neighbors', 'file': sys.argv[1], 'centers': centers, 'radius': radius,
+                  'columns': output.format is not None})
+    if rows is None:
+        from neighbor_search import PeriodicNeighborSearch
+        labeled = LabeledStructure.from_file(sys.argv[1])
+        profiler.mark('parse')
+        rows = (neighbor_rows if output.format is None else neighbor_columns)(
+            labeled, PeriodicNeighborSearch.from_labeled(labeled), centers, radius)
+    elif output.format is not None:
+        rows = as_arrays('neighbors', rows)
+    profiler.mark('neighbors')
+except (KeyError, ValueError) as error:
+    print(error.args[0])
+    sys.exit()
+
+if output.format is not None:
+    output.write('neighbors', rows)
+    profiler.mark('write')
+    sys.exit()
 
 print("   Atom label |     x       y       z    | Distance ")
 print("  ────────────┼──────────────────────────┼──────────")
-# list of (3,) numpy arrays
-coordinate_list=[]
-for atom_label in atom_list:
-    # If label is atom label like 'Si1'
-    if atom_label[0].isalpha():
-        A1=df[df['atom_label']==atom_label]['pmg_site'].iloc[0]
-        temp_array=A1.frac_coords
-        print("   {0:>5}      | {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  ----- ".format(atom_label,temp_array[0],temp_array[1],temp_array[2]))
-        neighbors=struct.get_neighbors(A1,r=radius)
-        
-        for A2 in neighbors:
-            A2.to_unit_cell(in_place=True)
-            temp_array=A2.frac_coords
-            # temp_list = lines[index_dict[atom_label]].split()
-            # coordinate_list.append(np.array([float(i) for i in temp_list]))
-            # temp_array=np.array([float(i) for i in temp_list])
-            print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:<6.3f}"
-                  .format(df[df['pmg_site']==A2]['atom_label'].iloc[0],
-                          temp_array[0],temp_array[1],temp_array[2], A1.distance(A2) ))
-    # If entry is coordinate
-    else:
-        array=np.array(eval(atom_label))
-        print("     coords   | {0: 5.4f} {1: 5.4f} {2: 5.4f}  |  ----- ".format(array[0],array[1],array[2]))
-        neighbors=struct.get_sites_in_sphere(array,r=radius)
-        for A2_tuple in neighbors:
-            A2=A2_tuple[0]
-            A2.to_unit_cell(in_place=True)
-            temp_array=A2.frac_coords
-            # temp_list = lines[index_dict[atom_label]].split()
-            # coordinate_list.append(np.array([float(i) for i in temp_list]))
-            # temp_array=np.array([float(i) for i in temp_list])
-            print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:<6.3f}"
-                  .format(df[df['pmg_site']==A2]['atom_label'].iloc[0],
-                          temp_array[0],temp_array[1],temp_array[2], A2_tuple[1] ))
+print_rows(rows)
+profiler.mark('print')
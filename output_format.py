@@ -0,0 +1,177 @@
+"""
+Machine-readable output of the table-printing scripts.
+
+With --format=json, --format=csv or --format=npz (or --format json),
+coordinate.py, neighbors.py, perturb.py and compare_POSCAR.py write their
+results as named columns, taken directly from the arrays they were computed
+from, instead of printing a table. One row is one atom (or one pair of a
+center and its neighbor); the columns of each table are fixed in SCHEMAS.
+
+json  one line {"table": ..., "columns": {column: list}} per result, so an
+      XDATCAR gives one line per frame
+csv   a header, then one line per row. Columns of three components such as
+      frac_coords are split into frac_coords_x, frac_coords_y, frac_coords_z
+npz   one array per column, written at exit (numpy.load reads it as it is)
+
+The output goes to stdout, or to a file with --output=FILE. Indices count
+atoms from 0 in the site order of the structure file; coordinates are
+fractional unless named cart, and distances are in angstrom.
+"""
+
+import atexit
+import json
+import sys
+from itertools import chain
+
+import numpy as np
+
+FORMATS = ('json', 'csv', 'npz')
+
+# Columns of each table, in order
+SCHEMAS = {
+    'coordinates': ('label', 'index', 'line', 'frac_coords'),
+    'neighbors': ('step', 'center', 'center_label', 'center_index', 'center_frac_coords',
+                  'label', 'index', 'frac_coords', 'image', 'distance'),
+    'perturb': ('member', 'seed', 'center_label', 'center_index', 'center_cart_coords',
+                'label', 'index', 'frac_coords', 'image', 'distance', 'displacement'),
+    'compare': ('label', 'index', 'label2', 'index2', 'distance', 'vector',
+                'frac_coords', 'frac_coords2'),
+    'trajectory': ('step', 'label', 'index', 'label2', 'index2', 'distance', 'vector',
+                   'frac_coords', 'frac_coords2'),
+}
+# Columns of three components: coordinates, lattice translations and Cartesian vectors
+VECTOR_COLUMNS = {'frac_coords', 'frac_coords2', 'center_frac_coords', 'center_cart_coords',
+                  'image', 'vector', 'displacement'}
+# Rows formatted at once in csv
+CHUNK_SIZE = 65536
+
+
+def as_arrays(table, columns):
+    """
+    Columns of a table as numpy arrays, ex) from the JSON answer of the
+    structure server. Vector columns are (N,3) even when empty
+    """
+    arrays = dict()
+    for name in SCHEMAS[table]:
+        array = np.asarray(columns[name])
+        if name in VECTOR_COLUMNS:
+            array = array.reshape(-1, 3)
+        elif array.size == 0 and name in ('label', 'label2', 'center_label'):
+            array = array.astype(str)
+        arrays[name] = array
+    return arrays
+
+
+def _csv_columns(table, columns):
+    """Flat (name, 1-D array) pairs of a table, vector columns split into x, y, z"""
+    for name in SCHEMAS[table]:
+        array = np.asarray(columns[name])
+        if name in VECTOR_COLUMNS:
+            for axis, suffix in enumerate('xyz'):
+                yield name + '_' + suffix, array.reshape(-1, 3)[:, axis]
+        else:
+            yield name, array
+
+
+def _csv_conversion(array):
+    if array.dtype.kind in 'iub':
+        return '%d'
+    if array.dtype.kind == 'f':
+        return '%.10g'
+    return '%s'
+
+
+class Output:
+    """
+    attributes:
+    format: 'json', 'csv' or 'npz', or None to print tables
+    target: file written to, or None for stdout
+    """
+
+    def __init__(self, format=None, target=None):
+        if format is not None and format not in FORMATS:
+            raise ValueError("Output format should be one of {0}, not {1}".format(', '.join(FORMATS), format))
+        self.format = format
+        self.target = target
+        self.stream = None
+        self.headers = set()
+        self.pending = dict()
+        if format is not None:
+            atexit.register(self.close)
+
+    @classmethod
+    def from_argv(cls, argv):
+        """Build from --format and --output arguments, which are removed from argv"""
+        format = target = None
+        i = 1
+        while i < len(argv):
+            if argv[i] == '--format' and i + 1 < len(argv):
+                format = argv[i + 1]
+                del argv[i:i + 2]
+            elif argv[i].startswith('--format='):
+                format = argv.pop(i).split('=', 1)[1]
+            elif argv[i].startswith('--output='):
+                target = argv.pop(i).split('=', 1)[1]
+            else:
+                i += 1
+        return cls(format, target)
+
+    def _stream(self, binary=False):
+        if self.stream is None:
+            if self.target is not None:
+                self.stream = open(self.target, 'wb' if binary else 'w')
+            else:
+                self.stream = sys.stdout.buffer if binary else sys.stdout
+        return self.stream
+
+    def write(self, table, columns):
+        """
+        input:
+        table: name of the table in SCHEMAS
+        columns: dict of column name -> array, with the same number of rows
+        """
+        missing = set(SCHEMAS[table]) - set(columns)
+        if missing:
+            raise ValueError("Columns {0} of table {1} are missing".format(', '.join(sorted(missing)), table))
+        if self.format == 'json':
+            record = {'table': table,
+                      'columns': {name: np.asarray(columns[name]).tolist() for name in SCHEMAS[table]}}
+            self._stream().write(json.dumps(record) + '\n')
+        elif self.format == 'csv':
+            names, arrays = zip(*_csv_columns(table, columns))
+            stream = self._stream()
+            if table not in self.headers:
+                stream.write(','.join(names) + '\n')
+                self.headers.add(table)
+            # One format string for a whole chunk of rows, filled from the flat column values
+            line = ','.join(_csv_conversion(array) for array in arrays) + '\n'
+            for start in range(0, len(arrays[0]), CHUNK_SIZE):
+                values = [array[start:start + CHUNK_SIZE].tolist() for array in arrays]
+                stream.write((line * len(values[0])) % tuple(chain.from_iterable(zip(*values))))
+        else:
+            self.pending.setdefault(table, []).append({name: np.asarray(columns[name])
+                                                       for name in SCHEMAS[table]})
+
+    def close(self):
+        """Write the npz arrays, and close the output file"""
+        if self.format == 'npz' and self.pending:
+            arrays = dict()
+            for table, parts in self.pending.items():
+                for name in SCHEMAS[table]:
+                    arrays[name] = np.concatenate([part[name] for part in parts])
+            arrays['table'] = np.array(list(self.pending))
+            np.savez(self._stream(binary=True), **arrays)
+            self.pending = dict()
+        if self.stream is not None:
+            self.stream.flush()
+            if self.target is not None:
+                self.stream.close()
+            self.stream = None
+
+
+# Shared by the scripts. Importing this module removes the output arguments from sys.argv
+try:
+    output = Output.from_argv(sys.argv)
+except ValueError as error:
+    print(error.args[0])
+    sys.exit()
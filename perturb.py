@@ -1,63 +1,57 @@
 """
 ## Command:
-python selective_dynamics.py [POSCAR_filename] [optional:atom labels to get neighbors] [optional:radius of search]
+python perturb.py [POSCAR_filename] [atom label or coordinates] [optional:radius of search]
+                  [optional:number of structures] [optional:seed] [optional:out]
 
 [POSCAR_filename]:
-    POSCAR file that the user want to get coordinates
-[optional:atom labels to get neighbors]:
-    follows VESTA-like labels. Separated by spaces
-    ex) Si1 Si2 Si47 O28
+    POSCAR file that the user want to perturb
+[atom label or coordinates]:
+    follows VESTA-like labels, ex) Si1
+    ** Cartesian coordinates (angstrom) can also be input, ex) 0.1,0.1,0.1
+    ** any selection of selection.py works, quoted as one argument,
+    ex) 'Ge* and z>0.5'. Neighbors of the first atom or coordinates are perturbed
 [optional:radius of search]:
     ex) r=2.5 
-    Default is 2.5 ang.
+    Default is 3.5 ang.
+[optional:number of structures]:
+    ex) n=100
+    Ensemble mode: the neighbor search is done once, and displacements of all
+    structures are drawn together. POSCAR files and manifest.csv are written in [out]
+[optional:seed]:
+    ex) seed=42
+    Seed of the random number generator. A new seed is drawn and printed if not given
+[optional:out]:
+    ex) out=PERTURBED
+    Output directory of ensemble mode. Default is [POSCAR_filename]_ENSEMBLE
+[optional:--format]:
+    --format=json, --format=csv or --format=npz writes the 'perturb' table of
+    output_format.py instead of printing, one row per neighbor of each structure.
+    POSCAR files are written as usual
 """
 
+import os
 import sys
 import numpy as np
-from pymatgen.core import Structure, Element
-import pandas as pd
-#from pymatgen.util.coord import pbc_shortest_vectors
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from neighbor_search import PeriodicNeighborSearch
+from output_format import output
+from perturbation import new_seed, unique_neighbors, random_displacements
+from poscar_io import write_poscar, write_poscars
+from selection import split_centers, expand_centers
+from symmetry import get_space_group_info
+profiler.mark('import')
 
 #sys.argv=['test','PERTURBED_initial_H-.vasp','0,0,0','r=3']
 #sys.argv=['test','CONTCAR','Si1','r=3.5']
 #print(sys.argv[0])
 
-radius=None
-for i in range(len(sys.argv)):
-    if 'r=' in sys.argv[i]:
-        radius=float(sys.argv[i].split('=')[1])
-        # Once parsed, remove from the sys.argv
-        sys.argv.remove(sys.argv[i])
-if radius == None:
-    radius=3.5
-
-def create_df(pmg_struct):
-	"""
-	input:
-	pmg_struct: pymatgen structure. Structure containing organic molecule to rotate
-
-	output:
-	dataframe: Pandas DataFrame 
-		with columns=['site_index','atom_label','pmg_site','element']
-	"""
-	n_atom_count_dict=dict()
-	dataframe=pd.DataFrame(columns=['site_index','atom_label','pmg_site','element'])
-	for i in range(0,pmg_struct.num_sites):
-	    # Update label for each element
-	    if pmg_struct[i].specie in list(n_atom_count_dict.keys()):
-	        n_atom_count_dict.update({pmg_struct[i].specie:n_atom_count_dict[pmg_struct[i].specie]+1})
-	    else:
-	        n_atom_count_dict.update({pmg_struct[i].specie:1})
-	        
-	    label='{0}{1}'.format(pmg_struct.species[i], n_atom_count_dict[pmg_struct[i].specie])
-	    # Append a site to the data frame
-	    # If this part is costly, maybe using pd.concat would be faster (not sure yet)
-	    dataframe= dataframe.append({'site_index':i, \
-	                'atom_label':'{0}'.format(label), \
-	                'pmg_site':pmg_struct.sites[i],\
-	                'element':str((pmg_struct.sites[i]).specie)},ignore_index=True)
-
-	return dataframe
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('r', 'n', 'seed', 'out'))
+radius=float(options.get('r', 3.5))
+num_structures=int(options['n']) if 'n' in options else None
+seed=int(options['seed']) if 'seed' in options else new_seed()
 
 ##############################################################################
 ########## Read POSCAR file and indexing each line with atom label
@@ -82,18 +76,15 @@ elif len(sys.argv) >= 3:
 ##############################################################################
 ########## Additional treatment in case user put in coordinates
 ##############################################################################
-atom_list=[]
-flag_add_to_last=0
-for i,entry in enumerate(entry_list):
-    if flag_add_to_last ==0:
-        atom_list.append(entry)
-    else: 
-        atom_list[-1]=atom_list[-1]+entry
-    
-    if ',' in entry[-1]:
-        flag_add_to_last=1
-    else:
-        flag_add_to_last=0
+labeled = LabeledStructure.from_file(sys.argv[1])
+profiler.mark('parse')
+
+# Atom labels of the selections, and [x, y, z] coordinates (Cartesian, angstrom)
+try:
+    atom_list=expand_centers(labeled, split_centers(entry_list))
+except (KeyError, ValueError) as error:
+    print(error.args[0])
+    sys.exit()
 
 if len(atom_list)==0:
     print('No atom labels are provided')
@@ -103,153 +94,167 @@ if len(atom_list)==0:
 ########## Find neighbors & print
 ##############################################################################
 
-struct = Structure.from_file(sys.argv[1])
+# Space group of the input is cached, as the same host is perturbed many times
+original_SG = get_space_group_info(labeled,symprec=1e-2,angle_tolerance=0.1)[0]
+profiler.mark('symmetry')
+neighbor_search = PeriodicNeighborSearch.from_labeled(labeled)
 
-original_SG = struct.get_space_group_info(symprec=1e-2,angle_tolerance=0.1)[0]
-df=create_df(struct)
+# Neighbors are printed with coordinates inside the unit cell
+unit_frac_coords = np.mod(labeled.frac_coords, 1.0)
 
-lattice_vector = np.array([struct.lattice.a,struct.lattice.b,struct.lattice.c])
+# Tables are not printed for machine-readable output (output_format.py)
+if output.format is None:
+    print("   Atom label |     x       y       z    | Distance ")
+    print("   ───────────┼──────────────────────────┼──────────")
+    print("    Before    | Space group: {0:<8}    |".format(original_SG))
+    for atom_label in atom_list:
+        # If label is atom label like 'Si1'
+        if isinstance(atom_label, str):
+            center=labeled.index(atom_label)
+            temp_array=labeled.frac_coords[center]
+            print("   {0:>5}      | {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  ------ ".format(atom_label,temp_array[0],temp_array[1],temp_array[2]))
+            # (site_index, image, distance) of each neighbor
+            _, *neighbors = neighbor_search.query_sites([center], radius)
+        # If entry is coordinate (Cartesian, angstrom)
+        else:
+            center=np.array(atom_label)
+            print("     coords   | {0: 5.4f} {1: 5.4f} {2: 5.4f}  |  ------ ".format(center[0],center[1],center[2]))
+            _, *neighbors = neighbor_search.query_points(labeled.get_frac_coords(center), radius)
+        # Each neighbor once, at its nearest image, as it is perturbed
+        site_index, image, distance = unique_neighbors(*neighbors)
 
-print("   Atom label |     x       y       z    | Distance ")
-print("   ───────────┼──────────────────────────┼──────────")
-print("    Before    | Space group: {0:<8}    |".format(original_SG))
-# list of (3,) numpy arrays
-coordinate_list=[]
-for atom_label in atom_list:
-    # If label is atom label like 'Si1'
-    if atom_label[0].isalpha():
-        A1=df[df['atom_label']==atom_label]['pmg_site'].iloc[0]
-        temp_array=A1.frac_coords
-        print("   {0:>5}      | {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  ------ ".format(atom_label,temp_array[0],temp_array[1],temp_array[2]))
-        neighbors=struct.get_neighbors(A1,r=radius)
-        
-        for A2 in neighbors:
-            A2.to_unit_cell(in_place=True)
-            temp_array=A2.frac_coords
-            # temp_list = lines[index_dict[atom_label]].split()
-            # coordinate_list.append(np.array([float(i) for i in temp_list]))
-            # temp_array=np.array([float(i) for i in temp_list])
+        for j, dist in zip(site_index, distance):
+            temp_array=unit_frac_coords[j]
             print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:6.4f}"
-                  .format(df[df['pmg_site']==A2]['atom_label'].iloc[0],
-                          temp_array[0],temp_array[1],temp_array[2], A1.distance(A2) ))
-    # If entry is coordinate
-    else:
-        array=np.array(eval(atom_label))
-        print("     coords   | {0: 5.4f} {1: 5.4f} {2: 5.4f}  |  ------ ".format(array[0],array[1],array[2]))
-        neighbors=struct.get_sites_in_sphere(array,r=radius)
-        for A2_tuple in neighbors:
-            A2=A2_tuple[0]
-            A2.to_unit_cell(in_place=True)
-            temp_array=A2.frac_coords
-            # temp_list = lines[index_dict[atom_label]].split()
-            # coordinate_list.append(np.array([float(i) for i in temp_list]))
-            # temp_array=np.array([float(i) for i in temp_list])
-            print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:6.4f}"
-                  .format(df[df['pmg_site']==A2]['atom_label'].iloc[0],
-                          temp_array[0],temp_array[1],temp_array[2], A2_tuple[1] ))
-            
+                  .format(labeled.label(j),
+                          temp_array[0],temp_array[1],temp_array[2], dist ))
 
-print_list=[]
+##############################################################################
+########## Perturb neighbors of the first entry
+##############################################################################
 # If label is atom label like 'Si1'
-if atom_list[0][0].isalpha():
+if isinstance(atom_list[0], str):
     A1_label=atom_list[0]
-    A1=df[df['atom_label']==A1_label]['pmg_site'].iloc[0]
-    neighbors=struct.get_neighbors(A1,r=radius)
-    for A2 in neighbors:
-        A2.to_unit_cell(in_place=True)
-        A2_label=df[df['pmg_site']==A2]['atom_label'].iloc[0]
-        # random numbers
-        random_vector=np.random.ranf([3,])-0.5
-        # coordination dimention is (,3)
-        scaling_factor = min(0.1,0.1/A1.distance(A2) )
-        random_vector = scaling_factor*random_vector/np.linalg.norm(random_vector)
-        # perturbation: diaplace by 0.1 \AA for atoms 1.0 \AA apart from the position
-        A2.frac_coords = A2.frac_coords + random_vector/lattice_vector
-        temp_array=A2.frac_coords
-        struct.sites[df[df['atom_label']==A2_label]['site_index'].iloc[0]].frac_coords=temp_array
-        print_list.append("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:6.4f}"
-                      .format(A2_label,
-                              temp_array[0],temp_array[1],temp_array[2], A1.distance(A2) ))
-        # print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:6.4f}"
-        #               .format(A2_label,
-        #                       temp_array[0],temp_array[1],temp_array[2], A1.distance(A2) ))
+    center=labeled.index(A1_label)
+    center_cart=labeled.cart_coords[center]
+    _, *neighbors = neighbor_search.query_sites([center], radius)
 # If entry is coordinate
-else:        
-    position_array=np.array(eval(atom_label))
-    neighbors=struct.get_sites_in_sphere(position_array,r=radius)
-    for i, A2_tuple in enumerate(neighbors):
-        A2=A2_tuple[0]
-        A2.to_unit_cell(in_place=True)
-        A2_label=df[df['pmg_site']==A2]['atom_label'].iloc[0]
-        random_vector=np.random.ranf([3,])-0.5
-        # coordination dimention is (,3)
-        # scaling factor forces it to be less than 0.1 ang.
-        # + 0.001 is to prevent division by zero
-        scaling_factor=min(0.1, 0.1/(0.001 + A2.distance_from_point(position_array*lattice_vector)))
-        random_vector = scaling_factor * random_vector/np.linalg.norm(random_vector)
-        A2.frac_coords = A2.frac_coords + random_vector/lattice_vector
-        temp_array=A2.frac_coords
-        struct.sites[df[df['atom_label']==A2_label]['site_index'].iloc[0]].frac_coords=temp_array
-        new_distance = (struct.get_sites_in_sphere(position_array,r=radius))[i][1]
-        print_list.append("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:6.4f}"
-              .format(A2_label, temp_array[0], temp_array[1], temp_array[2],
-                      new_distance))
-        # print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:6.4f}"
-        #       .format(A2_label, temp_array[0], temp_array[1], temp_array[2],
-        #               new_distance))
-        
-
-new_SG = struct.get_space_group_info(symprec=1e-2,angle_tolerance=0.1)[0]
-print("   ───────────┼──────────────────────────┼──────────")
-print("    After     | Space group: {0:<8}    |".format(new_SG))
-
-if atom_list[0][0].isalpha():
-    A1=df[df['atom_label']==atom_label]['pmg_site'].iloc[0]
-    temp_array=A1.frac_coords
-    print("   {0:>5}      | {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  ------ ".format(atom_label,temp_array[0],temp_array[1],temp_array[2]))
 else:
-    print("     coords   | {0: 5.4f} {1: 5.4f} {2: 5.4f}  |  ------ ".format(position_array[0],position_array[1],position_array[2]))
-for i in print_list:
-    print(i)
-    
-##############################################################################
-########## Write POSCAR
-##############################################################################  
-# update DataFrame
-label_df=create_df(struct)
-
-# Idenfity lattice vectors
-lattice = struct.lattice.matrix
-# Get element of each atoms
-species_list=struct.species
-# Remove repeated entry in the element list
-reduced_species=[str(i) for n, i in enumerate(species_list) if i not in species_list[:n]]
+    position_array=np.array(atom_list[0])
+    center_cart=position_array
+    _, *neighbors = neighbor_search.query_points(labeled.get_frac_coords(position_array), radius)
+# A neighbor seen through several periodic images is perturbed once
+site_index, image, distance = unique_neighbors(*neighbors)
+
+profiler.mark('neighbors')
+
+# Displacements of all structures in one (M, k, 3) array
+rng=np.random.default_rng(seed)
+frac_displacements=random_displacements(rng, distance, labeled.lattice, num_structures or 1)
+# (M, k, 3) perturbed coordinates of neighbors, inside the unit cell
+neighbor_frac_coords=unit_frac_coords[site_index] + frac_displacements
+# (M, k) new distance from the center, using the image found by the neighbor search
+new_cart=(labeled.frac_coords[site_index] + image + frac_displacements) @ labeled.lattice
+new_distance=np.linalg.norm(new_cart - center_cart, axis=2)
+
+def perturb_columns():
+    """
+    Columns of the 'perturb' table of output_format.py: one row per neighbor of each structure.
+    frac_coords + image is the perturbed neighbor at distance from the center
+    """
+    num_members, k = new_distance.shape
+    is_label=isinstance(atom_list[0], str)
+    return {'member': np.repeat(np.arange(num_members), k),
+            'seed': np.full(num_members*k, seed),
+            'center_label': np.full(num_members*k, atom_list[0] if is_label else ''),
+            'center_index': np.full(num_members*k, labeled.index(atom_list[0]) if is_label else -1),
+            'center_cart_coords': np.tile(center_cart, (num_members*k, 1)),
+            'label': np.tile(labeled.labels[site_index], num_members),
+            'index': np.tile(site_index, num_members),
+            'frac_coords': neighbor_frac_coords.reshape(-1, 3),
+            # Image of the unit cell coordinates, from the image of the neighbor search
+            'image': np.tile(image + np.rint(labeled.frac_coords[site_index] - unit_frac_coords[site_index]).astype(int),
+                             (num_members, 1)),
+            'distance': new_distance.reshape(-1),
+            'displacement': (frac_displacements @ labeled.lattice).reshape(-1, 3)}
+
+def perturbed_structure(m):
+    """LabeledStructure of m-th perturbed structure"""
+    new_frac_coords=labeled.frac_coords.copy()
+    new_frac_coords[site_index]=neighbor_frac_coords[m]
+    return LabeledStructure(labeled.lattice, labeled.species, new_frac_coords)
+
+profiler.mark('perturb')
 
 if sys.argv[1][-5::]=='.vasp':
     filename = sys.argv[1][:-5]+'_PERTURBED'+sys.argv[1][-5::]
 else:
     filename = sys.argv[1]+'_PERTURBED'
-    
-out_file=open(filename,'w')
-out_file.write("Perturbed POSCAR file from {0}\n".format(sys.argv[1])) #first comment line
-out_file.write("1.0\n") # scale 
-# Print lattice part
-for i in range(np.shape(lattice)[0]):
-    out_file.write("{0:20.10f} {1:20.10f} {2:20.10f}\n".format(lattice[i,0],lattice[i,1],lattice[i,2]))
-# Print elements
-out_file.write("  "+" ".join('%4s' % entry for entry in reduced_species))
-out_file.write("\n")
-# Print the number of atoms for each element
-num_each_element=[species_list.count(Element(i)) for i in reduced_species]
-out_file.write("  "+" ".join('%4d' % entry for entry in num_each_element))
-out_file.write("\n")
-
-out_file.write("Direct\n")
-for element in reduced_species:
-    site_list=label_df[label_df['element']==element]['pmg_site']
-    for site in site_list:
-        out_file.write("  "+"        ".join('%.10f' % entry for entry in site.frac_coords)+'\n')
-out_file.close()
+
+# Ensemble directory, named apart from the POSCAR written in single mode
+out_dir=options.get('out', (sys.argv[1][:-5] if sys.argv[1][-5::]=='.vasp' else sys.argv[1])+'_ENSEMBLE')
+if num_structures is not None and os.path.exists(out_dir) and not os.path.isdir(out_dir):
+    print('{0} is a file, give another output directory with out='.format(out_dir))
+    sys.exit()
+if num_structures is None and os.path.isdir(filename):
+    print('{0} is a directory, the perturbed structure cannot be written'.format(filename))
+    sys.exit()
+
+##############################################################################
+########## Ensemble mode: write M perturbed POSCARs and manifest
+##############################################################################
+if num_structures is not None:
+    os.makedirs(out_dir, exist_ok=True)
+    width=len(str(num_structures))
+    if output.format is None:
+        print("   ───────────┼──────────────────────────┼──────────")
+        print("    Ensemble  | {0} structures, seed {1}".format(num_structures, seed))
+    center_name=atom_list[0] if isinstance(atom_list[0], str) else ' '.join(map(str, atom_list[0]))
+    members=[perturbed_structure(m) for m in range(num_structures)]
+    member_names=['POSCAR_{0:0{1}d}.vasp'.format(m+1, width) for m in range(num_structures)]
+    write_poscars(out_dir, member_names, members,
+                  comments=["Perturbed POSCAR file from {0} (seed {1}, member {2})".format(sys.argv[1],seed,m)
+                            for m in range(num_structures)])
+    profiler.mark('write')
+    with open(os.path.join(out_dir,'manifest.csv'),'w') as manifest:
+        # Structure m is the m-th slice of the (M, k, 3) draw from this seed
+        manifest.write("filename,seed,member,num_structures,center,radius,space_group\n")
+        for m, (member_name, perturbed) in enumerate(zip(member_names, members)):
+            new_SG=get_space_group_info(perturbed,symprec=1e-2,angle_tolerance=0.1,disk_cache=False)[0]
+            manifest.write("{0},{1},{2},{3},{4},{5},{6}\n".format(member_name,seed,m,num_structures,
+                                                                center_name,radius,new_SG))
+    profiler.mark('symmetry')
+    if output.format is not None:
+        output.write('perturb', perturb_columns())
+        profiler.mark('write')
+        sys.exit()
+    print("")
+    print('  {0} perturbed structures and manifest.csv were written in {1}'.format(num_structures,out_dir))
+    sys.exit()
+
+##############################################################################
+########## Single structure: print & write POSCAR
+##############################################################################
+perturbed=perturbed_structure(0)
+write_poscar(filename, perturbed, comment="Perturbed POSCAR file from {0}".format(sys.argv[1]))
+profiler.mark('write')
+if output.format is not None:
+    output.write('perturb', perturb_columns())
+    sys.exit()
+
+new_SG = get_space_group_info(perturbed,symprec=1e-2,angle_tolerance=0.1,disk_cache=False)[0]
+profiler.mark('symmetry')
+print("   ───────────┼──────────────────────────┼──────────")
+print("    After     | Space group: {0:<8}    |".format(new_SG))
+
+if isinstance(atom_list[0], str):
+    temp_array=labeled.frac_coords[labeled.index(A1_label)]
+    print("   {0:>5}      | {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  ------ ".format(A1_label,temp_array[0],temp_array[1],temp_array[2]))
+else:
+    print("     coords   | {0: 5.4f} {1: 5.4f} {2: 5.4f}  |  ------ ".format(position_array[0],position_array[1],position_array[2]))
+for j, temp_array, dist in zip(site_index, neighbor_frac_coords[0], new_distance[0]):
+    print("      └ {0:<6}| {1: 5.4f} {2: 5.4f} {3: 5.4f}  |  {4:6.4f}"
+          .format(labeled.label(j), temp_array[0], temp_array[1], temp_array[2], dist))
 
 print("")
-print('  Perturbed structure was written as {0}'.format(filename))
+print('  Perturbed structure was written as {0} (seed {1})'.format(filename, seed))
@@ -0,0 +1,52 @@
+"""
+Random perturbation of atoms around a defect, drawn for many structures at once.
+
+Each neighbor is displaced in a random direction by
+min(0.1, 0.1/distance) angstrom, where distance is measured from the
+center, so closer atoms move up to 0.1 angstrom and farther atoms less.
+"""
+
+import numpy as np
+
+
+def new_seed():
+    """Fresh random seed, to be recorded so that a run can be reproduced"""
+    return int(np.random.SeedSequence().entropy)
+
+
+def unique_neighbors(site_index, image, distance):
+    """
+    Neighbors reached through several periodic images, as in small cells,
+    are kept once, at their nearest image, so each atom is displaced once.
+
+    input:
+    site_index, image, distance: (k,), (k,3), (k,) arrays of one center
+        from neighbor_search.PeriodicNeighborSearch, sorted by distance
+
+    output:
+    (site_index, image, distance) without repeated sites, in the same order
+    """
+    first = np.sort(np.unique(site_index, return_index=True)[1])
+    return site_index[first], image[first], distance[first]
+
+
+def random_displacements(rng, distance, lattice, num_structures=1):
+    """
+    input:
+    rng: numpy Generator, ex) np.random.default_rng(seed)
+    distance: (k,) array, distance of each neighbor from the center (angstrom)
+    lattice: (3,3) array, lattice vectors in rows (angstrom)
+    num_structures: number of perturbed structures M
+
+    output:
+    (M,k,3) array of displacements in fractional coordinates
+    """
+    distance = np.asarray(distance, dtype=float)
+    random_vector = rng.random((num_structures, len(distance), 3)) - 0.5
+    # scaling factor forces it to be less than 0.1 ang.
+    # + 0.001 is to prevent division by zero
+    scaling_factor = np.minimum(0.1, 0.1 / (0.001 + distance))
+    random_vector = (scaling_factor[None, :, None] * random_vector
+                     / np.linalg.norm(random_vector, axis=2, keepdims=True))
+    # Each component is converted with the length of its lattice vector
+    return random_vector / np.linalg.norm(lattice, axis=1)
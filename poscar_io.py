@@ -0,0 +1,509 @@
+"""
+Pure-numpy reader of VASP POSCAR/CONTCAR files.
+
+The header is read line by line and the coordinate block is converted to
+numpy in one bulk call, so reading a structure does not import pymatgen.
+Supports scale factors (single, negative volume, or one per axis), Direct
+and Cartesian coordinates, selective dynamics flags and velocity blocks.
+
+An opt-in binary cache skips the parsing of files read again and again,
+such as large supercells in batch runs. It is enabled with cache=True, or
+for every read with the environment variable DEFECT_TOOL_CACHE=1. The
+arrays are stored uncompressed in .[filename].npz next to the POSCAR,
+together with the size and modification time of the POSCAR, and later
+reads memory-map the coordinates instead of parsing them. A cache whose
+POSCAR has changed since is rewritten.
+"""
+
+import os
+import zipfile
+from itertools import islice
+
+import numpy as np
+
+from labeled_structure import LabeledStructure
+
+
+def _is_cartesian(line):
+    """Coordinate type line starting with C or K means Cartesian"""
+    return line.strip()[:1] in ('C', 'c', 'K', 'k')
+
+
+def _clean_species(symbol):
+    """'Si_pv' or 'Si/1a2b3c' (POTCAR hash written by VASP 6) --> 'Si'"""
+    return symbol.split('/')[0].split('_')[0]
+
+
+def read_poscar_header(file):
+    """
+    Read the header of a POSCAR from an open file, up to the coordinate type line.
+
+    input:
+    file: file object positioned at the start of a POSCAR
+
+    output:
+    header: dict with keys
+        'comment': first line
+        'lattice': (3,3) array of lattice vectors in rows, scale applied (angstrom)
+        'species': list of element symbols, one per element block
+        'counts': list of number of atoms of each element
+        'selective': True if 'Selective dynamics' is stated
+        'cartesian': True if coordinates are Cartesian
+        'cart_scale': (3,) array, scale of Cartesian x, y, z components
+        'first_coord_line': line index (starting from 0) of the first atom
+    """
+    lines = list(islice(file, 7))
+    if len(lines) < 7:
+        raise ValueError("File is too short to be a POSCAR")
+    comment = lines[0].rstrip('\n')
+    scale = np.array(lines[1].split(), dtype=float)
+    lattice = np.array([line.split()[:3] for line in lines[2:5]], dtype=float)
+
+    # VASP 5 format states element names above the number of atoms
+    if lines[5].split()[0].isdigit():
+        counts = [int(i) for i in lines[5].split()]
+        species = comment.split()
+        if len(species) != len(counts) or not all(name.isalpha() for name in species):
+            raise ValueError("Element names are not stated in the POSCAR (VASP 4 format)")
+        type_line = lines[6]
+        n_header = 6
+    else:
+        species = [_clean_species(name) for name in lines[5].split()]
+        counts = [int(i) for i in lines[6].split()]
+        type_line = file.readline()
+        n_header = 7
+
+    selective = type_line.strip()[:1] in ('S', 's')
+    if selective:
+        type_line = file.readline()
+        n_header += 1
+
+    # Scale: negative value is the volume of the cell,
+    # three values scale the x, y, z components
+    if len(scale) == 3:
+        cart_scale = scale
+    elif scale[0] < 0:
+        cart_scale = np.full(3, (-scale[0] / abs(np.linalg.det(lattice)))**(1 / 3))
+    else:
+        cart_scale = np.full(3, scale[0])
+    lattice = lattice * cart_scale
+
+    return {'comment': comment, 'lattice': lattice, 'species': species, 'counts': counts,
+            'selective': selective, 'cartesian': _is_cartesian(type_line),
+            'cart_scale': cart_scale, 'first_coord_line': n_header + 1}
+
+
+def _read_velocities(file, num_atoms, lattice):
+    """Velocity block after the coordinates, in Cartesian (angstrom/fs), or None"""
+    line = file.readline()
+    while line and not line.strip():
+        line = file.readline()
+    if not line:
+        return None
+    # Lattice velocities of MD with variable cell come first: 1 + 1 + 3 + 3 lines
+    if line.strip()[:1] in ('L', 'l'):
+        for _ in range(7):
+            file.readline()
+        line = file.readline()
+    cartesian = True
+    if line.strip()[:1].isalpha():
+        cartesian = _is_cartesian(line)
+        line = file.readline()
+    block = [line] + list(islice(file, num_atoms - 1))
+    if len(block) < num_atoms or not all(row.strip() for row in block):
+        return None
+    velocities = np.loadtxt(block, usecols=(0, 1, 2), ndmin=2)
+    if not cartesian:
+        velocities = velocities @ lattice
+    return velocities
+
+
+# Version of the cache layout, stored in every cache file
+CACHE_VERSION = 1
+
+
+def cache_enabled():
+    """True if the environment variable DEFECT_TOOL_CACHE enables the binary cache"""
+    return os.environ.get('DEFECT_TOOL_CACHE', '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def cache_filename(filename):
+    """Binary cache of a POSCAR, ex) dir/CONTCAR --> dir/.CONTCAR.npz"""
+    directory, basename = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, '.' + basename + '.npz')
+
+
+def _cache_stamp(filename):
+    """(size, modification time in ns) of a file, as stored in its cache"""
+    stat = os.stat(filename)
+    return np.array([CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _mmap_member(archive, path, name):
+    """
+    Memory-map one array of an uncompressed npz file, with copy-on-write,
+    so that the caller may modify it without touching the file
+    """
+    info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return np.load(archive.open(info))
+    with open(path, 'rb') as file:
+        # Local file header: 30 bytes, then the member name and an extra field
+        file.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(file.read(4), dtype='<u2')
+        file.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    if dtype.hasobject or 0 in shape:
+        return np.load(archive.open(info))
+    return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def _read_cache(filename):
+    """LabeledStructure from the cache of a POSCAR, or None if there is no valid cache"""
+    path = cache_filename(filename)
+    try:
+        with zipfile.ZipFile(path) as archive:
+            with archive.open('stamp.npy') as member:
+                if not np.array_equal(np.lib.format.read_array(member), _cache_stamp(filename)):
+                    return None
+            with archive.open('header.npy') as member:
+                elements, comment = np.lib.format.read_array(member).tolist()
+            with archive.open('counts.npy') as member:
+                counts = np.lib.format.read_array(member)
+            lattice = _mmap_member(archive, path, 'lattice')
+            frac_coords = _mmap_member(archive, path, 'frac_coords')
+            selective_dynamics = None
+            if 'selective_dynamics.npy' in archive.namelist():
+                selective_dynamics = _mmap_member(archive, path, 'selective_dynamics')
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    species = np.repeat(elements.split(), counts)
+    return LabeledStructure(lattice, species, frac_coords,
+                            selective_dynamics=selective_dynamics, comment=comment)
+
+
+def _write_cache(filename, header, labeled):
+    """Store a parsed POSCAR in its cache. Unwritable directories are skipped"""
+    path = cache_filename(filename)
+    arrays = {'stamp': _cache_stamp(filename),
+              'header': np.array([' '.join(header['species']), header['comment']]),
+              'counts': np.asarray(header['counts'], dtype=np.int64),
+              'lattice': labeled.lattice, 'frac_coords': labeled.frac_coords}
+    if labeled.selective_dynamics is not None:
+        arrays['selective_dynamics'] = labeled.selective_dynamics
+    try:
+        # Written to a temporary file first so that readers never see half a file
+        temp_filename = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_filename, 'wb') as cache_file:
+            np.savez(cache_file, **arrays)
+        os.replace(temp_filename, path)
+    except OSError:
+        pass
+
+
+def read_poscar(filename, read_velocities=False, cache=None):
+    """
+    input:
+    filename: POSCAR or CONTCAR file
+    read_velocities: if True, also read the velocity block (None if absent).
+        Velocities are not cached, so the file is always parsed
+    cache: if True, read from and store to the binary cache of the file.
+        Default is the environment variable DEFECT_TOOL_CACHE
+
+    output:
+    LabeledStructure with comment, selective_dynamics ((N,3) bool array or None)
+    and velocities ((N,3) array or None) set
+    """
+    if cache is None:
+        cache = cache_enabled()
+    cache = cache and not read_velocities
+    if cache:
+        labeled = _read_cache(filename)
+        if labeled is not None:
+            return labeled
+
+    with open(filename, 'r') as file:
+        header = read_poscar_header(file)
+        num_atoms = sum(header['counts'])
+        block = list(islice(file, num_atoms))
+        if len(block) < num_atoms:
+            raise ValueError("{0} has fewer coordinates than the number of atoms".format(filename))
+        ncols = 6 if header['selective'] else 3
+        # Whole coordinate block in one call; trailing labels or comments are ignored
+        table = np.loadtxt(block, dtype=str, usecols=range(ncols), ndmin=2, comments=('!', '#'))
+        coords = table[:, :3].astype(float)
+        selective_dynamics = None
+        if header['selective']:
+            selective_dynamics = np.char.upper(table[:, 3:6]) == 'T'
+        velocities = None
+        if read_velocities:
+            velocities = _read_velocities(file, num_atoms, header['lattice'])
+
+    lattice = header['lattice']
+    if header['cartesian']:
+        # Cartesian coordinates are scaled like the lattice
+        frac_coords = (coords * header['cart_scale']) @ np.linalg.inv(lattice)
+    else:
+        frac_coords = coords
+
+    species = np.repeat(header['species'], header['counts'])
+    labeled = LabeledStructure(lattice, species, frac_coords,
+                               selective_dynamics=selective_dynamics,
+                               velocities=velocities, comment=header['comment'])
+    if cache:
+        _write_cache(filename, header, labeled)
+    return labeled
+
+
+def is_xdatcar(filename):
+    """True if the file is an XDATCAR, with 'Direct configuration=' after the header"""
+    with open(filename, 'r') as file:
+        head = list(islice(file, 9))
+    return any('configuration' in line for line in head[6:9])
+
+
+class XdatcarReader:
+    """
+    Frame-by-frame reader of XDATCAR trajectories.
+
+    Only one frame is held in memory at a time, so memory use does not grow
+    with the length of the trajectory. Variable-cell trajectories, where the
+    header is repeated before every frame, are supported. A trajectory that
+    is still being written can be followed with new_frames.
+
+    attributes:
+    lattice: (3,3) array, lattice of the first frame (angstrom)
+    species: (N,) array of element symbols
+    labeled: LabeledStructure of the first frame, None if no frame is written yet
+    position: file position after the last frame read
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'r') as file:
+            self._read_header(file)
+            self.offset = file.tell()
+        self.num_atoms = len(self.species)
+        self.position = self.offset
+        self.labeled = None
+        for _, lattice, frac_coords in self.frames():
+            self.labeled = LabeledStructure(lattice, self.species, frac_coords, comment=self.comment)
+            break
+
+    def _read_header(self, file, comment_line=None):
+        """Read comment, scale, lattice, species and counts lines"""
+        lines = [comment_line if comment_line is not None else file.readline()]
+        lines += [file.readline() for _ in range(6)]
+        if not lines[-1].endswith('\n'):
+            raise ValueError("Header of {0} is not complete".format(self.filename))
+        self.comment = lines[0].rstrip('\n')
+        scale = np.array(lines[1].split(), dtype=float)
+        lattice = np.array([line.split()[:3] for line in lines[2:5]], dtype=float)
+        if len(scale) == 3:
+            lattice = lattice * scale
+        elif scale[0] < 0:
+            lattice = lattice * (-scale[0] / abs(np.linalg.det(lattice)))**(1 / 3)
+        else:
+            lattice = lattice * scale[0]
+        self.lattice = lattice
+        counts = [int(i) for i in lines[6].split()]
+        self.species = np.repeat([_clean_species(name) for name in lines[5].split()], counts)
+
+    def frames(self, offset=None, complete=False):
+        """
+        Generator over frames.
+
+        input:
+        offset: file position to start from. Default is the first frame
+        complete: only yield frames whose lines all end with a newline, for a
+            file that is still being written
+
+        yields:
+        (step, lattice, frac_coords) of each complete frame, where step is the
+        number of the 'Direct configuration=' line
+        """
+        with open(self.filename, 'r') as file:
+            file.seek(self.offset if offset is None else offset)
+            lattice = self.lattice
+            while True:
+                line = file.readline()
+                if not line.strip() or (complete and not line.endswith('\n')):
+                    return
+                if 'configuration' not in line:
+                    # Variable cell: the header is repeated before each frame
+                    self._read_header(file, comment_line=line)
+                    lattice = self.lattice
+                    line = file.readline()
+                cartesian = _is_cartesian(line)
+                step = int(line.split('=')[-1]) if '=' in line else -1
+                block = [file.readline() for _ in range(self.num_atoms)]
+                if not block[-1].strip() or (complete and not block[-1].endswith('\n')):
+                    return
+                coords = np.loadtxt(block, usecols=(0, 1, 2), ndmin=2)
+                if cartesian:
+                    coords = coords @ np.linalg.inv(lattice)
+                self.position = file.tell()
+                yield step, lattice, coords
+
+    def new_frames(self):
+        """
+        Frames appended since the last frame read, for a trajectory that is
+        still being written. Reading starts at self.position, so the cost is
+        proportional to the new data only; a frame that is partly written is
+        read again at the next call.
+
+        output:
+        list of (step, lattice, frac_coords)
+        """
+        size = os.path.getsize(self.filename)
+        if size < self.position:
+            raise ValueError("{0} was rewritten from the start".format(self.filename))
+        if size == self.position:
+            return []
+        frames = []
+        try:
+            for frame in self.frames(self.position, complete=True):
+                frames.append(frame)
+        except (ValueError, IndexError):
+            # The header of a variable-cell frame is partly written
+            pass
+        return frames
+
+
+def _element_order(labeled):
+    """Elements in order of first appearance, their counts, and the site order grouped by element"""
+    _, first, inverse, counts = np.unique(labeled.species, return_index=True,
+                                          return_inverse=True, return_counts=True)
+    rank = np.argsort(np.argsort(first))
+    order = np.argsort(rank[inverse], kind='stable')
+    elements = labeled.species[np.sort(first)]
+    return elements, counts[np.argsort(first)], order
+
+
+def format_poscar(labeled, comment=None, selective_dynamics=None):
+    """
+    POSCAR text of a LabeledStructure, with Direct coordinates.
+
+    Atoms are grouped by element, in order of first appearance, so labels
+    are kept. The whole coordinate block is formatted by one % operation
+    over a repeated line template. Negative zeros are written as zeros, so
+    the same structure always gives the same bytes.
+
+    input:
+    labeled: LabeledStructure to write
+    comment: first line. Default is the comment of labeled
+    selective_dynamics: (N,3) bool array of flags. Default is the flags of
+        labeled; 'Selective dynamics' is written only if flags are given
+
+    output:
+    str, content of the POSCAR file
+    """
+    lattice = labeled.lattice + 0.0
+    elements, counts, order = _element_order(labeled)
+    if selective_dynamics is None:
+        selective_dynamics = labeled.selective_dynamics
+    comment = labeled.comment if comment is None else comment
+
+    text = ["{0}\n".format(comment.rstrip('\n')), "1.0\n"]  # scale
+    # Print lattice part
+    text.append("%20.10f %20.10f %20.10f\n" * 3 % tuple(lattice.ravel().tolist()))
+    # Print elements and the number of atoms for each element
+    text.append("  " + " ".join('%4s' % entry for entry in elements) + "\n")
+    text.append("  " + " ".join('%4d' % entry for entry in counts) + "\n")
+    if selective_dynamics is not None:
+        text.append("Selective dynamics\n")
+    text.append("Direct\n")
+
+    frac_coords = labeled.frac_coords[order] + 0.0
+    if selective_dynamics is None:
+        template = "  %.10f        %.10f        %.10f\n"
+        values = frac_coords.ravel().tolist()
+    else:
+        template = "  %.10f        %.10f        %.10f   %s   %s   %s\n"
+        table = np.empty((len(order), 6), dtype=object)
+        table[:, :3] = frac_coords
+        table[:, 3:] = np.where(np.asarray(selective_dynamics, dtype=bool)[order], 'T', 'F')
+        values = table.ravel().tolist()
+    text.append(template * len(order) % tuple(values))
+    return ''.join(text)
+
+
+def write_poscar(filename, labeled, comment=None, selective_dynamics=None):
+    """
+    Write a LabeledStructure as POSCAR with Direct coordinates, in one buffered write.
+    See format_poscar for the arguments.
+
+    input:
+    filename: output file name
+    labeled: LabeledStructure to write
+    comment: first line. Default is the comment of labeled
+    selective_dynamics: (N,3) bool array of flags. Default is the flags of labeled
+    """
+    with open(filename, 'w') as out_file:
+        out_file.write(format_poscar(labeled, comment, selective_dynamics))
+
+
+def write_selective_dynamics(filename, source, flags):
+    """
+    Copy of a POSCAR with new selective dynamics flags, in one buffered write.
+
+    The header (comment, scale, lattice, element blocks in their order and
+    names such as Si_pv) and the coordinate type are copied as they are, so
+    the file still matches its POTCAR; the first three columns of the
+    coordinate lines are kept as text, and only the flag columns are written
+    anew. 'Selective dynamics' is added when missing, and the lines after
+    the coordinates (velocities of a CONTCAR) are kept.
+
+    input:
+    filename: output file name
+    source: POSCAR file the flags belong to
+    flags: (N,3) bool array, in the site order of source
+    """
+    with open(source, 'r') as file:
+        header = read_poscar_header(file)
+        file.seek(0)
+        lines = file.readlines()
+    first = header['first_coord_line']
+    num_atoms = sum(header['counts'])
+    head = lines[:first - 1]
+    if not header['selective']:
+        head.append('Selective dynamics\n')
+    head.append(lines[first - 1])
+    coords = [line.split()[:3] for line in lines[first:first + num_atoms]]
+    if len(coords) < num_atoms or min(map(len, coords), default=3) < 3:
+        raise ValueError("Coordinates of {0} are incomplete".format(source))
+    # One template for the whole block, filled from the coordinate text and the flags
+    values = np.column_stack([np.array(coords), np.where(np.asarray(flags, dtype=bool), 'T', 'F')])
+    block = ('  %s  %s  %s   %s   %s   %s\n' * num_atoms) % tuple(values.ravel().tolist())
+    with open(filename, 'w') as out_file:
+        out_file.write(''.join(head) + block + ''.join(lines[first + num_atoms:]))
+
+
+def write_poscars(out_dir, filenames, structures, comments=None):
+    """
+    Write many structures as POSCAR files in a directory.
+
+    input:
+    out_dir: output directory, created if missing
+    filenames: file names inside out_dir
+    structures: LabeledStructure of each file
+    comments: comment line of each file. Default is the comment of each structure
+
+    output:
+    list of written paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if comments is None:
+        comments = [None] * len(filenames)
+    paths = []
+    for filename, labeled, comment in zip(filenames, structures, comments):
+        path = os.path.join(out_dir, filename)
+        write_poscar(path, labeled, comment)
+        paths.append(path)
+    return paths
@@ -0,0 +1,126 @@
+"""
+Stage-level timing and memory records of the scripts.
+
+Profiling is off unless a script is run with --profile, or the
+environment variable DEFECT_TOOL_PROFILE is set to 1 or a file name
+(empty, 0, false and no keep it off). The scripts call
+profiler.mark(stage) at the end of each stage (import, parse, labeling,
+neighbors, symmetry, write, ...); the wall time since the previous mark
+and the peak RSS so far are recorded. At exit, one JSON record per run is
+written to stderr, or appended to a file, so batch workflows collect one
+line per structure without editing the scripts.
+
+--profile                  JSON record to stderr
+--profile=run.jsonl        JSON record appended to run.jsonl
+--cprofile=run.prof        also dump cProfile statistics (pstats format)
+DEFECT_TOOL_PROFILE=1 or DEFECT_TOOL_PROFILE=run.jsonl, and
+DEFECT_TOOL_CPROFILE=run.prof work the same way.
+"""
+
+import atexit
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Time of the first import of this module, the start of the 'import' stage
+_start = time.perf_counter()
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process (MB), or None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def _switch(value):
+    """Target of a profiling switch, or None when it is off: unset, '', 0, false or no"""
+    if value is None or value.strip().lower() in ('', '0', 'false', 'no', 'off'):
+        return None
+    return value
+
+
+class Profiler:
+    """
+    attributes:
+    enabled: True if the stages are recorded
+    target: file the record is appended to, or None for stderr
+    stages: OrderedDict of stage -> {'seconds', 'peak_rss_mb', 'count'}
+    """
+
+    def __init__(self, enabled=False, target=None, cprofile_target=None):
+        self.enabled = enabled or cprofile_target is not None
+        self.target = target
+        self.cprofile_target = cprofile_target
+        self.stages = OrderedDict()
+        self.last = _start
+        self.cprofile = None
+        if self.enabled:
+            if cprofile_target is not None:
+                import cProfile
+                self.cprofile = cProfile.Profile()
+                self.cprofile.enable()
+            atexit.register(self.write)
+
+    @classmethod
+    def from_argv(cls, argv):
+        """
+        Build from --profile and --cprofile arguments, which are removed from argv,
+        or from the environment variables
+        """
+        target = _switch(os.environ.get('DEFECT_TOOL_PROFILE'))
+        cprofile_target = _switch(os.environ.get('DEFECT_TOOL_CPROFILE'))
+        for arg in list(argv[1:]):
+            if arg == '--profile' or arg.startswith('--profile='):
+                target = _switch(arg.split('=', 1)[1] if '=' in arg else '1')
+                argv.remove(arg)
+            elif arg.startswith('--cprofile='):
+                cprofile_target = _switch(arg.split('=', 1)[1])
+                argv.remove(arg)
+        enabled = target is not None
+        if enabled and target.lower() in ('1', 'true', 'yes', 'stderr'):
+            target = None
+        return cls(enabled, target, cprofile_target)
+
+    def mark(self, stage):
+        """End a stage: record the time since the previous mark. Repeated stages add up"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        record = self.stages.setdefault(stage, {'seconds': 0.0, 'peak_rss_mb': None, 'count': 0})
+        record['seconds'] += now - self.last
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['count'] += 1
+        self.last = now
+
+    def record(self):
+        """JSON-compatible dict of this run"""
+        return {'script': os.path.basename(sys.argv[0]), 'argv': sys.argv[1:],
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid': os.getpid(),
+                'total_seconds': time.perf_counter() - _start, 'peak_rss_mb': peak_rss_mb(),
+                'stages': [dict(stage=stage, **values) for stage, values in self.stages.items()]}
+
+    def write(self):
+        """Write the record, and the cProfile statistics if requested"""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_target)
+        line = json.dumps(self.record())
+        if self.target is None:
+            sys.stderr.write(line + '\n')
+        else:
+            with open(self.target, 'a') as out_file:
+                out_file.write(line + '\n')
+
+
+# Shared by the scripts. Importing this module removes the profiling arguments from sys.argv
+profiler = Profiler.from_argv(sys.argv)
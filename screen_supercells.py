@@ -0,0 +1,79 @@
+"""
+## Command:
+python screen_supercells.py [POSCAR_filename] [optional:max] [optional:min] [optional:out]
+
+[POSCAR_filename]:
+    POSCAR file of the primitive cell
+[optional:max]:
+    ex) max=300
+    Largest number of atoms of the supercells. Default is 500
+[optional:min]:
+    ex) min=100
+    Smallest number of atoms of the supercells. Default is 1
+[optional:out]:
+    ex) out=supercells.csv
+    Also write every candidate supercell as CSV
+
+Every supercell up to [max] atoms (every Hermite normal form of the
+transformation matrix) is screened by the distance between a point
+defect and its nearest periodic image. The supercells for which no
+smaller supercell has a longer image distance are printed, with the
+matrix to pass to defect_creation.py as supercell=...
+"""
+
+import sys
+import numpy as np
+from profiling import profiler
+from command_line import parse_options
+from labeled_structure import LabeledStructure
+from supercell import screen_supercells
+profiler.mark('import')
+
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('max', 'min', 'out'))
+max_sites=int(options.get('max', 500))
+min_sites=int(options.get('min', 1))
+
+if len(sys.argv) == 1:
+    print('POSCAR is not provided')
+    sys.exit()
+
+##############################################################################
+########## Screen
+##############################################################################
+labeled = LabeledStructure.from_file(sys.argv[1])
+profiler.mark('parse')
+try:
+    screen = screen_supercells(labeled.lattice, len(labeled), max_sites, min_sites)
+except ValueError as error:
+    print(error.args[0])
+    sys.exit()
+profiler.mark('screen')
+
+##############################################################################
+########## Print & write
+##############################################################################
+print("   Primitive cell: {0}, {1} atoms".format(sys.argv[1], len(labeled)))
+print("   Atoms  | Image distance | Sphericity | supercell=")
+print("   ───────┼────────────────┼────────────┼──────────────────────────")
+for i, matrix in zip(screen['pareto'], screen['pareto_matrices']):
+    if np.count_nonzero(matrix - np.diag(np.diag(matrix))):
+        argument = ','.join(str(value) for value in matrix.ravel())
+    else:
+        argument = ','.join(str(value) for value in np.diag(matrix))
+    print("   {0:>6} |    {1:8.4f}    |   {2:6.4f}   | {3}".format(
+        screen['num_sites'][i], screen['image_distance'][i], screen['sphericity'][i], argument))
+
+if 'out' in options:
+    pareto = np.zeros(len(screen['matrices']), dtype=int)
+    pareto[screen['pareto']] = 1
+    table = np.column_stack([screen['num_sites'], screen['matrices'].reshape(-1, 9),
+                             screen['image_distance'], screen['sphericity'], pareto])
+    np.savetxt(options['out'], table, fmt=['%d']*10 + ['%.6f', '%.6f', '%d'], delimiter=',', comments='',
+               header='atoms,m11,m12,m13,m21,m22,m23,m31,m32,m33,image_distance,sphericity,pareto')
+
+print("")
+print('  {0} supercells with {1} to {2} atoms were screened'.format(len(screen['matrices']), min_sites, max_sites))
+if 'out' in options:
+    print('  All candidates were written as {0}'.format(options['out']))
+profiler.mark('write')
@@ -0,0 +1,337 @@
+"""
+Atom selections shared by the scripts.
+
+A selection is compiled once into a tree of functions, each returning a
+boolean mask over the arrays of a LabeledStructure, so selecting thousands
+of atoms is a few array operations, not one lookup per label.
+
+Syntax (keywords are case-insensitive):
+    Si1 O3              atom labels; a list of terms is their union
+    O, O*, Si1*         all atoms of an element, or labels matching a wildcard
+    Si10-Si200          range of atom numbers of one element (also Si10-200)
+    all                 every atom
+    x>0.7, 0.2<z<0.5    slabs of fractional coordinates (x, y, z, as printed by
+                        the scripts), or Cartesian ones (cx, cy, cz, angstrom)
+    z==0.5              coordinates equal to a value within EQUAL_TOLERANCE
+    within 4.0 of Si1   atoms within 4.0 angstrom of a selection, or of a point
+                        given in Cartesian coordinates, ex) within 3 of 0.1,0.1,0.1
+    and, or, not, ( )   boolean combinations, ex) 'O* and not within 3 of Si1'
+
+Errors of the syntax are raised as ValueError, unknown labels as KeyError.
+"""
+
+import re
+from string import ascii_letters
+from fnmatch import translate
+from functools import lru_cache
+
+import numpy as np
+
+from selective import radius_mask
+
+# Cartesian point, optionally in brackets: 0.1,0.1,0.1 or [0.1,0.1,0.1] or (0.1,0.1,0.1)
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_POINT = r'[\[(]?\s*{0}\s*,\s*{0}\s*,\s*{0}\s*[\])]?'.format(_NUMBER)
+_TOKEN = re.compile(r'\s*({0}|\(|\)|==|<=|>=|<|>|[^\s()<>=]+)'.format(_POINT))
+_RANGE = re.compile(r'^([A-Za-z]+)(\d+)-(?:([A-Za-z]+))?(\d+)$')
+_AXES = {'x': 0, 'y': 1, 'z': 2, 'cx': 0, 'cy': 1, 'cz': 2}
+_OPERATORS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal, '==': None}
+# Coordinates within this of the value are equal to it, fractional or angstrom
+EQUAL_TOLERANCE = 1e-3
+_KEYWORDS = {'and', 'or', 'not', 'of', ')'}
+# Up to this many centers, 'within' is one distance pass per center without a KD-tree
+DIRECT_CENTERS = 16
+
+
+def tokenize(text):
+    """List of tokens of a selection"""
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise ValueError("Cannot read the selection from '{0}'".format(text[position:]))
+        tokens.append(match.group(1).strip())
+        position = match.end()
+    return tokens
+
+
+def is_point(token):
+    """True if a token is a Cartesian point such as 0.1,0.1,0.1"""
+    return re.fullmatch(_POINT, token) is not None
+
+
+def parse_point(token):
+    """'[0.1,0.1,0.1]' --> (3,) array"""
+    return np.array(re.findall(_NUMBER, token), dtype=float)
+
+
+def _is_number(token):
+    return re.fullmatch(_NUMBER, token) is not None
+
+
+class _Context:
+    """Arrays of one structure used by the selection functions, built on first use"""
+
+    def __init__(self, labeled):
+        self.labeled = labeled
+        self._numbers = None
+
+    @property
+    def numbers(self):
+        """Number of each atom label, ex) 12 for 'Si12'"""
+        if self._numbers is None:
+            self._numbers = np.char.lstrip(self.labeled.labels, ascii_letters).astype(int)
+        return self._numbers
+
+
+def _term(token):
+    """Function of a label, element, wildcard or range"""
+    match = _RANGE.match(token)
+    if match:
+        element, start, element2, stop = match.groups()
+        if element2 not in (None, element):
+            raise ValueError("Range {0} should be of one element".format(token))
+        start, stop = int(start), int(stop)
+        return lambda context: ((context.labeled.species == element)
+                                & (context.numbers >= start) & (context.numbers <= stop))
+    if token.isalpha() or re.fullmatch(r'[A-Za-z]+\*', token):
+        element = token.rstrip('*')
+
+        def species(context):
+            if element not in context.labeled.elements:
+                raise KeyError("Element {0} is not in the structure".format(element))
+            return context.labeled.species == element
+        return species
+    if re.fullmatch(r'[A-Za-z]+\d*\*', token):
+        return lambda context: np.char.startswith(context.labeled.labels, token[:-1])
+    if any(character in token for character in '*?['):
+        pattern = re.compile(translate(token))
+        return lambda context: np.array([pattern.match(label) is not None
+                                         for label in context.labeled.labels.tolist()], dtype=bool)
+
+    def label(context):
+        mask = np.zeros(len(context.labeled), dtype=bool)
+        mask[context.labeled.index(token)] = True
+        return mask
+    return label
+
+
+def _within(radius, centers):
+    """Function of atoms within radius of the atoms of a selection, or of a point"""
+    def within(context):
+        labeled = context.labeled
+        if isinstance(centers, np.ndarray):
+            return radius_mask(labeled, labeled.get_frac_coords(centers), radius)
+        center_index = np.flatnonzero(centers(context))
+        if len(center_index) <= DIRECT_CENTERS:
+            mask = np.zeros(len(labeled), dtype=bool)
+            for index in center_index:
+                mask |= radius_mask(labeled, index, radius)
+            return mask
+        from neighbor_search import PeriodicNeighborSearch
+        _, site_index, _, _ = PeriodicNeighborSearch.from_labeled(labeled).query_sites(center_index, radius)
+        mask = np.zeros(len(labeled), dtype=bool)
+        mask[site_index] = True
+        mask[center_index] = True
+        return mask
+    return within
+
+
+def _slab(axis, bounds):
+    """Function of a slab of coordinates, bounds is a list of (operator, value)"""
+    index = _AXES[axis]
+    cartesian = axis.startswith('c')
+
+    def slab(context):
+        if cartesian:
+            coords = context.labeled.cart_coords[:, index]
+        else:
+            coords = np.mod(context.labeled.frac_coords[:, index], 1.0)
+        mask = np.ones(len(coords), dtype=bool)
+        for operator, value in bounds:
+            if operator == '==':
+                difference = coords - value
+                if not cartesian:
+                    # Fractional coordinates are periodic: z==0 also takes z=0.9999
+                    difference -= np.round(difference)
+                mask &= np.abs(difference) <= EQUAL_TOLERANCE
+            else:
+                mask &= _OPERATORS[operator](coords, value)
+        return mask
+    return slab
+
+
+class _Parser:
+    """Recursive descent parser of tokens into selection functions"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Selection ends too early")
+        self.position += 1
+        return token
+
+    def expect(self, expected):
+        token = self.next()
+        if token.lower() != expected:
+            raise ValueError("'{0}' is expected instead of '{1}'".format(expected, token))
+
+    def parse(self):
+        function = self.union()
+        if self.peek() is not None:
+            raise ValueError("Unexpected '{0}' in the selection".format(self.peek()))
+        return function
+
+    def union(self):
+        # Terms next to each other without operator are joined by 'or'
+        functions = [self.intersection()]
+        while self.peek() is not None and self.peek() != ')' and self.peek().lower() != 'and':
+            if self.peek().lower() == 'or':
+                self.next()
+            functions.append(self.intersection())
+        if len(functions) == 1:
+            return functions[0]
+        return lambda context: np.logical_or.reduce([function(context) for function in functions])
+
+    def intersection(self):
+        functions = [self.negation()]
+        while self.peek() is not None and self.peek().lower() == 'and':
+            self.next()
+            functions.append(self.negation())
+        if len(functions) == 1:
+            return functions[0]
+        return lambda context: np.logical_and.reduce([function(context) for function in functions])
+
+    def negation(self):
+        if self.peek() is not None and self.peek().lower() == 'not':
+            self.next()
+            function = self.negation()
+            return lambda context: ~function(context)
+        return self.primary()
+
+    def primary(self):
+        token = self.next()
+        lower = token.lower()
+        if token == '(':
+            function = self.union()
+            self.expect(')')
+            return function
+        if lower in _KEYWORDS:
+            raise ValueError("Unexpected '{0}' in the selection".format(token))
+        if lower == 'all':
+            return lambda context: np.ones(len(context.labeled), dtype=bool)
+        if lower == 'within':
+            radius = self.next()
+            if not _is_number(radius):
+                raise ValueError("'within' should be followed by a radius, not '{0}'".format(radius))
+            self.expect('of')
+            if self.peek() is not None and is_point(self.peek()):
+                return _within(float(radius), parse_point(self.next()))
+            return _within(float(radius), self.negation())
+        # Slabs: z>0.7, 0.2<z<0.5
+        if lower in _AXES and self.peek() in _OPERATORS:
+            operator = self.next()
+            return _slab(lower, [(operator, self.number())])
+        if _is_number(token) and self.peek() in _OPERATORS and (self.peek(1) or '').lower() in _AXES:
+            # value < z is z > value
+            flipped = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '=='}[self.next()]
+            axis = self.next().lower()
+            bounds = [(flipped, float(token))]
+            if self.peek() in _OPERATORS:
+                operator = self.next()
+                bounds.append((operator, self.number()))
+            return _slab(axis, bounds)
+        if is_point(token):
+            raise ValueError("Coordinates {0} can only follow 'within R of'".format(token))
+        return _term(token)
+
+    def number(self):
+        token = self.next()
+        if not _is_number(token):
+            raise ValueError("A number is expected instead of '{0}'".format(token))
+        return float(token)
+
+
+@lru_cache(maxsize=128)
+def compile_selection(text):
+    """
+    input:
+    text: selection, ex) 'O* and z>0.7'
+
+    output:
+    function of a LabeledStructure returning its (N,) bool mask
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        raise ValueError("Selection is empty")
+    function = _Parser(tokens).parse()
+    return lambda labeled: function(_Context(labeled))
+
+
+def select(labeled, text):
+    """(N,) bool mask of the atoms of labeled selected by text"""
+    return compile_selection(text)(labeled)
+
+
+def select_indices(labeled, text):
+    """
+    Site indices of a selection. A plain list of atom labels, ex) 'Si1 O3 O1',
+    keeps its order, as the scripts print atoms in the given order;
+    other selections are in site order.
+    """
+    tokens = tokenize(text)
+    if tokens and all(token in labeled.label_to_index for token in tokens):
+        return labeled.indices(tokens)
+    return np.flatnonzero(select(labeled, text))
+
+
+def select_labels(labeled, text):
+    """Atom labels of a selection, in the order of select_indices"""
+    return labeled.labels[select_indices(labeled, text)].tolist()
+
+
+def split_centers(words):
+    """
+    Centers of neighbors.py and perturb.py from the words of the command line.
+
+    input:
+    words: list of strings, ex) ['Si1', '0.1,0.1,', '0.1', 'O*', 'and', 'z>0.5']
+
+    output:
+    list of [x, y, z] Cartesian coordinates (angstrom) and of the selections
+    between them, ex) ['Si1', [0.1, 0.1, 0.1], 'O* and z > 0.5']. Coordinates
+    after 'within R of' belong to the selection
+    """
+    tokens = tokenize(' '.join(words))
+    centers, run = [], []
+    for k, token in enumerate(tokens):
+        if is_point(token) and not (k > 0 and tokens[k - 1].lower() == 'of'):
+            if run:
+                centers.append(' '.join(run))
+                run = []
+            centers.append(parse_point(token).tolist())
+        else:
+            run.append(token)
+    if run:
+        centers.append(' '.join(run))
+    return centers
+
+
+def expand_centers(labeled, centers):
+    """Centers of split_centers with each selection replaced by its atom labels"""
+    expanded = []
+    for center in centers:
+        if isinstance(center, str):
+            expanded.extend(select_labels(labeled, center))
+        else:
+            expanded.append(center)
+    return expanded
@@ -0,0 +1,83 @@
+"""
+Selective dynamics flags by distance from a defect.
+
+Masks of atoms within a radius, or within the first few coordination
+shells, of a center are computed with one minimum-image distance pass
+over all atoms (displacement.py). The flags are written with
+poscar_io.write_selective_dynamics, into a copy of the input POSCAR.
+"""
+
+import numpy as np
+
+from displacement import minimum_image_vectors
+
+# Distances within this of each other belong to the same shell (angstrom)
+SHELL_TOLERANCE = 0.1
+
+
+def parse_tag(tag):
+    """'FFT' or 'F F T' --> (3,) bool array"""
+    tag = tag.replace(' ', '').upper()
+    if len(tag) != 3 or not set(tag) <= {'T', 'F'}:
+        raise ValueError("Selective dynamics tag should be like TTT or FFT, not {0}".format(tag))
+    return np.array([flag == 'T' for flag in tag])
+
+
+def center_distances(labeled, center):
+    """
+    input:
+    labeled: LabeledStructure
+    center: site index of the center atom, or (3,) fractional coordinates
+
+    output:
+    (N,) array of minimum-image distance of every atom from the center (angstrom)
+    """
+    center_frac = labeled.frac_coords[center] if np.ndim(center) == 0 else np.asarray(center, dtype=float)
+    vectors = minimum_image_vectors(labeled.lattice, labeled.frac_coords - center_frac)
+    return np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+
+
+def radius_mask(labeled, center, radius):
+    """(N,) bool array, True for atoms within radius (angstrom) of the center, including itself"""
+    return center_distances(labeled, center) <= radius
+
+
+def shell_mask(labeled, center, num_shells, tolerance=SHELL_TOLERANCE):
+    """
+    input:
+    labeled: LabeledStructure
+    center: site index of the center atom, or (3,) fractional coordinates
+    num_shells: number of neighbor shells to include
+    tolerance: distances within this of each other belong to the same shell (angstrom)
+
+    output:
+    (N,) bool array, True for the center atom and atoms of the first num_shells shells
+    """
+    distances = center_distances(labeled, center)
+    ordered = np.sort(distances[distances > tolerance])
+    # A new shell starts where the sorted distances jump by more than tolerance
+    shell_starts = ordered[np.r_[True, np.diff(ordered) > tolerance]]
+    if num_shells < 1 or len(shell_starts) == 0:
+        return distances <= tolerance
+    if num_shells >= len(shell_starts):
+        return np.ones(len(distances), dtype=bool)
+    return distances < shell_starts[num_shells]
+
+
+def apply_tags(num_atoms, mask, tag, rest_tag=None, flags=None):
+    """
+    input:
+    num_atoms: number of atoms
+    mask: (N,) bool array of atoms to tag
+    tag: tag of masked atoms, ex) 'TTT'
+    rest_tag: tag of the other atoms, ex) 'FFF'. None keeps their current flags
+    flags: (N,3) bool array of current flags, or None (all T)
+
+    output:
+    (N,3) bool array of new flags
+    """
+    new_flags = np.ones((num_atoms, 3), dtype=bool) if flags is None else np.array(flags, dtype=bool)
+    if rest_tag is not None:
+        new_flags[~mask] = parse_tag(rest_tag)
+    new_flags[mask] = parse_tag(tag)
+    return new_flags
@@ -2,59 +2,134 @@
 # python selective_dynamics.py [input_filename] [output_filename:optional]
 # input_filename: POSCAR file that the user want to modify the selective dynamics
 # output_filename: (optional) modified POSCAR file. If not given, default naming will be applied
-
+#
+# Non-interactive mode, to relax atoms around a defect and fix the rest:
+# python selective_dynamics.py [input_filename] center=[atom label or coordinates] r=[radius]
+#                              [optional:shell] [optional:tag] [optional:rest] [optional:out]
+# center: atom label, ex) center=Si1, or Cartesian coordinates (angstrom), ex) center=0.1,0.1,0.1
+# r: atoms within r (angstrom) of the center get the tag, ex) r=4.0
+# shell: instead of r, atoms within the first shells of the center get the tag, ex) shell=2
+# tag: tag of atoms near the center. Default is TTT
+# rest: tag of the other atoms. Default is FFF
+# out: output filename. Default is SelDy_[center]_r[radius].vasp or SelDy_[center]_shell[shell].vasp
+#
+# python selective_dynamics.py [input_filename] sel=[selection] [optional:tag] [optional:rest] [optional:out]
+# sel: atoms of a selection of selection.py get the tag, ex) 'sel=within 4 of Si1 and not O*'
+#
+# The atoms asked in interactive mode can also be any selection, ex) 'all', 'O* and z>0.7'
+
+import re
 import sys
 import numpy as np
+from profiling import profiler
+from command_line import parse_options
+from poscar_io import read_poscar, write_selective_dynamics
+from selective import radius_mask, shell_mask, apply_tags
+from selection import select, select_indices, is_point, parse_point
+profiler.mark('import')
 
 #sys.argv=['test','CONTCAR.i.0.IS.2.IB.1.vasp']
+
+### Options are given as key=value. Once parsed, remove from the sys.argv
+options, sys.argv=parse_options(sys.argv, ('center', 'r', 'shell', 'sel', 'tag', 'rest', 'out'))
+
 ##############################################################################
 ########## Read POSCAR file and indexing each line with atom label
 ##############################################################################
-struct_file=open(sys.argv[1],'r')
-lines=struct_file.readlines()
-
-#### Calculate index, including header 
-num_atom_dict=dict()
-element_list=lines[5].split()
-for i in range(len(element_list)):
-    num_atom_dict[element_list[i]]=int((lines[6].split())[i])
-
-if lines[7][0]=='s' or lines[7][0]=='S':
-    # the vasp file is already tagged with 'selective dynamics'
-    flag_selective=1
-else:
-    # the vasp file is pristine. Should add 'Selective dynamics'
-    flag_selective=0
-
-#### INDEXING INDIVIDUAL ATOMS #####
-### Si1 --> 9, Si2 -->10, etc
-index_dict=dict()
-# index_counter to read/write in sequence from original vasp
-index_counter = 8 + flag_selective
-for i, element in enumerate(element_list):
-    for j in range(num_atom_dict[element]):
-        label_name=element+str(j+1)      
-        index_dict[label_name] = index_counter
-        index_counter += 1
+if len(sys.argv) == 1:
+    print('POSCAR is not provided')
+    sys.exit()
+
+labeled=read_poscar(sys.argv[1])
+profiler.mark('parse')
+num_atoms=len(labeled)
+
+def file_tag(text):
+    """Part of the output filename from a selection, ex) 'O* and z>0.7' --> 'O_and_z_0.7'"""
+    return re.sub(r'[^\w.-]+', '_', text).strip('_')
+
+##############################################################################
+########## Non-interactive mode: tag atoms of a selection
+##############################################################################
+if 'sel' in options:
+    try:
+        mask=select(labeled, options['sel'])
+        SD_tag=options.get('tag', 'TTT')
+        rest_tag=options.get('rest', 'FFF')
+        flags=apply_tags(num_atoms, mask, SD_tag, rest_tag)
+    except (KeyError, ValueError) as error:
+        print(error.args[0])
+        sys.exit()
+    profiler.mark('labeling')
+
+    out_filename=options.get('out', 'SelDy_{0}_{1}.vasp'.format(SD_tag, file_tag(options['sel'])))
+    write_selective_dynamics(out_filename, sys.argv[1], flags)
+    profiler.mark('write')
+
+    print("")
+    print("   {0} of {1} atoms of '{2}' are set to {3}, the rest to {4}"
+          .format(int(np.count_nonzero(mask)), num_atoms, options['sel'], SD_tag, rest_tag))
+    print("")
+    print("   POSCAR is written with this filename: {0}".format(out_filename))
+    sys.exit()
+
+##############################################################################
+########## Non-interactive mode: tag atoms around the center
+##############################################################################
+if 'center' in options:
+    center_input=options['center']
+    try:
+        # If center is coordinate (Cartesian, angstrom)
+        if is_point(center_input):
+            center=labeled.get_frac_coords(parse_point(center_input))
+        # If center is atom label like 'Si1'
+        else:
+            center=labeled.index(center_input)
+
+        if 'shell' in options:
+            mask=shell_mask(labeled, center, int(options['shell']))
+            region='shell'+options['shell']
+        else:
+            mask=radius_mask(labeled, center, float(options.get('r', 4.0)))
+            region='r'+options.get('r', '4.0')
+        SD_tag=options.get('tag', 'TTT')
+        rest_tag=options.get('rest', 'FFF')
+        flags=apply_tags(num_atoms, mask, SD_tag, rest_tag)
+    except (KeyError, ValueError) as error:
+        print(error.args[0])
+        sys.exit()
+    profiler.mark('neighbors')
+
+    out_filename=options.get('out', 'SelDy_{0}_{1}.vasp'.format(file_tag(center_input), region))
+    write_selective_dynamics(out_filename, sys.argv[1], flags)
+    profiler.mark('write')
+
+    print("")
+    print("   {0} of {1} atoms near {2} ({3}) are set to {4}, the rest to {5}"
+          .format(int(np.count_nonzero(mask)), num_atoms, center_input, region, SD_tag, rest_tag))
+    print("")
+    print("   POSCAR is written with this filename: {0}".format(out_filename))
+    sys.exit()
 
 ##############################################################################
 ########## Ask user for tag and atoms to apply
 ##############################################################################
 print('   For which atoms do you want to apply this tag?')
 print("   Separate with spaces: ex) 'Si1 Si2 O1 O3'")
-print("   For all atoms, write 'All' ")
+print("   For all atoms, write 'All'. Selections also work: ex) 'O* and z>0.7'")
 atom_input=input()
 
 print('   Which tag do you want to apply for selective dynamics?')
 print('   ex) TTT, FFF, FFT')
 SD_tag=input()
 
-if atom_input == 'All':
-    apply_atom_list = [atom_input]
-    apply_index_list = []
-else:
-    apply_atom_list=atom_input.split()
-    apply_index_list=[index_dict[i] for i in apply_atom_list]
+mask=np.zeros(num_atoms, dtype=bool)
+try:
+    apply_index=select_indices(labeled, atom_input)
+except (KeyError, ValueError) as error:
+    print(error.args[0])
+    sys.exit()
+mask[apply_index]=True
 
 ##############################################################################
 ########## Write output POSCAR file
@@ -62,71 +137,36 @@ else:
 if len(sys.argv) >= 3:
     out_filename=sys.argv[2]
 else:
-    out_filename='SelDy'+'_'+SD_tag+'_'+"_".join('%s' % entry for entry in apply_atom_list)+'.vasp'
-out_file=open(out_filename,'w')
-
-# Write header + lattice part
-# Header is up to 7th line if 'selective dynamics' is not stated
-# up to 8th if 'selective dynamics' is already stated
-for i in range(0,7+flag_selective):
-    out_file.write(lines[i])
-
-# state 'selective dynamics' if not already stated
-if flag_selective == 0:
-    out_file.write("Selective dynamics \n")
-
-# Write Direct or Cartesian
-out_file.write(lines[7+flag_selective])
-
-for i in range(8+flag_selective,1+max(index_dict.values())):
-    ## if input poscar is without Selective dynamics line,
-    # starts with line number 9 (index number 8)
-    ## if poscar has Selective dynamics line,
-    # starts with line 10 (index number 9)
-    ## +1 in the range part is to cover the last item.
-    for j in (lines[i].split())[0:3]:
-            out_file.write('  '+j)
-            
-    #out_file.write('  ')
-    if i in apply_index_list or atom_input=='All' or atom_input=='all' or atom_input=="ALL":
-        # for j in (lines[i].split)[0:3]:
-        #     out_file.write('  '+j)
-        out_file.write('   {0}   {1}   {2}'.format(SD_tag[0],SD_tag[1],SD_tag[2]))
-    elif flag_selective == 1:
-        tag_list=lines[i].split()[3:6]
-        out_file.write('   {0}   {1}   {2}'.format(tag_list[0],tag_list[1],tag_list[2]))
-    else:
-        # Default is to be TTT
-        out_file.write('   T   T   T')
-    out_file.write('\n') # end of line
-# end of file
-out_file.close()
-
+    out_filename='SelDy'+'_'+SD_tag+'_'+file_tag('All' if mask.all() else atom_input)+'.vasp'
+
+# Tags of the other atoms are kept, or default to TTT if not stated
+try:
+    flags=apply_tags(num_atoms, mask, SD_tag, flags=labeled.selective_dynamics)
+except ValueError as error:
+    print(error.args[0])
+    sys.exit()
+profiler.mark('labeling')
+write_selective_dynamics(out_filename, sys.argv[1], flags)
+profiler.mark('write')
 
 ##############################################################################
 ########## Printing
 ##############################################################################
 
-if atom_input != 'All':
+if not mask.all():
     print("")
     print("   Modified atom list")
     print("   Atom label |     x       y       z   | tag ")
     print("   ───────────┼─────────────────────────┼─────")
-    # list of (3,) numpy arrays
-    coordinate_list=[]
-    for atom_label in apply_atom_list:
-        temp_list = lines[index_dict[atom_label]].split()
-        coordinate_list.append(np.array([float(i) for i in temp_list[0:3]]))
-        temp_array=np.array([float(i) for i in temp_list[0:3]])
+    for index in apply_index:
+        temp_array=labeled.frac_coords[index]
         print("   {0:>10} | {1: 5.4f} {2: 5.4f} {3: 5.4f} "
-              .format(atom_label,temp_array[0],temp_array[1],temp_array[2])+
+              .format(labeled.label(index),temp_array[0],temp_array[1],temp_array[2])+
               "| {0}".format(SD_tag))
 else:
     print("")
     print("   All atoms selective dynamics tag is set to {0}".format(SD_tag))
 
-  
-print("")  
-print("   POSCAR is written with this filename: {0}".format(out_filename))
-
 
+print("")
+print("   POSCAR is written with this filename: {0}".format(out_filename))
@@ -0,0 +1,127 @@
+"""
+All-pairs comparison of many structures of the same system, such as the
+relaxed members of a perturbation ensemble, and their clustering into
+distinct configurations.
+
+Structures are parsed in a process pool. The coordinates of all of them
+are then stacked into one (structures, atoms, 3) array, and each row of
+the displacement matrix (one structure against all later ones) is one
+batched minimum-image operation of displacement.py; rows are spread over
+a thread pool, as numpy releases the GIL in the array operations.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from labeled_structure import LabeledStructure
+from displacement import minimum_image_vectors
+from batch_compare import pool_context
+
+# Default clustering tolerance on the largest atomic displacement (angstrom)
+CLUSTER_TOLERANCE = 0.1
+
+
+def _parse_one(filename):
+    try:
+        return filename, LabeledStructure.from_file(filename), ''
+    except (ValueError, KeyError, OSError) as error:
+        return filename, None, str(error)
+
+
+def read_structures(filenames, workers=None):
+    """
+    input:
+    filenames: list of structure files
+    workers: number of worker processes. Default is the number of CPUs
+
+    output:
+    structures: dict of file name -> LabeledStructure, for the files that could be read
+    errors: dict of file name -> error message
+    """
+    structures, errors = dict(), dict()
+    chunksize = max(1, len(filenames) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+        for filename, labeled, error in executor.map(_parse_one, filenames, chunksize=chunksize):
+            if error:
+                errors[filename] = error
+            else:
+                structures[filename] = labeled
+    return structures, errors
+
+
+def pairwise_displacements(structures, workers=None):
+    """
+    Minimum-image displacements between all pairs of structures, with atoms
+    matched by label.
+
+    input:
+    structures: list of LabeledStructure with the same atom labels and
+        equivalent lattices; the lattice of the first of each pair is used
+    workers: number of threads. Default is the number of CPUs
+
+    output:
+    rms: (S,S) symmetric array of RMS displacements (angstrom)
+    max: (S,S) symmetric array of the largest atomic displacements (angstrom)
+    """
+    reference = structures[0]
+    frac_coords = np.empty((len(structures), len(reference), 3))
+    for k, labeled in enumerate(structures):
+        if not np.allclose(labeled.lattice, reference.lattice):
+            raise ValueError("Lattice vectors of structure {0} are not equivalent".format(k))
+        if np.array_equal(labeled.labels, reference.labels):
+            frac_coords[k] = labeled.frac_coords
+        else:
+            frac_coords[k] = labeled.frac_coords[labeled.indices(reference.labels)]
+
+    num_structures = len(structures)
+    rms = np.zeros((num_structures, num_structures))
+    largest = np.zeros((num_structures, num_structures))
+
+    def row(i):
+        """Structure i against the structures after it"""
+        vectors = minimum_image_vectors(structures[i].lattice,
+                                        (frac_coords[i + 1:] - frac_coords[i]).reshape(-1, 3))
+        distances = np.sqrt(np.einsum('ij,ij->i', vectors, vectors)).reshape(num_structures - i - 1, -1)
+        rms[i, i + 1:] = np.sqrt(np.mean(distances**2, axis=1)) if distances.shape[1] else 0.0
+        largest[i, i + 1:] = distances.max(axis=1, initial=0.0)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(row, range(num_structures - 1)))
+    return rms + rms.T, largest + largest.T
+
+
+def cluster_structures(distance, tolerance=CLUSTER_TOLERANCE):
+    """
+    Complete-linkage clustering, so that every two structures of a cluster
+    are within tolerance of each other.
+
+    input:
+    distance: (S,S) symmetric array of pairwise distances, ex) the largest displacement
+    tolerance: largest distance inside a cluster (angstrom)
+
+    output:
+    cluster: (S,) int array, cluster of each structure, numbered from 0
+        from the largest cluster to the smallest
+    representative: (S,) bool array, True for the medoid of each cluster,
+        the member with the smallest sum of distances to the others
+    """
+    from scipy.cluster.hierarchy import linkage, fcluster
+    from scipy.spatial.distance import squareform
+
+    num_structures = len(distance)
+    if num_structures == 1:
+        return np.zeros(1, dtype=int), np.ones(1, dtype=bool)
+    labels = fcluster(linkage(squareform(distance, checks=False), method='complete'),
+                      t=tolerance, criterion='distance')
+    # Renumber from the largest cluster, then by first member
+    _, first, inverse, counts = np.unique(labels, return_index=True, return_inverse=True, return_counts=True)
+    rank = np.argsort(np.argsort(np.lexsort((first, -counts))))
+    cluster = rank[inverse]
+
+    representative = np.zeros(num_structures, dtype=bool)
+    for k in range(len(counts)):
+        members = np.flatnonzero(cluster == k)
+        representative[members[np.argmin(distance[np.ix_(members, members)].sum(axis=1))]] = True
+    return cluster, representative
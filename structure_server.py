@@ -0,0 +1,412 @@
+"""
+Long-lived structure-query server, and the queries it answers.
+
+The server keeps parsed structures, label indexes and neighbor search
+trees in memory, so consecutive calls of coordinate.py, neighbors.py and
+compare_POSCAR.py on the same large supercell do not parse the file
+again. Structures are evicted least recently used first, and reloaded
+when the size or modification time of their file changes.
+
+Requests and responses are JSON objects, one per line, over a Unix socket
+($DEFECT_TOOL_SOCKET, or server.sock in the cache directory of
+symmetry.py) or over stdin/stdout. The scripts send their query to the
+server when one is running, and answer it themselves otherwise, with the
+same functions. Clients import neither scipy nor pymatgen, so a query
+returns in the time it takes to start Python and import numpy.
+
+## Command:
+python structure_server.py [start|stop|status|stdio] [optional:size] [optional:socket]
+
+[start]: serve on the Unix socket until stopped
+[stop]: stop the server
+[status]: print the cached structures of the server
+[stdio]: serve requests read from stdin, one JSON object per line
+[optional:size]: number of structures kept in memory, ex) size=8. Default is 16
+[optional:socket]: path of the Unix socket, ex) socket=/tmp/defect.sock
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from command_line import parse_options
+from labeled_structure import LabeledStructure, PYMATGEN_EXTENSIONS
+from displacement import compute_displacements, sort_displacements
+from poscar_io import read_poscar_header
+from selection import select, select_indices, expand_centers
+from symmetry import cache_dir
+
+# Number of structures kept in memory
+STORE_SIZE = 16
+# Seconds a client waits for an answer before computing it itself
+CLIENT_TIMEOUT = 60.0
+
+
+def socket_path():
+    """Path of the Unix socket of the server"""
+    return os.environ.get('DEFECT_TOOL_SOCKET',
+                          os.path.join(os.path.dirname(cache_dir()), 'server.sock'))
+
+
+##############################################################################
+########## Queries, answered by the server or by the scripts themselves
+##############################################################################
+
+def coordinate_columns(labeled, first_coord_line, labels):
+    """
+    input:
+    labeled: LabeledStructure read from a POSCAR
+    first_coord_line: line index (from 0) of the first atom in the POSCAR
+    labels: list of atom labels or selections (selection.py), ex) ['Si1', 'O* and z>0.7']
+
+    output:
+    dict of arrays, the 'coordinates' table of output_format.py: label, index,
+    line (line number from 1), frac_coords
+    """
+    index = select_indices(labeled, ' '.join(labels))
+    return {'label': labeled.labels[index], 'index': index, 'line': index + first_coord_line + 1,
+            'frac_coords': labeled.frac_coords[index]}
+
+
+def coordinate_rows(labeled, first_coord_line, labels):
+    """
+    output:
+    list of [label, line number (from 1), x, y, z] with fractional coordinates,
+    see coordinate_columns
+    """
+    columns = coordinate_columns(labeled, first_coord_line, labels)
+    return [[label, line] + coords for label, line, coords
+            in zip(columns['label'].tolist(), columns['line'].tolist(), columns['frac_coords'].tolist())]
+
+
+def _neighbor_query(labeled, search, centers, radius):
+    """Centers with the selections expanded into atom labels, and the neighbor columns"""
+    centers = expand_centers(labeled, centers)
+    is_label = np.array([isinstance(center, str) for center in centers], dtype=bool)
+    center_labels = np.array([center if flag else '' for center, flag in zip(centers, is_label)])
+    center_index = np.full(len(centers), -1, dtype=int)
+    center_index[is_label] = labeled.indices(center_labels[is_label])
+    center_frac_coords = np.empty((len(centers), 3))
+    center_frac_coords[is_label] = labeled.frac_coords[center_index[is_label]]
+    center_frac_coords[~is_label] = labeled.get_frac_coords(
+        np.array([center for center, flag in zip(centers, is_label) if not flag], dtype=float).reshape(-1, 3))
+
+    # Atoms and points are searched apart, then merged in order of the centers
+    site_centers, point_centers = np.flatnonzero(is_label), np.flatnonzero(~is_label)
+    center1, site_index1, image1, distance1 = search.query_sites(center_index[is_label], radius)
+    center2, site_index2, image2, distance2 = search.query_points(center_frac_coords[~is_label], radius)
+    center = np.concatenate([site_centers[center1], point_centers[center2]])
+    order = np.argsort(center, kind='stable')
+    center = center[order]
+    site_index = np.concatenate([site_index1, site_index2])[order]
+    # Neighbors are given inside the unit cell, with the image translated accordingly
+    frac_coords = labeled.frac_coords[site_index]
+    unit_frac_coords = np.mod(frac_coords, 1.0)
+    image = (np.concatenate([image1, image2]).reshape(-1, 3)[order]
+             + np.rint(frac_coords - unit_frac_coords)).astype(int)
+    columns = {'step': np.zeros(len(center), dtype=int), 'center': center,
+               'center_label': center_labels[center], 'center_index': center_index[center],
+               'center_frac_coords': center_frac_coords[center], 'label': labeled.labels[site_index],
+               'index': site_index, 'frac_coords': unit_frac_coords, 'image': image,
+               'distance': np.concatenate([distance1, distance2])[order]}
+    return centers, columns
+
+
+def neighbor_columns(labeled, search, centers, radius):
+    """
+    input:
+    labeled: LabeledStructure
+    search: PeriodicNeighborSearch of labeled
+    centers: list of selections (selection.py), such as atom labels, or of
+        [x, y, z] Cartesian coordinates (angstrom); see selection.split_centers
+    radius: search radius (angstrom)
+
+    output:
+    dict of arrays, the 'neighbors' table of output_format.py, one row per
+    neighbor of each center, sorted by center then by distance: center
+    (position in centers, after expanding the selections), center_label and
+    center_index ('' and -1 for coordinates), center_frac_coords, label, index,
+    frac_coords (inside the unit cell), image (lattice translation of the
+    neighbor, so that frac_coords + image is the atom found) and distance.
+    step is 0, for the caller to set on XDATCAR frames
+    """
+    return _neighbor_query(labeled, search, centers, radius)[1]
+
+
+def neighbor_rows(labeled, search, centers, radius):
+    """
+    output:
+    list of [center, x, y, z, neighbors] per center, where x, y, z are the
+    fractional coordinates of an atom or the Cartesian coordinates as given,
+    and neighbors is a list of [label, x, y, z, distance] with fractional
+    coordinates inside the unit cell, sorted by distance; see neighbor_columns
+    """
+    centers, columns = _neighbor_query(labeled, search, centers, radius)
+    bounds = np.searchsorted(columns['center'], np.arange(len(centers) + 1)).tolist()
+    labels = columns['label'].tolist()
+    frac_coords = columns['frac_coords'].tolist()
+    distances = columns['distance'].tolist()
+    rows = []
+    for k, center in enumerate(centers):
+        if isinstance(center, str):
+            coords = labeled.frac_coords[labeled.index(center)].tolist()
+        else:
+            coords = list(center)
+        neighbors = [[label] + frac + [dist] for label, frac, dist
+                     in zip(labels[bounds[k]:bounds[k + 1]], frac_coords[bounds[k]:bounds[k + 1]],
+                            distances[bounds[k]:bounds[k + 1]])]
+        rows.append([center] + coords + [neighbors])
+    return rows
+
+
+def compare_columns(labeled1, labeled2, threshold, selection=None):
+    """
+    input:
+    labeled1, labeled2: LabeledStructure with equivalent lattices
+    threshold: only displacements larger than this are kept (angstrom)
+    selection: only atoms of this selection of labeled1 are kept (selection.py).
+        Default is all atoms
+
+    output:
+    dict of arrays, the 'compare' table of output_format.py, from the largest
+    to the smallest displacement: label, index, label2, index2, distance,
+    vector (Cartesian displacement), frac_coords, frac_coords2
+    """
+    vectors, distances, index2 = compute_displacements(labeled1, labeled2)
+    order = sort_displacements(distances, threshold)
+    if selection is not None:
+        order = order[select(labeled1, selection)[order]]
+    return {'label': labeled1.labels[order], 'index': order, 'label2': labeled2.labels[index2[order]],
+            'index2': index2[order], 'distance': distances[order], 'vector': vectors[order],
+            'frac_coords': labeled1.frac_coords[order], 'frac_coords2': labeled2.frac_coords[index2[order]]}
+
+
+def compare_rows(labeled1, labeled2, threshold, selection=None):
+    """
+    output:
+    list of [label, displacement, x1, y1, z1, x2, y2, z2], from the largest
+    to the smallest displacement, with fractional coordinates; see compare_columns
+    """
+    columns = compare_columns(labeled1, labeled2, threshold, selection)
+    return [[label, displ] + coords1 + coords2 for label, displ, coords1, coords2
+            in zip(columns['label'].tolist(), columns['distance'].tolist(),
+                   columns['frac_coords'].tolist(), columns['frac_coords2'].tolist())]
+
+
+##############################################################################
+########## Server
+##############################################################################
+
+class StructureStore:
+    """
+    LRU store of parsed structures, keyed by absolute path and checked
+    against the size and modification time of the file at every access.
+    """
+
+    def __init__(self, size=STORE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, filename):
+        """
+        output:
+        dict with keys 'labeled', 'first_coord_line' (None if not a POSCAR),
+        'search' (PeriodicNeighborSearch, built on first use) and 'stat'
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry['stat'] == stamp:
+                self.entries.move_to_end(path)
+                return entry
+        labeled = LabeledStructure.from_file(path)
+        first_coord_line = None
+        if not path.lower().endswith(PYMATGEN_EXTENSIONS):
+            with open(path, 'r') as file:
+                first_coord_line = read_poscar_header(file)['first_coord_line']
+        entry = {'labeled': labeled, 'first_coord_line': first_coord_line,
+                 'search': None, 'stat': stamp}
+        with self.lock:
+            self.entries[path] = entry
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def search(self, entry):
+        """Neighbor search of an entry, built once"""
+        if entry['search'] is None:
+            from neighbor_search import PeriodicNeighborSearch
+            entry['search'] = PeriodicNeighborSearch.from_labeled(entry['labeled'])
+        return entry['search']
+
+
+def handle(store, request):
+    """
+    Answer one request.
+
+    requests:
+    {'op': 'coordinates', 'file': ..., 'labels': [...]}
+    {'op': 'neighbors', 'file': ..., 'centers': [...], 'radius': ...}
+    {'op': 'compare', 'file1': ..., 'file2': ..., 'threshold': ..., 'selection': ... (optional)}
+    {'op': 'status'}, {'op': 'shutdown'}
+    With 'columns': true, coordinates, neighbors and compare are answered with
+    the columns of their table in output_format.py, as lists, instead of rows
+
+    output:
+    {'result': ...} or {'error': message}
+    """
+    columns = bool(request.get('columns'))
+    try:
+        op = request.get('op')
+        if op == 'coordinates':
+            entry = store.get(request['file'])
+            if entry['first_coord_line'] is None:
+                raise ValueError("Line numbers are only defined for POSCAR files")
+            result = (coordinate_columns if columns else coordinate_rows)(
+                entry['labeled'], entry['first_coord_line'], request['labels'])
+        elif op == 'neighbors':
+            entry = store.get(request['file'])
+            result = (neighbor_columns if columns else neighbor_rows)(
+                entry['labeled'], store.search(entry), request['centers'], float(request['radius']))
+        elif op == 'compare':
+            result = (compare_columns if columns else compare_rows)(
+                store.get(request['file1'])['labeled'], store.get(request['file2'])['labeled'],
+                float(request['threshold']), request.get('selection'))
+        elif op == 'status':
+            result = {'pid': os.getpid(), 'size': store.size, 'files': list(store.entries)}
+        elif op == 'shutdown':
+            result = 'bye'
+        else:
+            raise ValueError("Unknown request {0}".format(op))
+        if columns and op in ('coordinates', 'neighbors', 'compare'):
+            result = {name: array.tolist() for name, array in result.items()}
+    except KeyError as error:
+        return {'error': error.args[0] if error.args else 'Missing key'}
+    except (ValueError, OSError) as error:
+        return {'error': str(error)}
+    return {'result': result}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One connection: one JSON request per line, one JSON response per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'error': 'Request is not JSON'}
+                request = {}
+            else:
+                response = handle(self.server.store, request)
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+            if request.get('op') == 'shutdown':
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+def serve(path=None, size=STORE_SIZE):
+    """Serve on a Unix socket until a shutdown request"""
+    path = path or socket_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    # Requests are answered one at a time, as neighbor searches grow their trees in place
+    server = socketserver.UnixStreamServer(path, _Handler)
+    server.store = StructureStore(size)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def serve_stdio(size=STORE_SIZE, in_file=sys.stdin, out_file=sys.stdout):
+    """Serve requests read from in_file, one JSON object per line"""
+    store = StructureStore(size)
+    for line in in_file:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request, response = {}, {'error': 'Request is not JSON'}
+        else:
+            response = handle(store, request)
+        out_file.write(json.dumps(response) + '\n')
+        out_file.flush()
+        if request.get('op') == 'shutdown':
+            return
+
+
+##############################################################################
+########## Client
+##############################################################################
+
+def query(request, path=None, timeout=CLIENT_TIMEOUT):
+    """
+    Send one request to the server.
+
+    output:
+    None if no server is running, so that the caller answers the request itself.
+    Otherwise the result of the request. Errors of the server are raised as ValueError
+    """
+    path = path or socket_path()
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    # Relative file names are resolved here, as the server runs elsewhere
+    for key in ('file', 'file1', 'file2'):
+        if key in request:
+            request[key] = os.path.abspath(request[key])
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall((json.dumps(request) + '\n').encode())
+            with client.makefile('r') as reader:
+                line = reader.readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+    response = json.loads(line)
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return response['result']
+
+
+if __name__ == '__main__':
+    options, commands = parse_options(sys.argv[1:], ('size', 'socket'))
+    commands = commands or ['status']
+    path = options.get('socket')
+    size = int(options.get('size', STORE_SIZE))
+    if commands[0] == 'start':
+        print("   Structure server is listening on {0}".format(path or socket_path()))
+        serve(path, size)
+    elif commands[0] == 'stdio':
+        serve_stdio(size)
+    elif commands[0] == 'stop':
+        print("   Server stopped" if query({'op': 'shutdown'}, path) else "   No server is running")
+    else:
+        status = query({'op': 'status'}, path)
+        if status is None:
+            print("   No server is running")
+        else:
+            print("   Server (pid {0}) keeps {1} of {2} structures".format(
+                status['pid'], len(status['files']), status['size']))
+            for filename in status['files']:
+                print("      {0}".format(filename))
@@ -0,0 +1,312 @@
+"""
+Supercells of a LabeledStructure from an integer transformation matrix.
+
+The sites are tiled by broadcasting the primitive coordinates against all
+lattice translations inside the supercell, with no loop over sites, so
+10x10x10 expansions of multi-atom cells take a fraction of a second.
+Atoms are grouped by element in order of first appearance, and all images
+of a primitive site are consecutive, as in the POSCAR files written by
+VESTA, so the labels of the supercell follow VESTA.
+"""
+
+from itertools import permutations, product
+
+import numpy as np
+
+from labeled_structure import LabeledStructure
+
+# Tolerance of fractional coordinates of lattice translations in the supercell
+FRAC_TOLERANCE = 1e-8
+# Number of (matrix, vector) pairs tested at once by image_distances
+CHUNK_SIZE = 1048576
+
+
+def parse_matrix(text):
+    """
+    input:
+    text: '2' for 2x2x2, '2,2,1' for a diagonal matrix, or nine integers
+        '2,0,0,0,2,0,0,0,1' (rows of the matrix)
+
+    output:
+    (3,3) integer array of the transformation matrix
+    """
+    values = [int(value) for value in text.replace(';', ',').replace('x', ',').split(',') if value.strip()]
+    if len(values) == 1:
+        matrix = np.eye(3, dtype=int) * values[0]
+    elif len(values) == 3:
+        matrix = np.diag(values)
+    elif len(values) == 9:
+        matrix = np.array(values).reshape(3, 3)
+    else:
+        raise ValueError("Supercell matrix needs 1, 3 or 9 integers, not {0}".format(text))
+    if round(abs(np.linalg.det(matrix))) == 0:
+        raise ValueError("Supercell matrix {0} is singular".format(text))
+    return matrix
+
+
+def lattice_translations(matrix):
+    """
+    input:
+    matrix: (3,3) integer transformation matrix, rows are the supercell
+        vectors in units of the primitive vectors
+
+    output:
+    (|det matrix|, 3) integer array of the primitive lattice translations
+    inside the supercell
+    """
+    matrix = np.asarray(matrix, dtype=int)
+    # Bounding box of the supercell in primitive units, from its 8 corners
+    corners = np.array(np.meshgrid([0, 1], [0, 1], [0, 1], indexing='ij')).reshape(3, -1).T @ matrix
+    ranges = [np.arange(low, high + 1) for low, high in zip(corners.min(axis=0), corners.max(axis=0))]
+    grid = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, 3)
+    frac = grid @ np.linalg.inv(matrix)
+    inside = np.all((frac > -FRAC_TOLERANCE) & (frac < 1 - FRAC_TOLERANCE), axis=1)
+    translations = grid[inside]
+    if len(translations) != round(abs(np.linalg.det(matrix))):
+        raise ValueError("Lattice translations of the supercell could not be found")
+    return translations
+
+
+def make_supercell(labeled, matrix):
+    """
+    input:
+    labeled: LabeledStructure of the primitive cell
+    matrix: (3,3) integer transformation matrix, [n1, n2, n3] for a diagonal,
+        or an integer n for n x n x n
+
+    output:
+    supercell: LabeledStructure of the supercell, with fractional
+        coordinates in [0, 1) and tiled selective dynamics flags and velocities
+    primitive_index: (N,) array, the primitive site of each supercell site
+    """
+    if np.ndim(matrix) < 2:
+        matrix = np.eye(3, dtype=int) * np.asarray(matrix, dtype=int)
+    matrix = np.asarray(matrix, dtype=int)
+    translations = lattice_translations(matrix)
+    num_images = len(translations)
+
+    # Primitive sites grouped by element, in order of first appearance
+    rank = {element: i for i, element in enumerate(labeled.elements)}
+    order = np.argsort([rank[element] for element in labeled.species.tolist()], kind='stable')
+
+    # (sites, images, 3): every image of a site next to each other
+    frac_coords = (labeled.frac_coords[order][:, None, :] + translations[None, :, :]) @ np.linalg.inv(matrix)
+    frac_coords = np.mod(frac_coords.reshape(-1, 3), 1.0)
+    frac_coords[frac_coords > 1 - FRAC_TOLERANCE] = 0.0
+    primitive_index = np.repeat(order, num_images)
+
+    selective_dynamics = None
+    if labeled.selective_dynamics is not None:
+        selective_dynamics = labeled.selective_dynamics[primitive_index]
+    velocities = None if labeled.velocities is None else labeled.velocities[primitive_index]
+    supercell = LabeledStructure(matrix @ labeled.lattice, labeled.species[primitive_index], frac_coords,
+                                 selective_dynamics=selective_dynamics, velocities=velocities,
+                                 comment=labeled.comment)
+    return supercell, primitive_index
+
+
+def keeps_symmetry(matrix, rotations):
+    """
+    input:
+    matrix: (3,3) integer transformation matrix
+    rotations: (M,3,3) rotations of the primitive cell in fractional
+        coordinates, from the symmetry dataset
+
+    output:
+    True if every rotation maps the supercell lattice onto itself, so that
+    equivalent sites of the primitive cell stay equivalent in the supercell
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    # Rotations in fractional coordinates of the supercell
+    rotations = np.linalg.inv(matrix).T @ np.asarray(rotations, dtype=float) @ matrix.T
+    return bool(np.allclose(rotations, np.round(rotations), atol=1e-6))
+
+
+def supercell_dataset(dataset, primitive_index):
+    """
+    Symmetry dataset of the primitive cell carried over to its supercell,
+    so that defects are grouped by the orbits of the primitive cell without
+    analyzing the (much larger) supercell. Only valid if keeps_symmetry is
+    True for the supercell matrix.
+
+    input:
+    dataset: symmetry dataset of the primitive cell, from symmetry.get_symmetry_dataset
+    primitive_index: (N,) array from make_supercell
+
+    output:
+    copy of dataset with 'wyckoffs' and 'equivalent_atoms' of the supercell
+    sites; the symmetry operations are still those of the primitive cell
+    """
+    # First supercell site of each primitive site
+    first = np.zeros(primitive_index.max() + 1, dtype=int)
+    first[primitive_index[::-1]] = np.arange(len(primitive_index))[::-1]
+    equivalent_atoms = first[np.asarray(dataset['equivalent_atoms'])[primitive_index]]
+    return dict(dataset, wyckoffs=np.asarray(dataset['wyckoffs'])[primitive_index].tolist(),
+                equivalent_atoms=equivalent_atoms.tolist())
+
+
+##############################################################################
+########## Screening of supercell matrices
+##############################################################################
+
+def hermite_normal_forms(determinant):
+    """
+    input:
+    determinant: number of primitive cells in the supercell
+
+    output:
+    (K,3,3) integer array of all lower-triangular Hermite normal forms
+    [[a,0,0],[b,c,0],[d,e,f]] with a*c*f = determinant, 0 <= b, d < a and
+    0 <= e < c; each distinct supercell lattice appears once
+    """
+    blocks = []
+    for a in range(1, determinant + 1):
+        if determinant % a:
+            continue
+        for c in range(1, determinant // a + 1):
+            if (determinant // a) % c:
+                continue
+            f = determinant // (a * c)
+            b, d, e = [values.ravel() for values in np.meshgrid(np.arange(a), np.arange(a), np.arange(c),
+                                                                indexing='ij')]
+            block = np.zeros((len(b), 3, 3), dtype=int)
+            block[:, 0, 0], block[:, 1, 1], block[:, 2, 2] = a, c, f
+            block[:, 1, 0], block[:, 2, 0], block[:, 2, 1] = b, d, e
+            blocks.append(block)
+    return np.concatenate(blocks)
+
+
+def image_distances(lattice, matrices):
+    """
+    Shortest nonzero lattice vector of each supercell, which is the distance
+    between a point defect and its nearest periodic image.
+
+    The primitive lattice vectors inside the bound of Hermite
+    (length <= 2^(1/6) V^(1/3) for a lattice of volume V) are listed once,
+    sorted by length, and the first of them that belongs to each supercell
+    lattice is found for all matrices together.
+
+    input:
+    lattice: (3,3) primitive lattice vectors in rows (angstrom)
+    matrices: (K,3,3) integer transformation matrices, all of the same determinant
+
+    output:
+    (K,) array of image distances (angstrom)
+    """
+    matrices = np.asarray(matrices, dtype=int)
+    determinant = int(round(abs(np.linalg.det(matrices[0]))))
+    radius = 2**(1/6) * (determinant * abs(np.linalg.det(lattice)))**(1/3) * (1 + 1e-6)
+    # Integer range of each axis that covers the sphere, from the reciprocal vector lengths
+    reach = np.ceil(radius * np.linalg.norm(np.linalg.inv(lattice), axis=0)).astype(int)
+    grid = np.stack(np.meshgrid(*[np.arange(-n, n + 1) for n in reach], indexing='ij'), axis=-1).reshape(-1, 3)
+    lengths = np.linalg.norm(grid @ lattice, axis=1)
+    keep = (lengths > 0) & (lengths <= radius)
+    order = np.argsort(lengths[keep], kind='stable')
+    vectors, lengths = grid[keep][order], lengths[keep][order]
+
+    # t is a supercell vector if t @ inv(M) is integer, i.e. t @ adj(M) = 0 mod det(M).
+    # Most supercells contain one of the first few vectors, so the vectors are tested in
+    # blocks of growing size, and only on the supercells whose vector is not found yet
+    adjugates = np.round(np.linalg.inv(matrices) * np.linalg.det(matrices)[:, None, None])
+    distances = np.full(len(matrices), np.nan)
+    remaining = np.arange(len(matrices))
+    start, size = 0, 16
+    while len(remaining) and start < len(vectors):
+        block = vectors[start:start + size].astype(float)
+        found = np.empty(0, dtype=int)
+        for chunk in range(0, len(remaining), max(1, CHUNK_SIZE // len(block))):
+            index = remaining[chunk:chunk + max(1, CHUNK_SIZE // len(block))]
+            member = np.all(np.mod(block @ adjugates[index], determinant) == 0, axis=2)
+            hit = member.any(axis=1)
+            distances[index[hit]] = lengths[start + np.argmax(member[hit], axis=1)]
+            found = np.append(found, index[hit])
+        remaining = np.setdiff1d(remaining, found)
+        start, size = start + size, 2 * size
+    return distances
+
+
+def reduce_matrix(matrix, lattice, delta=0.75):
+    """
+    LLL reduction of the supercell basis, so that the returned matrix
+    gives the same supercell with short, nearly orthogonal vectors.
+
+    input:
+    matrix: (3,3) integer transformation matrix
+    lattice: (3,3) primitive lattice vectors in rows (angstrom)
+
+    output:
+    (3,3) integer matrix with the same lattice, a positive determinant and
+    rows ordered to be as close to diagonal as possible
+    """
+    matrix = np.array(matrix, dtype=int)
+    k = 1
+    while k < 3:
+        basis = matrix @ lattice
+        # Gram-Schmidt of the current basis
+        ortho = basis.copy()
+        for i in range(3):
+            for j in range(i):
+                ortho[i] -= (basis[i] @ ortho[j]) / (ortho[j] @ ortho[j]) * ortho[j]
+        for j in range(k - 1, -1, -1):
+            mu = (matrix[k] @ lattice) @ ortho[j] / (ortho[j] @ ortho[j])
+            if abs(mu) > 0.5:
+                matrix[k] -= int(round(mu)) * matrix[j]
+        basis = matrix @ lattice
+        # Lovasz condition: projected = ortho[k] + mu_{k,k-1} * ortho[k-1], so that
+        # |projected|^2 >= delta * |ortho[k-1]|^2 is |ortho[k]|^2 >= (delta - mu^2) * |ortho[k-1]|^2
+        projected = basis[k] - sum((basis[k] @ ortho[j]) / (ortho[j] @ ortho[j]) * ortho[j] for j in range(k - 1))
+        if projected @ projected >= delta * (ortho[k - 1] @ ortho[k - 1]):
+            k += 1
+        else:
+            matrix[[k - 1, k]] = matrix[[k, k - 1]]
+            k = max(k - 1, 1)
+    # Rows ordered and signed to be as close to diagonal as possible, keeping det > 0
+    candidates = [np.array(signs)[:, None] * matrix[list(perm)]
+                  for perm in permutations(range(3)) for signs in product((1, -1), repeat=3)]
+    candidates = [candidate for candidate in candidates if np.linalg.det(candidate) > 0]
+    return max(candidates, key=lambda candidate: np.trace(candidate))
+
+
+def screen_supercells(lattice, num_sites, max_sites, min_sites=1):
+    """
+    Image distance of every supercell up to a size, and the Pareto-optimal
+    supercells, for which no smaller supercell has a longer image distance.
+
+    input:
+    lattice: (3,3) primitive lattice vectors in rows (angstrom)
+    num_sites: number of atoms in the primitive cell
+    max_sites, min_sites: range of the number of atoms of the supercells
+
+    output:
+    dict with keys
+        'matrices': (K,3,3) Hermite normal forms of all candidates
+        'num_sites': (K,) number of atoms
+        'image_distance': (K,) distance between a defect and its nearest image (angstrom)
+        'sphericity': (K,) image distance over its largest possible value
+            for the volume, 2^(1/6) V^(1/3) of the face-centered cubic lattice;
+            1 for the most compact supercells, small for slabs and needles
+        'pareto': indices of the Pareto-optimal candidates, by number of atoms,
+            with their matrices reduced in 'pareto_matrices'
+    """
+    volume = abs(np.linalg.det(lattice))
+    matrices, distances, determinants = [], [], []
+    for determinant in range(max(1, -(-min_sites // num_sites)), max_sites // num_sites + 1):
+        forms = hermite_normal_forms(determinant)
+        matrices.append(forms)
+        distances.append(image_distances(lattice, forms))
+        determinants.append(np.full(len(forms), determinant))
+    if not matrices:
+        raise ValueError("No supercell has between {0} and {1} atoms".format(min_sites, max_sites))
+    matrices, distances, determinants = np.concatenate(matrices), np.concatenate(distances), np.concatenate(determinants)
+    sphericity = distances / (2**(1/6) * (determinants * volume)**(1/3))
+
+    # Best candidate of each size, then those better than every smaller size
+    order = np.lexsort((-sphericity, -distances, determinants))
+    first = np.unique(determinants[order], return_index=True)[1]
+    best = order[first]
+    record = np.maximum.accumulate(distances[best])
+    improves = np.r_[True, distances[best][1:] > record[:-1] + 1e-6]
+    pareto = best[improves]
+    return {'matrices': matrices, 'num_sites': determinants * num_sites, 'image_distance': distances,
+            'sphericity': sphericity, 'pareto': pareto,
+            'pareto_matrices': np.array([reduce_matrix(matrices[i], lattice) for i in pareto])}
@@ -0,0 +1,132 @@
+"""
+Symmetry analysis with spglib, cached in memory and on disk.
+
+Results are keyed by a content hash of the lattice, species and rounded
+fractional coordinates together with symprec and angle_tolerance, so the
+same host structure is analyzed only once, whatever its file name. The
+full dataset is kept (space group, Wyckoff letters, equivalent atoms and
+symmetry operations), not just the symbol.
+
+The disk cache is in $DEFECT_TOOL_CACHE_DIR/symmetry, or
+~/.cache/defect_calc_tool/symmetry when the variable is not set.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# Number of datasets kept in memory
+LRU_SIZE = 64
+# Decimals of fractional coordinates and lattice used in the hash
+KEY_DECIMALS = 6
+
+_memory_cache = OrderedDict()
+
+
+def cache_dir():
+    """Directory of the on-disk symmetry cache"""
+    base = os.environ.get('DEFECT_TOOL_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'defect_calc_tool'))
+    return os.path.join(base, 'symmetry')
+
+
+def symmetry_key(labeled, symprec, angle_tolerance):
+    """
+    input:
+    labeled: LabeledStructure
+    symprec, angle_tolerance: tolerances of spglib
+
+    output:
+    hex string of the content hash
+    """
+    frac_coords = np.round(np.mod(labeled.frac_coords, 1.0), KEY_DECIMALS)
+    # Coordinates rounded up to 1.0 are the same as 0.0
+    frac_coords[frac_coords == 1.0] = 0.0
+    digest = hashlib.sha256()
+    digest.update(np.round(labeled.lattice, KEY_DECIMALS).tobytes())
+    digest.update('\n'.join(labeled.species.tolist()).encode())
+    digest.update(frac_coords.tobytes())
+    digest.update('{0!r} {1!r}'.format(float(symprec), float(angle_tolerance)).encode())
+    return digest.hexdigest()
+
+
+def _get(dataset, name):
+    """spglib >= 2.5 returns an object, older versions return a dict"""
+    return getattr(dataset, name) if hasattr(dataset, name) else dataset[name]
+
+
+def _analyze(labeled, symprec, angle_tolerance):
+    """Run spglib and convert its dataset to a JSON-compatible dict"""
+    import spglib
+    _, numbers = np.unique(labeled.species, return_inverse=True)
+    dataset = spglib.get_symmetry_dataset((labeled.lattice, labeled.frac_coords, numbers),
+                                          symprec=symprec, angle_tolerance=angle_tolerance)
+    if dataset is None:
+        raise ValueError("Symmetry analysis failed with symprec={0}".format(symprec))
+    return {'number': int(_get(dataset, 'number')),
+            'international': str(_get(dataset, 'international')),
+            'hall': str(_get(dataset, 'hall')),
+            'pointgroup': str(_get(dataset, 'pointgroup')),
+            'wyckoffs': [str(letter) for letter in _get(dataset, 'wyckoffs')],
+            'equivalent_atoms': np.asarray(_get(dataset, 'equivalent_atoms')).tolist(),
+            'rotations': np.asarray(_get(dataset, 'rotations')).tolist(),
+            'translations': np.asarray(_get(dataset, 'translations')).tolist(),
+            'symprec': symprec, 'angle_tolerance': angle_tolerance}
+
+
+def get_symmetry_dataset(labeled, symprec=1e-2, angle_tolerance=0.1, disk_cache=True):
+    """
+    input:
+    labeled: LabeledStructure
+    symprec, angle_tolerance: tolerances of spglib (same defaults as perturb.py)
+    disk_cache: also look up and store the result on disk.
+        Use False for one-off structures such as random perturbations
+
+    output:
+    dict with keys 'number', 'international', 'hall', 'pointgroup',
+    'wyckoffs', 'equivalent_atoms', 'rotations', 'translations'
+    """
+    key = symmetry_key(labeled, symprec, angle_tolerance)
+    if key in _memory_cache:
+        _memory_cache.move_to_end(key)
+        return _memory_cache[key]
+
+    filename = os.path.join(cache_dir(), key + '.json')
+    dataset = None
+    if disk_cache and os.path.isfile(filename):
+        try:
+            with open(filename, 'r') as cache_file:
+                dataset = json.load(cache_file)
+        except (OSError, ValueError):
+            dataset = None
+    if dataset is None:
+        dataset = _analyze(labeled, symprec, angle_tolerance)
+        if disk_cache:
+            try:
+                os.makedirs(cache_dir(), exist_ok=True)
+                # Written to a temporary file first so that readers never see half a file
+                temp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+                with open(temp_filename, 'w') as cache_file:
+                    json.dump(dataset, cache_file)
+                os.replace(temp_filename, filename)
+            except OSError:
+                pass
+
+    _memory_cache[key] = dataset
+    if len(_memory_cache) > LRU_SIZE:
+        _memory_cache.popitem(last=False)
+    return dataset
+
+
+def get_space_group_info(labeled, symprec=1e-2, angle_tolerance=0.1, disk_cache=True):
+    """
+    Same as pymatgen Structure.get_space_group_info, with caching.
+
+    output:
+    (international symbol, space group number), ex) ('P3_221', 154)
+    """
+    dataset = get_symmetry_dataset(labeled, symprec, angle_tolerance, disk_cache)
+    return dataset['international'], dataset['number']
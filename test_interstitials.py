@@ -0,0 +1,45 @@
+"""
+Tests of interstitials.py. Run with: python -m pytest -q
+"""
+
+import numpy as np
+import pytest
+
+from labeled_structure import LabeledStructure
+from interstitials import grid_maxima, find_interstitials
+from symmetry import get_symmetry_dataset
+
+# Conventional cell of diamond Si: tetrahedral (8) and hexagonal (16) sites
+SILICON_FRAC_COORDS = np.array([[0, 0, 0], [0, 0.5, 0.5], [0.5, 0, 0.5], [0.5, 0.5, 0],
+                                [0.25, 0.25, 0.25], [0.25, 0.75, 0.75],
+                                [0.75, 0.25, 0.75], [0.75, 0.75, 0.25]])
+
+
+@pytest.fixture
+def silicon():
+    return LabeledStructure(np.eye(3) * 5.43, ['Si'] * 8, SILICON_FRAC_COORDS)
+
+
+def test_plateau_is_one_maximum_at_its_center():
+    distance = np.zeros((8, 8, 8))
+    distance[3:5, 4, 4] = 1.0
+    assert np.allclose(grid_maxima(distance), [[3.5 / 8, 0.5, 0.5]])
+
+
+def test_flat_ridge_is_not_a_maximum():
+    # Equal points next to a larger one are the flat part of a slope
+    distance = np.zeros((8, 8, 8))
+    distance[2:5, 4, 4] = 1.0
+    distance[5, 4, 4] = 2.0
+    assert np.allclose(grid_maxima(distance), [[5 / 8, 0.5, 0.5]])
+
+
+@pytest.mark.parametrize('spacing', [0.15, 0.2, 0.25])
+def test_grid_and_voronoi_sites_agree(silicon, spacing):
+    dataset = get_symmetry_dataset(silicon, disk_cache=False)
+    voronoi = find_interstitials(silicon, dataset, method='voronoi')
+    grid = find_interstitials(silicon, dataset, method='grid', spacing=spacing)
+    assert np.array_equal(grid['multiplicity'], voronoi['multiplicity'])
+    assert list(voronoi['multiplicity']) == [8, 16]
+    # Distances of the grid maxima are close to the exact ones
+    assert np.allclose(grid['distance'], voronoi['distance'], atol=spacing * 0.1)
@@ -0,0 +1,36 @@
+"""
+Tests of selection.py. Run with: python -m pytest -q
+"""
+
+import numpy as np
+import pytest
+
+from labeled_structure import LabeledStructure
+from selection import tokenize, select_labels
+
+# Four atoms of a 4 angstrom cubic cell, one at the origin
+LATTICE = np.eye(3) * 4.0
+SPECIES = np.array(['Si', 'O', 'O', 'Si'])
+FRAC_COORDS = np.array([[0.0, 0.0, 0.0], [0.5, 0.0, 0.5], [0.25, 0.5, 0.9996], [0.5, 0.5, 0.75]])
+
+
+@pytest.fixture
+def labeled():
+    return LabeledStructure(LATTICE, SPECIES, FRAC_COORDS)
+
+
+def test_equal_is_one_token():
+    assert tokenize('x==0') == ['x', '==', '0']
+    assert tokenize('O* and z>=0.5') == ['O*', 'and', 'z', '>=', '0.5']
+
+
+@pytest.mark.parametrize('text, labels', [
+    ('x==0.5', ['O1', 'Si2']),
+    ('z==0', ['Si1', 'O2']),            # fractional coordinates are periodic
+    ('0.5==x', ['O1', 'Si2']),
+    ('cz==3', ['Si2']),
+    ('O* and z>=0.5', ['O1', 'O2']),
+    ('z<=0.5', ['Si1', 'O1']),
+])
+def test_comparisons(labeled, text, labels):
+    assert sorted(select_labels(labeled, text)) == sorted(labels)
@@ -0,0 +1,63 @@
+"""
+Tests of supercell.py. Run with: python -m pytest -q
+"""
+
+from itertools import product
+
+import numpy as np
+import pytest
+
+from supercell import hermite_normal_forms, image_distances, reduce_matrix
+
+# Number of sublattices of index n of a 3D lattice, sum over d|n of d*sigma(d)
+SUBLATTICE_COUNTS = {1: 1, 2: 7, 3: 13, 4: 35, 5: 31, 6: 91, 8: 155}
+
+
+def sublattice_key(matrix, determinant):
+    """
+    Sublattice spanned by the rows of matrix, as the set of its points modulo
+    determinant; it contains determinant * Z^3, so this set identifies it
+    """
+    coefficients = np.array(list(product(range(determinant), repeat=3)))
+    return frozenset(map(tuple, (coefficients @ matrix) % determinant))
+
+
+@pytest.mark.parametrize('determinant', sorted(SUBLATTICE_COUNTS))
+def test_hermite_normal_forms_cover_each_sublattice_once(determinant):
+    forms = hermite_normal_forms(determinant)
+    assert np.all(np.round(np.linalg.det(forms)) == determinant)
+    keys = {sublattice_key(form, determinant) for form in forms}
+    assert len(keys) == len(forms)
+    assert len(forms) == SUBLATTICE_COUNTS[determinant]
+
+
+def test_root3_cell_is_found():
+    # sqrt(3) x sqrt(3) x 1 cell of a hexagonal lattice, 3 primitive cells
+    a, c = 4.913, 5.405
+    lattice = np.array([[a, 0, 0], [-a/2, a*np.sqrt(3)/2, 0], [0, 0, c]])
+    forms = hermite_normal_forms(3)
+    keys = [sublattice_key(form, 3) for form in forms]
+    root3 = keys.index(sublattice_key(np.array([[2, 1, 0], [-1, 1, 0], [0, 0, 1]]), 3))
+    assert image_distances(lattice, forms)[root3] == pytest.approx(c)
+
+
+
+def test_reduce_matrix_of_skewed_basis():
+    # diag(2, 1, 1) supercell of a cubic lattice, given by long, nearly parallel vectors
+    skewed = np.array([[6, -5, 3], [2, -5, 4], [2, -6, 5]])
+    assert round(abs(np.linalg.det(skewed))) == 2
+    assert np.array_equal(reduce_matrix(skewed, np.eye(3)), np.diag([2, 1, 1]))
+
+
+def test_reduce_matrix_keeps_the_supercell():
+    a, c = 4.913, 5.405
+    lattice = np.array([[a, 0, 0], [-a/2, a*np.sqrt(3)/2, 0], [0, 0, c]])
+    skewed = np.array([[7, 3, 2], [5, 2, 1], [-4, 9, 5]])
+    reduced = reduce_matrix(skewed, lattice)
+    assert round(np.linalg.det(reduced)) == round(abs(np.linalg.det(skewed)))
+    # Each basis is an integer combination of the other
+    transform = skewed @ np.linalg.inv(reduced)
+    assert np.allclose(transform, np.round(transform))
+    # Orthogonality defect of an LLL basis with delta = 0.75 is at most 2**(3/2)
+    volume = abs(np.linalg.det(reduced @ lattice))
+    assert np.prod(np.linalg.norm(reduced @ lattice, axis=1)) <= 2**1.5 * volume